@@ -1,16 +1,86 @@
 import tkinter as tk
 from tkinter import messagebox, ttk
 import threading
+import time
+from collections import deque
 import sys, pathlib
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
 
 from config_utils import load_config
-from main import scanner_worker, network_monitor_worker
+import log_config
+import metrics
+import runtime
+import scan_stats
 from speaker import SpeakerService
-from sql_connection import db_flush_worker, stop_event
-import pyautogui
+from connectivity import ConnectivityMonitor
+from sql_connection import flush_status, spool_backlog_bytes, stop_event
+
+STOP_TIMEOUT_SEC = 10.0
+
+
+class ScanAccumulator:
+    """
+    Collects scan notifications from the runtime's scan thread. The Tk loop drains it
+    at a fixed rate, so a burst of scans costs one label update per frame.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_entry_no = None
+        self._last_barcode = None
+        self._invalid = None
+
+    def add(self, entry_no, barcode) -> None:
+        with self._lock:
+            self._pending += 1
+            self._last_entry_no = entry_no
+            self._last_barcode = barcode
+
+    def drain(self):
+        """Return (new_scans, last_entry_no, last_barcode) and reset the new-scan count."""
+        with self._lock:
+            pending, self._pending = self._pending, 0
+            return pending, self._last_entry_no, self._last_barcode
+
+    def add_invalid(self, entry_no, barcode, problem) -> None:
+        with self._lock:
+            self._invalid = (entry_no, barcode, problem)
+
+    def drain_invalid(self):
+        """Return the latest (entry_no, barcode, problem) that failed the label check, or None."""
+        with self._lock:
+            invalid, self._invalid = self._invalid, None
+            return invalid
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending = 0
+            self._last_entry_no = None
+            self._last_barcode = None
+            self._invalid = None
+
+
+def _format_age(seconds) -> str:
+    if seconds is None:
+        return "never"
+    if seconds < 60:
+        return f"{int(seconds)}s ago"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m ago"
+    return f"{int(seconds // 3600)}h ago"
+
+
+def _format_scanner(summary: dict) -> str:
+    """One scanner's shift line: rate, key timing, resets and unparsed label dates."""
+    gaps = summary["key_gap_ms"]
+    p50 = "-" if gaps["p50"] is None else f"{gaps['p50']:g}"
+    p99 = "-" if gaps["p99"] is None else f"{gaps['p99']:g}"
+    share = summary["date_failure_share"]
+    return (f"{summary['scanner']}: {summary['scans_per_min']:.0f}/min, key gap p50 {p50} / p99 {p99} ms, "
+            f"resets {sum(summary['resets'].values())}, bad dates {'-' if share is None else f'{share:.1%}'}, "
+            f"human {summary['human_sequences']}")
 
-screen_width, screen_height = pyautogui.size()
 
 class ScannerUI:
     def __init__(self, root):
@@ -95,7 +165,21 @@ class ScannerUI:
             padx=12,
             pady=10,
         )
-        self.last_label.pack(pady=(0, 16), fill=tk.X)
+        self.last_label.pack(pady=(0, 8), fill=tk.X)
+
+        self.stats_text = tk.StringVar(value="")
+        self.stats_label = tk.Label(
+            container,
+            textvariable=self.stats_text,
+            font=("Segoe UI", 10),
+            bg="#111827",
+            fg="#9ca3af",
+            anchor="w",
+            justify=tk.LEFT,
+            padx=12,
+            pady=6,
+        )
+        self.stats_label.pack(pady=(0, 16), fill=tk.X)
 
         btns = ttk.Frame(container, style="TFrame")
         btns.pack()
@@ -109,34 +193,39 @@ class ScannerUI:
 
         # Wiring
         self.config = load_config()
+        log_config.setup_logging(self.config)
         self.speaker = SpeakerService(self.config, stop_event)
-        self.speaker.start()
-        self.db_thread = threading.Thread(target=db_flush_worker, args=(self.config, self.speaker), daemon=True)
-        self.db_thread.start()
-        self.scan_thread = None
-        self.net_thread = None
+        self.connectivity = ConnectivityMonitor(self.config)
+        self.connectivity.subscribe(self.speaker.on_connectivity_change)
+        self.connectivity.subscribe(metrics.on_connectivity_change)
+        metrics.start_metrics_server(self.config)
+        # Flushing, probes, timers, config reloads and alerts run from the start;
+        # Start and Stop switch the runtime's capture task.
+        self.runtime, self.runtime_thread = runtime.start_thread(
+            self.config, flush=True, speaker=self.speaker, connectivity=self.connectivity,
+            on_scan=self._on_scan, on_invalid=self._on_invalid)
+
+        self.accumulator = ScanAccumulator()
+        # (monotonic time, total count) per refresh tick over the last minute
+        self.rate_window = deque()
+        self._displayed = None
+        self.root.after(self.refresh_ms, self._refresh)
 
     def start_scanning(self):
         if self.running:
             return
         if not messagebox.askyesno("Start Scanning", "Are you sure you want to start scanning?"):
             return
-        stop_event.clear()
         self.running = True
         self.count = 0
+        self.accumulator.reset()
+        self.rate_window.clear()
         self.live_count.set("Live Count: 0")
         self.last_barcode.set("Last Barcode: -")
         self.start_button.state(["disabled"])
         self.stop_button.state(["!disabled"])
 
-        self.scan_thread = threading.Thread(target=scanner_worker,
-                                            args=(self.config, self.speaker, self._on_scan),
-                                            daemon=True)
-        self.scan_thread.start()
-        self.net_thread = threading.Thread(target=network_monitor_worker,
-                                           args=(self.config, self.speaker),
-                                           daemon=True)
-        self.net_thread.start()
+        self.runtime.start_capture()
 
     def stop_scanning(self):
         if not self.running:
@@ -144,31 +233,75 @@ class ScannerUI:
         if not messagebox.askyesno("Stop Scanning", "Are you sure you want to stop scanning?"):
             return
         self.running = False
-        
+        self.runtime.stop_capture()
         self.start_button.state(["!disabled"])
         self.stop_button.state(["disabled"])
 
     def _on_scan(self, entry_no, barcode):
-        self.count += 1
-        self.root.after(0, self._update_labels, self.count, barcode)
+        # Runs on the runtime's scan thread: never touch Tk here.
+        self.accumulator.add(entry_no, barcode)
+
+    def _on_invalid(self, entry_no, barcode, problem):
+        # Scan thread as well; the label turns red on the next refresh.
+        self.accumulator.add_invalid(entry_no, barcode, problem)
+
+    @property
+    def refresh_ms(self) -> int:
+        return max(20, int(1000 / max(self.config.latest().ui_refresh_hz, 1)))
+
+    def _refresh(self):
+        try:
+            new_scans, _, barcode = self.accumulator.drain()
+            if new_scans:
+                self.count += new_scans
+                self.live_count.set(f"Live Count: {self.count}")
+                self.last_barcode.set(f"Last Barcode: {barcode}")
+                self.last_label.configure(bg="#111827")
+            invalid = self.accumulator.drain_invalid()
+            if invalid is not None:
+                _, invalid_barcode, problem = invalid
+                self.last_barcode.set(f"CHECK LABEL ({problem.replace('_', ' ')}): {invalid_barcode}")
+                self.last_label.configure(bg="#b91c1c")
+
+            now = time.monotonic()
+            self.rate_window.append((now, self.count))
+            while len(self.rate_window) > 1 and now - self.rate_window[0][0] > 60:
+                self.rate_window.popleft()
+            first_time, first_count = self.rate_window[0]
+            elapsed = now - first_time
+            rate = (self.count - first_count) * 60 / elapsed if elapsed >= 1 else 0.0
+
+            backlog_bytes = spool_backlog_bytes(self.config, flush_status.offset)
+            backlog_records = flush_status.backlog_records()
+            flush_age = None
+            if flush_status.last_flush_time is not None:
+                flush_age = time.time() - flush_status.last_flush_time
 
-    def _update_labels(self, count_value, barcode):
-        self.live_count.set(f"Live Count: {count_value}")
-        self.last_barcode.set(f"Last Barcode: {barcode}")
+            text = (
+                f"Scans/min: {rate:.0f}    DB: {self.connectivity.state}\n"
+                f"Spool backlog: {'-' if backlog_records is None else backlog_records} rec / "
+                f"{'-' if backlog_bytes is None else backlog_bytes} B\n"
+                f"Last DB flush: {_format_age(flush_age)}"
+            )
+            for summary in scan_stats.stats.status().values():
+                text += "\n" + _format_scanner(summary)
+            if text != self._displayed:
+                self.stats_text.set(text)
+                self._displayed = text
+        finally:
+            self.root.after(self.refresh_ms, self._refresh)
 
     def on_close(self):
         if messagebox.askyesno("Quit", "Stop scanning and exit?"):
             self.running = False
-            stop_event.set()
-            try:
-                self.speaker.cleanup()
-            except Exception:
-                pass
+            # The runtime closes connectivity and the speaker, and the flusher writes its checkpoint.
+            self.runtime.request_stop()
+            self.runtime_thread.join(STOP_TIMEOUT_SEC)
             self.root.destroy()
 
 def main():
     root = tk.Tk()
-    root.geometry("420x260")
+    root.geometry("420x330")
     app = ScannerUI(root)
     root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
@@ -0,0 +1,376 @@
+"""
+Reproducible benchmarks for the capture -> parse -> spool -> flush pipeline.
+
+    python benchmarks/run_benchmarks.py                     # all, JSON to benchmarks/results/
+    python benchmarks/run_benchmarks.py --only spool --quick
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json
+
+Results include a machine profile so runs are only compared on like
+hardware (same Pi model, same SD card class). The macro benchmark drives
+the real KeyFramer/ScanPipeline and db_flush_worker against
+benchmarks/sql_standin.py.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+import sql_connection
+from config_utils import Config, compile_config
+from scan_record import COLUMNS
+import sql_standin
+import synthetic
+from capture import KeyFramer, ScanPipeline, fetch_barcode_segments, format_parent_child_record, keycode_to_char, split_parent_barcode
+
+RESULTS_DIR = BENCH_DIR / "results"
+BENCHMARKS = {}
+
+
+def benchmark(name: str, group: str):
+    def register(fn):
+        BENCHMARKS[name] = (group, fn)
+        return fn
+    return register
+
+
+def machine_profile() -> dict:
+    profile = {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        with open("/proc/device-tree/model", "r") as f:
+            profile["board"] = f.read().strip("\x00\n ")
+    except OSError:
+        pass
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.lower().startswith(("model name", "hardware")):
+                    profile["cpu"] = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    try:
+        with open("/proc/meminfo", "r") as f:
+            profile["mem_total_kb"] = int(f.readline().split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return profile
+
+
+def measure(fn, iterations: int, repeat: int = 5, ops_per_call: int = 1) -> dict:
+    """Time `fn` `iterations` times per round; per-op figures from the rounds' per-call samples."""
+    samples = []
+    for _ in range(repeat):
+        for _ in range(iterations):
+            t0 = time.perf_counter_ns()
+            fn()
+            samples.append((time.perf_counter_ns() - t0) / ops_per_call)
+    samples.sort()
+    total_s = sum(samples) / 1e9
+    return {
+        "ops": len(samples) * ops_per_call,
+        "ops_per_sec": round(len(samples) / total_s, 1) if total_s else None,
+        "mean_us": round(statistics.fmean(samples) / 1000, 3),
+        "p50_us": round(samples[len(samples) // 2] / 1000, 3),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000, 3),
+    }
+
+
+def _barcodes(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    return [synthetic.raw_barcode(rng) for _ in range(n)]
+
+
+def _spool_config(tmp: str, **extra) -> Config:
+    config = {
+        "Device_id": "BENCH",
+        "Table_name": "Bench_Scanning_Data",
+        "user_id": "bench",
+        "state_file": os.path.join(tmp, "state.json"),
+        "spool_file": os.path.join(tmp, "spool.jsonl"),
+        "spool_offset_file": os.path.join(tmp, "spool.offset"),
+        "scan_log_max_per_sec": 1,
+    }
+    config.update(extra)
+    return compile_config(config)
+
+
+@benchmark("keycode_to_char", "capture")
+def bench_keycode_to_char(args) -> dict:
+    keycodes = [k for b in _barcodes(50) for k in synthetic.keycodes_for(b)]
+    def run():
+        for k in keycodes:
+            keycode_to_char(k, False)
+    return measure(run, args.iterations // 10 or 1, ops_per_call=len(keycodes))
+
+
+@benchmark("key_framing", "capture")
+def bench_key_framing(args) -> dict:
+    keycodes = [k for b in _barcodes(50) for k in synthetic.keycodes_for(b)]
+    def run():
+        framer = KeyFramer()
+        for k in keycodes:
+            framer.feed(k)
+    return measure(run, args.iterations // 10 or 1, ops_per_call=len(keycodes))
+
+
+@benchmark("evdev_categorize", "capture")
+def bench_evdev_categorize(args) -> dict | None:
+    try:
+        from evdev import InputEvent, categorize, ecodes
+    except ImportError:
+        return None
+    events = [InputEvent(0, 0, ecodes.EV_KEY, ecodes.ecodes[k], 1)
+              for b in _barcodes(50) for k in synthetic.keycodes_for(b)]
+    def run():
+        for e in events:
+            categorize(e).keycode
+    return measure(run, args.iterations // 10 or 1, ops_per_call=len(events))
+
+
+@benchmark("parse_barcode", "parse")
+def bench_parse(args) -> dict:
+    barcodes = _barcodes(200)
+    def run():
+        for raw in barcodes:
+            formatted = format_parent_child_record(raw)
+            fetch_barcode_segments(split_parent_barcode(formatted))
+    return measure(run, args.iterations // 20 or 1, ops_per_call=len(barcodes))
+
+
+def _bench_append(args, **durability) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        config = _spool_config(tmp, **durability)
+        pipeline = ScanPipeline(config, "/dev/input/bench")
+        records = [pipeline.build_record(b, None, time.monotonic_ns()) for b in _barcodes(200)]
+        it = iter(range(10**9))
+        def run():
+            sql_connection.append_spool(config, records[next(it) % len(records)])
+        return measure(run, args.iterations)
+
+
+@benchmark("append_spool_fsync", "spool")
+def bench_append_fsync(args) -> dict:
+    return _bench_append(args, spool_fsync=True)
+
+
+@benchmark("append_spool_nofsync", "spool")
+def bench_append_nofsync(args) -> dict:
+    return _bench_append(args, spool_fsync=False)
+
+
+@benchmark("spool_read_batch", "flush")
+def bench_spool_read(args) -> dict:
+    n = 5000 if args.quick else 20000
+    with tempfile.TemporaryDirectory() as tmp:
+        config = _spool_config(tmp, spool_fsync=False)
+        pipeline = ScanPipeline(config, "/dev/input/bench")
+        for i, b in enumerate(_barcodes(n)):
+            rec = pipeline.build_record(b, None, time.monotonic_ns())._replace(EntryNo=i)
+            sql_connection.append_spool(config, rec)
+        def run():
+            batch, _ = sql_connection.read_spool_batch(config.spool_file, 0)
+            assert len(batch) == n
+        result = measure(run, 1, repeat=5, ops_per_call=n)
+        result["records_per_call"] = n
+        return result
+
+
+def _run_pipeline(args, scans: int, **extra) -> dict:
+    """Synthetic key events -> KeyFramer -> ScanPipeline -> spool -> db_flush_worker -> stand-in."""
+    with tempfile.TemporaryDirectory() as tmp:
+        config = _spool_config(
+            tmp,
+            sql_connection_string=f"DRIVER={{standin}};DATABASE={os.path.join(tmp, 'db.sqlite')}",
+            db_flush_interval_sec=0.05,
+            connectivity_probe_enabled=False,
+            **extra,
+        )
+        sql_connection.pyodbc = sql_standin
+        sql_connection.flush_status = sql_connection.FlushStatus()
+        sql_connection.stop_event.clear()
+
+        keycodes = [synthetic.keycodes_for(b) for b in _barcodes(scans, seed=7)]
+        framer = KeyFramer()
+        pipeline = ScanPipeline(config, "/dev/input/bench")
+        flusher = threading.Thread(target=sql_connection.db_flush_worker, args=(config,), daemon=True)
+        flusher.start()
+
+        t0 = time.perf_counter()
+        for codes in keycodes:
+            for k in codes:
+                frame = framer.feed(k)
+                if frame is not None:
+                    pipeline.accept(*frame)
+        captured = time.perf_counter()
+        deadline = captured + 120
+        while sql_connection.flush_status.rows_flushed < scans and time.perf_counter() < deadline:
+            time.sleep(0.005)
+        done = time.perf_counter()
+        sql_connection.stop_event.set()
+        flusher.join(timeout=10)
+
+        return {
+            "scans": scans,
+            "rows_flushed": sql_connection.flush_status.rows_flushed,
+            "capture_scans_per_sec": round(scans / (captured - t0), 1),
+            "end_to_end_scans_per_sec": round(scans / (done - t0), 1),
+            "drain_after_capture_s": round(done - captured, 3),
+            "total_s": round(done - t0, 3),
+        }
+
+
+@benchmark("pipeline_fsync", "macro")
+def bench_pipeline_fsync(args) -> dict:
+    return _run_pipeline(args, 500 if args.quick else 2000, spool_fsync=True)
+
+
+@benchmark("pipeline_nofsync_latency5ms", "macro")
+def bench_pipeline_latency(args) -> dict:
+    sql_standin.set_latency_ms(5)
+    try:
+        return _run_pipeline(args, 500 if args.quick else 2000, spool_fsync=False)
+    finally:
+        sql_standin.set_latency_ms(0)
+
+
+def _schema_table(tmp: str, optimized: bool, rows: int):
+    """A stand-in table with the default or optimized schema and `rows` synthetic scans."""
+    conn = sql_standin.connect(f"DATABASE={os.path.join(tmp, 'schema.sqlite')}")
+    table = "Bench_Optimized" if optimized else "Bench_Default"
+    sql_connection.ensure_table_exists(conn, table, optimized)
+    pipeline = ScanPipeline(_spool_config(tmp), "/dev/input/bench")
+    rng = random.Random(11)
+    columns = ", ".join(COLUMNS)
+    insert_sql = f"INSERT INTO [{table}] ({columns}) VALUES ({', '.join('?' * len(COLUMNS))})"
+    records = [pipeline.build_record(synthetic.raw_barcode(rng), None, 0)._replace(EntryNo=i) for i in range(rows)]
+    t0 = time.perf_counter()
+    cur = conn.cursor()
+    for rec in records:
+        cur.execute(insert_sql, *rec.params())
+    conn.commit()
+    insert_s = time.perf_counter() - t0
+    return conn, table, records, insert_s
+
+
+def _bench_schema(args, optimized: bool) -> dict:
+    rows = 20000 if args.quick else 100000
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, table, records, insert_s = _schema_table(tmp, optimized, rows)
+        rng = random.Random(5)
+        probes = [records[rng.randrange(rows)] for _ in range(200)]
+        it = iter(range(10**9))
+        def by_flight():
+            rec = probes[next(it) % len(probes)]
+            conn.execute(f"SELECT ContainerCode, COUNT(*) FROM [{table}] WHERE OrderDate = ? AND FlightNo = ? "
+                         f"GROUP BY ContainerCode", rec.OrderDate, rec.FlightNo).fetchall()
+        def by_container():
+            rec = probes[next(it) % len(probes)]
+            conn.execute(f"SELECT OrderDate, FlightNo FROM [{table}] WHERE ContainerCode = ?",
+                         rec.ContainerCode).fetchall()
+        result = {
+            "rows": rows,
+            "insert_rows_per_sec": round(rows / insert_s, 1),
+            "by_orderdate_flight": measure(by_flight, 20 if args.quick else 100, repeat=3),
+            "by_container": measure(by_container, 20 if args.quick else 100, repeat=3),
+        }
+        conn.close()
+        result["ops_per_sec"] = result["by_orderdate_flight"]["ops_per_sec"]
+        return result
+
+
+@benchmark("schema_default", "schema")
+def bench_schema_default(args) -> dict:
+    return _bench_schema(args, optimized=False)
+
+
+@benchmark("schema_optimized", "schema")
+def bench_schema_optimized(args) -> dict:
+    return _bench_schema(args, optimized=True)
+
+
+def _headline(result: dict):
+    for key in ("ops_per_sec", "end_to_end_scans_per_sec"):
+        if result.get(key):
+            return key, result[key]
+    return None, None
+
+
+def compare(current: dict, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("profile", {}).get("board") != current["profile"].get("board"):
+        print("warning: baseline was recorded on different hardware")
+    regressions = 0
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        key, new_value = _headline(result)
+        old_value = old.get(key) if key else None
+        if not new_value or not old_value:
+            continue
+        change = (new_value - old_value) / old_value
+        flag = "REGRESSION" if change < -threshold else ""
+        regressions += bool(flag)
+        print(f"{name:<32}{key:<26}{old_value:>12}{new_value:>12}{change:>+9.1%} {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scanning pipeline benchmarks")
+    parser.add_argument("--only", action="append", help="benchmark name or group (repeatable)")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--quick", action="store_true", help="smaller macro runs")
+    parser.add_argument("--output", help="result JSON path (default benchmarks/results/...)")
+    parser.add_argument("--compare", help="baseline result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="regression threshold (fraction)")
+    args = parser.parse_args()
+    if args.quick:
+        args.iterations = min(args.iterations, 200)
+
+    results = {}
+    for name, (group, fn) in BENCHMARKS.items():
+        if args.only and name not in args.only and group not in args.only:
+            continue
+        print(f"running {name} ...", flush=True)
+        result = fn(args)
+        if result is None:
+            print(f"  skipped (dependency missing)")
+            continue
+        result["group"] = group
+        results[name] = result
+        print("  " + json.dumps(result))
+
+    report = {"profile": machine_profile(), "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    output = args.output
+    if not output:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"bench-{report['profile']['hostname']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        sys.exit(1 if compare(report, args.compare, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""
+Soak test: the unmodified service under synthetic scanner load for hours.
+
+    sudo python benchmarks/soak.py --hours 4 --rate 40 --burst 0.1 --misread 0.02
+    sudo python benchmarks/soak.py --minutes 30 --process-mode multi --spool-rotate-bytes 1000000
+
+A uinput virtual keyboard types synthetic parent/child barcodes (see
+synthetic.py) at --rate scans/min with bursts, misreads, empty Enters and
+repeated labels mixed in. main.py runs as a subprocess on a throwaway
+config: its scanner device is the virtual keyboard and its "pyodbc" is
+sql_standin, through a shim module on PYTHONPATH, so supervised children
+get it too.
+
+Every --sample-sec the harness records RSS, CPU time, open fds and
+threads of the service's process tree, spool and log size, rows committed,
+and scan -> DB commit latency (each typed scan is timed until its row is
+in the stand-in). It also reads the service's diagnostics status.
+
+After --warmup-min, the run fails when:
+
+    RSS grows faster than --max-rss-mb-per-hour (least-squares slope)
+    open fds grow by more than --max-fd-growth
+    p95 commit latency in the last quarter exceeds --max-latency-s, or is
+        --max-latency-growth times the first quarter's
+    CPU seconds per scan in the last quarter are --max-cpu-growth times
+        the first quarter's (an ever-growing re-read shows up here)
+    rows are still missing --drain-sec after typing stops
+
+Samples and the verdict go to benchmarks/results/soak-<time>.json.
+Needs python-evdev and write access to /dev/uinput.
+"""
+import argparse
+import json
+import os
+import pathlib
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+import synthetic
+
+RESULTS_DIR = BENCH_DIR / "results"
+TABLE = "Soak_Scanning_Data"
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+class VirtualScanner:
+    """A uinput keyboard that types like a keyboard-wedge scanner."""
+
+    def __init__(self, name: str = "soak-virtual-scanner"):
+        from evdev import UInput, ecodes
+
+        self.ecodes = ecodes
+        keys = [code for name, code in ecodes.ecodes.items() if name.startswith("KEY_") and code < 256]
+        self.ui = UInput({ecodes.EV_KEY: sorted(set(keys))}, name=name)
+        self.path = self.ui.device.path
+
+    def type(self, keycodes: list, key_delay: float) -> None:
+        ecodes = self.ecodes
+        for name in keycodes:
+            code = ecodes.ecodes[name]
+            self.ui.write(ecodes.EV_KEY, code, 1)
+            self.ui.syn()
+            self.ui.write(ecodes.EV_KEY, code, 0)
+            self.ui.syn()
+            if key_delay:
+                time.sleep(key_delay)
+
+    def close(self) -> None:
+        self.ui.close()
+
+
+class LoadGenerator(threading.Thread):
+    """Types scans until `deadline`; sent[i] is when the i-th row-producing scan hit Enter."""
+
+    def __init__(self, scanner: VirtualScanner, args, deadline: float):
+        super().__init__(name="load", daemon=True)
+        self.scanner = scanner
+        self.args = args
+        self.deadline = deadline
+        self.rng = random.Random(args.seed)
+        self.sent = []
+        self.counts = {"scans": 0, "misreads": 0, "empty": 0, "repeats": 0}
+        self.stop = threading.Event()
+
+    def _next_gap(self) -> float:
+        return self.rng.expovariate(self.args.rate / 60.0)
+
+    def _scan(self, last: str | None) -> str | None:
+        roll = self.rng.random()
+        args = self.args
+        if roll < args.empty:
+            self.counts["empty"] += 1
+            return None
+        roll -= args.empty
+        if roll < args.repeat and last:
+            self.counts["repeats"] += 1
+            return last
+        roll -= args.repeat
+        barcode = synthetic.raw_barcode(self.rng)
+        if roll < args.misread:
+            self.counts["misreads"] += 1
+            barcode = synthetic.corrupt(barcode, self.rng)
+        return barcode
+
+    def run(self) -> None:
+        last = None
+        while time.monotonic() < self.deadline and not self.stop.is_set():
+            burst = self.rng.randint(3, 12) if self.rng.random() < self.args.burst else 1
+            for _ in range(burst):
+                barcode = self._scan(last)
+                if barcode is None:
+                    self.scanner.type(["KEY_ENTER"], 0)
+                else:
+                    self.scanner.type(synthetic.keycodes_for(barcode), self.args.key_delay_ms / 1000.0)
+                    self.sent.append(time.monotonic())
+                    self.counts["scans"] += 1
+                    last = barcode
+                if burst > 1:
+                    time.sleep(self.rng.uniform(0.2, 0.6))
+            self.stop.wait(self._next_gap())
+
+
+class CommitWatcher(threading.Thread):
+    """Polls the stand-in database; rows commit in EntryNo order, so row k is scan k."""
+
+    def __init__(self, db_path: str, sent: list, interval: float = 0.25):
+        super().__init__(name="commit_watch", daemon=True)
+        self.db_path = db_path
+        self.sent = sent
+        self.interval = interval
+        self.committed = 0
+        self.latencies = []   # (commit monotonic time, latency seconds)
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop.wait(self.interval):
+            try:
+                db = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=1)
+                try:
+                    (count,) = db.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                continue
+            now = time.monotonic()
+            for k in range(self.committed, min(count, len(self.sent))):
+                self.latencies.append((now, now - self.sent[k]))
+            self.committed = max(self.committed, count)
+
+
+def _process_tree(root_pid: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, ()))
+    return tree
+
+
+def _proc_sample(pid: int) -> dict | None:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status", "r") as f:
+            rss_kb = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except (OSError, ValueError, StopIteration):
+        return None
+    return {
+        "cpu_s": (int(fields[11]) + int(fields[12])) / CLK_TCK,
+        "threads": int(fields[17]),
+        "rss_mb": rss_kb / 1024.0,
+        "fds": fds,
+    }
+
+
+def _diagnostics_status(socket_path: str) -> dict:
+    """Merged status of the service's diagnostics socket(s); supervised children add a .name suffix."""
+    status = {}
+    base = pathlib.Path(socket_path)
+    for path in [base] + sorted(base.parent.glob(base.name + ".*")):
+        if not path.exists():
+            continue
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(2)
+                s.connect(str(path))
+                s.sendall(b"status\n")
+                data = b""
+                while chunk := s.recv(65536):
+                    data += chunk
+            status.update(json.loads(data.decode("utf-8")))
+        except (OSError, ValueError):
+            continue
+    return status
+
+
+def _dir_size(path: pathlib.Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) if path.exists() else 0
+
+
+def _slope_per_hour(points: list) -> float:
+    """Least-squares slope of (seconds, value) points, per hour."""
+    if len(points) < 3:
+        return 0.0
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var * 3600.0
+
+
+def _p95(values: list) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def write_workdir(args, scanner_path: str) -> tuple[pathlib.Path, dict]:
+    work = pathlib.Path(tempfile.mkdtemp(prefix="soak-"))
+    shim = work / "shim"
+    shim.mkdir()
+    (shim / "pyodbc.py").write_text(
+        "# Soak harness: the service's pyodbc is the sqlite stand-in.\n"
+        "from sql_standin import *  # noqa: F401,F403\n",
+        encoding="utf-8",
+    )
+    config = {
+        "Device_id": "SOAK",
+        "user_id": "soak",
+        "Table_name": TABLE,
+        "Starting_entry_no": 1,
+        "Summary_post_entry": 1 if args.summary else 0,
+        "db_save_interval": args.flush_interval,
+        "sql_connection_string": f"DRIVER={{standin}};DATABASE={work / 'db.sqlite'}",
+        "log_file_path": str(work / "logs" / "scan_data.log"),
+        "state_file": str(work / "state" / "scanner_state.json"),
+        "spool_file": str(work / "state" / "spool_data.jsonl"),
+        "spool_offset_file": str(work / "state" / "spool.offset"),
+        "archive_dir": str(work / "archive"),
+        "spool_rotate_bytes": args.spool_rotate_bytes,
+        "scanner_input_device": scanner_path,
+        "SPEAKER_ENABLED": args.speaker,
+        "diagnostics_socket": str(work / "diag.sock"),
+        "diagnostics_dir": str(work / "diagnostics"),
+        "process_mode": args.process_mode,
+    }
+    config.update(json.loads(args.config_override or "{}"))
+    (work / "config.json").write_text(json.dumps(config, indent=2), encoding="utf-8")
+    return work, config
+
+
+def evaluate(samples: list, latencies: list, args, started: float, missing: int) -> list:
+    """Threshold failures, as human-readable strings."""
+    failures = []
+    warm = [s for s in samples if s["t"] >= args.warmup_min * 60]
+    if len(warm) < 4:
+        return [f"only {len(warm)} samples after warmup; run longer or lower --sample-sec"]
+
+    rss_slope = _slope_per_hour([(s["t"], s["rss_mb"]) for s in warm])
+    if rss_slope > args.max_rss_mb_per_hour:
+        failures.append(f"RSS grows {rss_slope:.1f} MB/h (limit {args.max_rss_mb_per_hour})")
+    fd_growth = warm[-1]["fds"] - warm[0]["fds"]
+    if fd_growth > args.max_fd_growth:
+        failures.append(f"open fds grew by {fd_growth} (limit {args.max_fd_growth})")
+
+    quarter = max(1, len(warm) // 4)
+    first, last = warm[:quarter + 1], warm[-quarter - 1:]
+
+    def cpu_per_scan(window):
+        scans = window[-1]["committed"] - window[0]["committed"]
+        return (window[-1]["cpu_s"] - window[0]["cpu_s"]) / scans if scans > 0 else None
+
+    first_cpu, last_cpu = cpu_per_scan(first), cpu_per_scan(last)
+    if first_cpu and last_cpu and last_cpu > first_cpu * args.max_cpu_growth:
+        failures.append(f"CPU per scan rose {last_cpu / first_cpu:.2f}x "
+                        f"({first_cpu * 1000:.2f} -> {last_cpu * 1000:.2f} ms; limit {args.max_cpu_growth}x)")
+
+    def latency_p95(window):
+        lo, hi = started + window[0]["t"], started + window[-1]["t"]
+        return _p95([lat for at, lat in latencies if lo <= at <= hi])
+
+    first_lat, last_lat = latency_p95(first), latency_p95(last)
+    if last_lat is not None and last_lat > args.max_latency_s:
+        failures.append(f"p95 commit latency {last_lat:.2f}s in the last quarter (limit {args.max_latency_s}s)")
+    if first_lat and last_lat and last_lat > max(first_lat * args.max_latency_growth, args.flush_interval * 2):
+        failures.append(f"p95 commit latency rose {first_lat:.2f}s -> {last_lat:.2f}s "
+                        f"(limit {args.max_latency_growth}x)")
+    if missing:
+        failures.append(f"{missing} scans not committed {args.drain_sec}s after typing stopped")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the scanning service with a virtual scanner")
+    duration = parser.add_mutually_exclusive_group()
+    duration.add_argument("--hours", type=float)
+    duration.add_argument("--minutes", type=float, default=30.0)
+    parser.add_argument("--rate", type=float, default=30.0, help="mean scans per minute")
+    parser.add_argument("--burst", type=float, default=0.1, help="probability a scan starts a burst of 3-12")
+    parser.add_argument("--misread", type=float, default=0.02, help="share of scans with dropped characters")
+    parser.add_argument("--empty", type=float, default=0.01, help="share of bare Enter presses")
+    parser.add_argument("--repeat", type=float, default=0.02, help="share of scans repeating the previous label")
+    parser.add_argument("--key-delay-ms", type=float, default=1.0, help="delay between key events")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--process-mode", choices=("threads", "multi"), default="threads")
+    parser.add_argument("--summary", action="store_true", help="Summary_post_entry table")
+    parser.add_argument("--speaker", action="store_true", help="leave voice alerts enabled")
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--spool-rotate-bytes", type=int, default=0)
+    parser.add_argument("--config-override", help="JSON object merged into the generated config")
+    parser.add_argument("--sample-sec", type=float, default=30.0)
+    parser.add_argument("--warmup-min", type=float, default=5.0)
+    parser.add_argument("--drain-sec", type=float, default=60.0)
+    parser.add_argument("--max-rss-mb-per-hour", type=float, default=5.0)
+    parser.add_argument("--max-fd-growth", type=int, default=8)
+    parser.add_argument("--max-cpu-growth", type=float, default=1.5)
+    parser.add_argument("--max-latency-s", type=float, default=10.0)
+    parser.add_argument("--max-latency-growth", type=float, default=2.0)
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--output", help="result JSON path (default benchmarks/results/soak-<time>.json)")
+    args = parser.parse_args()
+    run_sec = (args.hours * 3600) if args.hours else args.minutes * 60
+
+    scanner = VirtualScanner()
+    work, config = write_workdir(args, scanner.path)
+    env = dict(os.environ, SCANNING_CONFIG=str(work / "config.json"),
+               PYTHONPATH=os.pathsep.join([str(work / "shim"), str(BENCH_DIR), os.environ.get("PYTHONPATH", "")]))
+    print(f"work dir {work}; virtual scanner {scanner.path}")
+
+    service_log = open(work / "service.out", "wb")
+    service = subprocess.Popen([sys.executable, str(REPO_DIR / "main.py")], cwd=str(REPO_DIR), env=env,
+                               stdout=service_log, stderr=subprocess.STDOUT)
+    time.sleep(3)  # let the scanner thread open the device before typing
+
+    started = time.monotonic()
+    load = LoadGenerator(scanner, args, started + run_sec)
+    watcher = CommitWatcher(str(work / "db.sqlite"), load.sent)
+    load.start()
+    watcher.start()
+
+    samples = []
+    state_dir, log_dir = pathlib.Path(config["spool_file"]).parent, pathlib.Path(config["log_file_path"]).parent
+    try:
+        while service.poll() is None:
+            now = time.monotonic()
+            typing = load.is_alive()
+            drained = watcher.committed >= len(load.sent)
+            if not typing and (drained or now - load.deadline > args.drain_sec):
+                break
+            procs = [p for p in map(_proc_sample, _process_tree(service.pid)) if p]
+            status = _diagnostics_status(config["diagnostics_socket"])
+            sample = {
+                "t": round(now - started, 1),
+                "rss_mb": round(sum(p["rss_mb"] for p in procs), 2),
+                "cpu_s": round(sum(p["cpu_s"] for p in procs), 2),
+                "fds": sum(p["fds"] for p in procs),
+                "threads": sum(p["threads"] for p in procs),
+                "processes": len(procs),
+                "sent": len(load.sent),
+                "committed": watcher.committed,
+                "spool_bytes": _dir_size(state_dir),
+                "log_bytes": _dir_size(log_dir),
+                "status": {k: status[k] for k in ("speaker_queue", "log_queue", "spool_backlog_records") if k in status},
+            }
+            window = [lat for at, lat in watcher.latencies if at >= now - args.sample_sec]
+            sample["latency_p95_s"] = _p95(window)
+            samples.append(sample)
+            print(json.dumps({k: v for k, v in sample.items() if k != "status"} | sample["status"]), flush=True)
+            time.sleep(args.sample_sec)
+    except KeyboardInterrupt:
+        load.stop.set()
+    finally:
+        load.stop.set()
+        watcher.stop.set()
+        exit_code = service.poll()
+        if exit_code is None:
+            service.send_signal(signal.SIGINT)
+            try:
+                service.wait(15)
+            except subprocess.TimeoutExpired:
+                service.kill()
+                service.wait()
+        service_log.close()
+        scanner.close()
+
+    missing = max(0, len(load.sent) - watcher.committed)
+    failures = evaluate(samples, watcher.latencies, args, started, missing)
+    if exit_code is not None:
+        failures.insert(0, f"service exited early with code {exit_code} (see {work / 'service.out'})")
+    result = {
+        "args": vars(args),
+        "load": load.counts,
+        "committed": watcher.committed,
+        "samples": samples,
+        "failures": failures,
+        "passed": not failures,
+    }
+    RESULTS_DIR.mkdir(exist_ok=True)
+    out = pathlib.Path(args.output or RESULTS_DIR / f"soak-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+    print(f"\n{load.counts['scans']} scans typed, {watcher.committed} committed; results in {out}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("PASS")
+    if not args.keep and not failures:
+        shutil.rmtree(work, ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
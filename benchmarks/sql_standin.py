@@ -0,0 +1,232 @@
+"""
+pyodbc-compatible stand-in for SQL Server backed by sqlite3.
+
+It understands the T-SQL the service emits (OBJECT_ID, INFORMATION_SCHEMA
+column checks, sys.indexes lookups, IDENTITY/NVARCHAR(MAX)/CLUSTERED/INCLUDE
+DDL) well enough to run the real flush path locally. ALTER COLUMN, DROP
+CONSTRAINT, columnstore indexes and locking table hints are ignored, and the
+reconciler's HASHBYTES row hash becomes a Python function with the same
+result. Use it as a connection string in config.json:
+
+    "sql_connection_string": "DRIVER={standin};DATABASE=/tmp/scans.db"
+
+or install it as the `pyodbc` module (benchmarks do this with
+sys.modules["pyodbc"] = sql_standin). SQL_STANDIN_LATENCY_MS adds a fixed
+delay per execute/commit to mimic a network round trip.
+"""
+import datetime as _dt
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+apilevel = "2.0"
+threadsafety = 1
+paramstyle = "qmark"
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+_latency = float(os.environ.get("SQL_STANDIN_LATENCY_MS", "0")) / 1000.0
+
+
+def set_latency_ms(ms: float) -> None:
+    global _latency
+    _latency = ms / 1000.0
+
+
+def drivers() -> list:
+    return ["standin"]
+
+
+def _table_param(value: str) -> str:
+    return str(value).split(".")[-1].strip("[]")
+
+
+_DDL_REWRITES = [
+    (re.compile(r"\bBIGINT\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)(\s+NOT\s+NULL)?", re.I), "INTEGER"),
+    (re.compile(r"\bIDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)", re.I), ""),
+    (re.compile(r"\bN?VARCHAR\s*\(\s*MAX\s*\)", re.I), "TEXT"),
+    (re.compile(r"\bNONCLUSTERED\b", re.I), ""),
+    (re.compile(r"\bCLUSTERED\b", re.I), ""),
+    (re.compile(r"\)\s*INCLUDE\s*\([^)]*\)", re.I), ")"),
+    (re.compile(r"\)\s*WITH\s*\([^)]*\)", re.I), ")"),
+    (re.compile(r"\)\s*ON\s*\[[^\]]+\]\s*(\(\s*\w+\s*\))?\s*$", re.I), ")"),
+]
+
+# DDL sqlite cannot express; the stand-in accepts it and does nothing.
+_NOOP_DDL = re.compile(
+    r"^\s*(ALTER\s+TABLE\s+\S+\s+(ALTER\s+COLUMN|DROP\s+CONSTRAINT)|CREATE\s+(CLUSTERED\s+)?COLUMNSTORE\s+INDEX)\b",
+    re.I,
+)
+
+_SYS_INDEX_EXISTS = re.compile(
+    r"^\s*SELECT\s+1\s+FROM\s+sys\.indexes\s+WHERE\s+name\s*=\s*\?\s+AND\s+object_id\s*=\s*OBJECT_ID\(\?\)\s*$", re.I)
+_SYS_PRIMARY_KEY = re.compile(
+    r"^\s*SELECT\s+name,\s*type_desc\s+FROM\s+sys\.indexes\s+WHERE\s+object_id\s*=\s*OBJECT_ID\(\?\)\s+AND\s+is_primary_key\s*=\s*1\s*$", re.I)
+_COLUMN_LENGTH = re.compile(
+    r"^\s*SELECT\s+CHARACTER_MAXIMUM_LENGTH\s+FROM\s+INFORMATION_SCHEMA\.COLUMNS\s+WHERE\s+TABLE_NAME\s*=\s*\?\s+AND\s+COLUMN_NAME\s*=\s*\?\s*$", re.I)
+_SCHEMA_PREFIX = re.compile(r"\[[^\]]+\]\.(?=\[)")
+# CAST(CONVERT(INT, SUBSTRING(HASHBYTES('MD5', CONCAT(a, N'|', b)), 1, 4)) AS BIGINT)
+_ROW_HASH = re.compile(
+    r"CAST\(\s*CONVERT\(\s*INT\s*,\s*SUBSTRING\(\s*HASHBYTES\(\s*'MD5'\s*,\s*CONCAT\(\s*(\w+)\s*,\s*N?'\|'\s*,\s*(\w+)\s*\)\s*\)"
+    r"\s*,\s*1\s*,\s*4\s*\)\s*\)\s+AS\s+BIGINT\s*\)", re.I)
+_TABLE_HINTS = re.compile(r"\s+WITH\s*\(\s*(?:UPDLOCK|SERIALIZABLE|HOLDLOCK|ROWLOCK)(?:\s*,\s*(?:UPDLOCK|SERIALIZABLE|HOLDLOCK|ROWLOCK))*\s*\)", re.I)
+_OBJECT_ID = re.compile(r"^\s*SELECT\s+OBJECT_ID\s*\(\s*\?\s*,\s*'U'\s*\)\s*$", re.I)
+_INFO_COLUMNS = re.compile(
+    r"^\s*SELECT\s+1\s+FROM\s+INFORMATION_SCHEMA\.COLUMNS\s+WHERE\s+TABLE_NAME\s*=\s*\?\s+AND\s+COLUMN_NAME\s*=\s*'(\w+)'\s*$",
+    re.I,
+)
+
+
+def translate(sql: str, params: tuple) -> tuple[str, tuple]:
+    """Rewrite the T-SQL subset used by the service into sqlite SQL."""
+    m = _OBJECT_ID.match(sql)
+    if m:
+        return ("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (_table_param(params[0]),))
+    m = _INFO_COLUMNS.match(sql)
+    if m:
+        return ("SELECT 1 FROM pragma_table_info(?) WHERE name = ?",
+                (_table_param(params[0]), m.group(1)))
+    if _SYS_INDEX_EXISTS.match(sql):
+        return ("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ? AND tbl_name = ?",
+                (params[0], _table_param(params[1])))
+    if _SYS_PRIMARY_KEY.match(sql):
+        return ("SELECT name, 'CLUSTERED' FROM pragma_index_list(?) WHERE origin = 'pk'", (_table_param(params[0]),))
+    if _COLUMN_LENGTH.match(sql):
+        return ("SELECT CASE WHEN upper(type) = 'TEXT' THEN -1 ELSE CAST(substr(type, instr(type, '(') + 1) AS INTEGER) END "
+                "FROM pragma_table_info(?) WHERE name = ?", (_table_param(params[0]), params[1]))
+    if _NOOP_DDL.match(sql):
+        return "SELECT 1", ()
+    # sqlite has no schemas: [dbo].[Table] -> [Table]
+    sql = _SCHEMA_PREFIX.sub("", sql)
+    sql = re.sub(r"\bLEN\(", "LENGTH(", sql, flags=re.I)
+    sql = _ROW_HASH.sub(r"md5_int4(\1, \2)", sql)
+    sql = _TABLE_HINTS.sub("", sql)
+    if re.match(r"^\s*(CREATE|ALTER)\s", sql, re.I):
+        for pattern, repl in _DDL_REWRITES:
+            sql = pattern.sub(repl, sql)
+    return sql, params
+
+
+def _md5_int4(a, b) -> int:
+    # NVARCHAR CONCAT hashes UTF-16LE; NULL concatenates as ''.
+    text = f"{'' if a is None else a}|{'' if b is None else b}"
+    return int.from_bytes(hashlib.md5(text.encode("utf-16-le")).digest()[:4], "big", signed=True)
+
+
+def _adapt(value):
+    if isinstance(value, _dt.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (_dt.date, _dt.time)):
+        return value.isoformat()
+    return value
+
+
+class Cursor:
+    def __init__(self, conn: "Connection"):
+        self._conn = conn
+        self._cur = conn._db.cursor()
+        self.rowcount = -1
+
+    def execute(self, sql: str, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        sql, params = translate(sql, tuple(_adapt(p) for p in params))
+        if _latency:
+            time.sleep(_latency)
+        try:
+            with self._conn._lock:
+                self._cur.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        except sqlite3.OperationalError as e:
+            raise OperationalError(str(e)) from e
+        except sqlite3.Error as e:
+            raise ProgrammingError(str(e)) from e
+        self.rowcount = self._cur.rowcount
+        return self
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def executemany(self, sql: str, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, *params)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, size: int = 1):
+        return self._cur.fetchmany(size)
+
+    def close(self) -> None:
+        self._cur.close()
+
+
+class Connection:
+    def __init__(self, path: str, autocommit: bool = False):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30,
+                                   isolation_level=None if autocommit else "DEFERRED")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.create_function("md5_int4", 2, _md5_int4, deterministic=True)
+        self._lock = threading.Lock()
+        self.autocommit = autocommit
+
+    def cursor(self) -> Cursor:
+        return Cursor(self)
+
+    def execute(self, sql: str, *params) -> Cursor:
+        return self.cursor().execute(sql, *params)
+
+    def commit(self) -> None:
+        if _latency:
+            time.sleep(_latency)
+        self._db.commit()
+
+    def rollback(self) -> None:
+        self._db.rollback()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _parse_connection_string(connection_string: str) -> dict:
+    parts = {}
+    for item in connection_string.split(";"):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            parts[k.strip().upper()] = v.strip()
+    return parts
+
+
+def connect(connection_string: str = "", autocommit: bool = False, **kwargs) -> Connection:
+    parts = _parse_connection_string(connection_string)
+    path = parts.get("DATABASE") or os.environ.get("SQL_STANDIN_DB") or ":memory:"
+    return Connection(path, autocommit=autocommit)
@@ -0,0 +1,63 @@
+"""Synthetic barcodes and key streams shaped like real parent/child labels."""
+import random
+
+CLASSES = ("F", "C", "Y")
+CHILD_PREFIXES = ("EB", "DPD", "DG", "DPF")
+
+
+def parent_barcode(rng: random.Random) -> str:
+    day = rng.randint(1, 28)
+    month = rng.randint(1, 12)
+    return "-".join([
+        str(rng.randint(100, 199)),
+        f"Ba{rng.randint(1, 9999):04d}",
+        f"{day:02d}.{month:02d}.25",
+        rng.choice(CLASSES),
+        str(rng.randint(1, 3)),
+        f"G{rng.randint(1, 9)}",
+        str(rng.randint(1, 20)),
+        f"Dasu{rng.randint(100, 999)}",
+        "Hnd",
+        str(rng.randint(100, 999)),
+    ])
+
+
+def raw_barcode(rng: random.Random, max_children: int = 10) -> str:
+    """Parent label optionally followed by child items as the scanner emits them."""
+    parent = parent_barcode(rng)
+    children = rng.randint(0, max_children)
+    if not children:
+        return parent
+    items = "".join(
+        f"{rng.choice(CHILD_PREFIXES)}{rng.randint(10, 9999)}-{rng.randint(1, 16)}"
+        for _ in range(children)
+    )
+    return f"{parent}-{items}"
+
+
+def corrupt(barcode: str, rng: random.Random) -> str:
+    """A misread: drop a few characters, typically breaking the date segment."""
+    chars = list(barcode)
+    for _ in range(rng.randint(1, 3)):
+        if len(chars) > 1:
+            del chars[rng.randrange(len(chars))]
+    return "".join(chars)
+
+
+_SPECIAL_KEYS = {"-": "KEY_MINUS", ".": "KEY_DOT", "=": "KEY_EQUAL", " ": "KEY_SPACE", "/": "KEY_SLASH"}
+
+
+def keycodes_for(text: str) -> list:
+    """Key-down keycodes a keyboard-wedge scanner sends for `text`, Enter included."""
+    out = []
+    for ch in text:
+        if ch.isalpha():
+            if ch.isupper():
+                out.append("KEY_LEFTSHIFT")
+            out.append(f"KEY_{ch.upper()}")
+        elif ch.isdigit():
+            out.append(f"KEY_{ch}")
+        elif ch in _SPECIAL_KEYS:
+            out.append(_SPECIAL_KEYS[ch])
+    out.append("KEY_ENTER")
+    return out
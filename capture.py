@@ -0,0 +1,314 @@
+"""
+Capture: keycodes to barcodes to spool records.
+
+KeyFramer turns key-down keycodes into framed barcodes and ScanPipeline
+parses, spools, counts and validates each one. Both are driven by the
+runtime's scan task; main.py is only the entry point.
+"""
+import logging
+import os
+import re
+from datetime import date, datetime
+
+import log_config
+import master_data
+import metrics
+import scan_stats
+import scan_trace
+import startup_timing
+from config_utils import Config
+from scan_record import ScanRecord
+from scanner_device_resolver import resolve_user
+from sql_connection import append_spool, load_entry_no, log, save_entry_no, spool_fsync_enabled, trace_table_name
+
+logger = logging.getLogger("scanner_service")
+
+# EntryNos reserved per fsynced state_file write while spool_fsync is off.
+ENTRY_NO_RESERVE = 100
+
+KEYMAP = {
+    "KEY_0": "0", "KEY_1": "1", "KEY_2": "2", "KEY_3": "3", "KEY_4": "4",
+    "KEY_5": "5", "KEY_6": "6", "KEY_7": "7", "KEY_8": "8", "KEY_9": "9",
+    "KEY_A": "a", "KEY_B": "b", "KEY_C": "c", "KEY_D": "d", "KEY_E": "e",
+    "KEY_F": "f", "KEY_G": "g", "KEY_H": "h", "KEY_I": "i", "KEY_J": "j",
+    "KEY_K": "k", "KEY_L": "l", "KEY_M": "m", "KEY_N": "n", "KEY_O": "o",
+    "KEY_P": "p", "KEY_Q": "q", "KEY_R": "r", "KEY_S": "s", "KEY_T": "t",
+    "KEY_U": "u", "KEY_V": "v", "KEY_W": "w", "KEY_X": "x", "KEY_Y": "y",
+    "KEY_Z": "z",
+    "KEY_MINUS": "-",
+    "KEY_EQUAL": "=",
+    "KEY_SPACE": " ",
+    "KEY_SLASH": "/",
+    "KEY_DOT": ".",
+}
+
+def keycode_to_char(keycode:str, shift:bool) -> str:
+    """convert a keycode like 'KEY_A' to 'a' or 'A' ."""
+    character = KEYMAP.get(keycode, "")
+    if not character:
+        return ""
+    if character.isalpha():
+        return character.upper() if shift else character.lower()
+    return character
+
+def format_parent_child_record(raw_barcode: str) -> str:
+    raw = raw_barcode.strip()  
+    start = re.search(
+        r"-(?=[A-Za-z]{2,}\d+-\d+[A-Za-z]{2,}\d+-\d+)",
+        raw,
+        flags=re.IGNORECASE,
+    )
+    if not start:
+        return raw.rstrip("-").strip()
+
+    parent_code = raw[:start.start()].rstrip("- ").strip()
+
+    child_code = raw[start.start():].lstrip("- ")
+    child_code = child_code.replace("~", "|")
+    child_code = re.sub(r"(\d)(?=[A-Za-z]{2,}\d+-\d+)", r"\1|", child_code, flags=re.IGNORECASE)
+
+    formatted_children = []
+    for token in child_code.split("|"):
+        token = token.strip("- ").strip()
+        mm = re.fullmatch(r"([A-Za-z]{2,}\d+)-(\d+)", token, flags=re.IGNORECASE)
+        if mm:
+            item, qty = mm.group(1).upper(), mm.group(2)
+            formatted_children.append(f"{item}_{qty}")
+
+    return parent_code if not formatted_children else f"{parent_code} [{'|'.join(formatted_children)}]"
+
+def fetch_barcode_segments(parent_barcode: str) -> dict:
+    segments = parent_barcode.split('-')
+    output = {
+        "Stowage": None,
+        "FlightNo": None,
+        "OrderDate": None,
+        "DACS_CLASS": None,
+        "Leg": None,
+        "Gally": None,
+        "BlockNo": None,
+        "ContainerCode": None,
+        "DES": None,
+        "DACS_ACType": None,        
+    }
+
+    if len(segments) >= 1: output["Stowage"] = segments[0]
+    if len(segments) >= 2: output["FlightNo"] = segments[1]
+    if len(segments) >= 3: 
+        try:
+            dd, mm, yy = segments[2].split('.')
+            yy = int(yy)
+            yyyy = 2000 + yy if yy <= 79 else 1900 + yy
+            output["OrderDate"] = date(yyyy, int(mm), int(dd)).isoformat()
+        except Exception: 
+            output["OrderDate"] = None
+    if len(segments) >= 4: output["DACS_CLASS"] = segments[3]
+    if len(segments) >= 5: output["Leg"] = segments[4]  
+    if len(segments) >= 6: output["Gally"] = segments[5]
+    if len(segments) >= 7: output["BlockNo"] = segments[6]
+    if len(segments) >= 8: output["ContainerCode"] = segments[7]
+    if len(segments) >= 9: output["DES"] = segments[8]
+    if len(segments) >= 10: output["DACS_ACType"] = segments[9]
+
+    return output
+
+def split_parent_barcode(raw_barcode: str) -> str:
+    if "[" in raw_barcode:
+        return raw_barcode.split("[", 1)[0].strip()
+    return raw_barcode.strip()
+
+def format_children_in_brackets(raw_barcode: str) -> str:
+    return format_parent_child_record(raw_barcode)
+
+def split_parent_from_formatted(formatted_barcode: str) -> str:
+    return split_parent_barcode(formatted_barcode)
+
+def parse_parent_fields(parent_barcode: str) -> dict:
+    return fetch_barcode_segments(parent_barcode)
+
+
+class KeyFramer:
+    """
+    Frames key-down keycodes into barcodes. feed() returns
+    (raw_barcode, first_key_ns, enter_ns) when Enter completes a non-empty
+    barcode, otherwise None. With a scan_stats.ScannerSession every key is
+    timed and reported to it, and the session may drop the partial barcode
+    (a long gap) or the finished one (human input).
+    """
+
+    def __init__(self, session=None):
+        self.buffer = ""
+        self.shift = False
+        self.first_key_ns = None
+        self.last_key_ns = None
+        self.session = session
+
+    def feed(self, keycode: str):
+        if keycode in ("KEY_LEFTSHIFT", "KEY_RIGHTSHIFT"):
+            self.shift = True
+            return None
+
+        if keycode == "KEY_ENTER":
+            if not self.buffer:
+                return None
+            frame = (self.buffer, self.first_key_ns, scan_trace.now_ns())
+            self.buffer = ""
+            self.shift = False
+            if self.session is not None and not self.session.end_sequence():
+                return None
+            return frame
+
+        ch = keycode_to_char(keycode, self.shift)
+        if ch:
+            if self.session is None:
+                if not self.buffer:
+                    self.first_key_ns = scan_trace.now_ns()
+            else:
+                now = scan_trace.now_ns()
+                if self.buffer and not self.session.key(now - self.last_key_ns):
+                    self.buffer = ""
+                if not self.buffer:
+                    self.first_key_ns = now
+                self.last_key_ns = now
+            self.buffer += ch
+        self.shift = False
+        return None
+
+    def reset(self) -> None:
+        """Drop a partial barcode, e.g. when the device is reopened after an error."""
+        if self.buffer and self.session is not None:
+            self.session.discard("reopen")
+        self.buffer = ""
+        self.shift = False
+
+
+class ScanPipeline:
+    """Turns a framed barcode into a spool record: parse, spool, advance EntryNo, record stats, notify, validate."""
+
+    def __init__(self, config: Config, dev_path: str, on_scan=None, alerts=None, on_invalid=None):
+        self.config = config
+        self.on_scan = on_scan
+        self.alerts = alerts
+        self.on_invalid = on_invalid
+        self.device_id = config.device_id
+        resolved_user = resolve_user(config, dev_path)
+        self.scanner_name = resolved_user or os.path.basename(dev_path)
+        self.user_id = config.user_id or self.scanner_name
+        self.entry_no = load_entry_no(config)
+        self.reserved_entry_no = self.entry_no
+        self.session = scan_stats.stats.session(config, self.scanner_name)
+        # Stage stamps only go into the spool when something reads them (trace_table / trace_enabled).
+        self.tracing = trace_table_name(config) is not None
+        self.scan_log_limiter = self._make_limiter(config)
+
+    @staticmethod
+    def _make_limiter(config: Config) -> log_config.LogRateLimiter:
+        return log_config.LogRateLimiter(config.scan_log_max_per_sec, config.scan_log_burst)
+
+    def _refresh_config(self) -> Config:
+        """Pick up a hot-reloaded config; only the rate limiter depends on tunables."""
+        latest = self.config.latest()
+        if latest is not self.config:
+            if (latest.scan_log_max_per_sec, latest.scan_log_burst) != (
+                    self.config.scan_log_max_per_sec, self.config.scan_log_burst):
+                self.scan_log_limiter = self._make_limiter(latest)
+            self.config = latest
+        return latest
+
+    def build_record(self, raw_barcode: str, first_key_ns, enter_ns: int) -> ScanRecord:
+        barcode_formatted = format_children_in_brackets(raw_barcode)
+        parent_text = split_parent_from_formatted(barcode_formatted)
+        parent_fields = parse_parent_fields(parent_text)
+
+        now = datetime.now()
+        return ScanRecord(
+            self.device_id,
+            self.scanner_name,
+            self.entry_no,
+            barcode_formatted,
+            now.date().isoformat(),
+            now.time().strftime("%H:%M:%S"),
+            self.user_id or self.scanner_name,
+            **parent_fields,
+            Trace=scan_trace.new_trace(first_key_ns, enter_ns) if self.tracing else None,
+        )
+
+    def accept(self, raw_barcode: str, first_key_ns, enter_ns: int) -> ScanRecord:
+        config = self._refresh_config()
+        entry_no = self.entry_no
+        if first_key_ns is not None:
+            metrics.KEY_TO_ENTER.observe((enter_ns - first_key_ns) / 1e9)
+
+        if config.spool_file and not spool_fsync_enabled(config) and entry_no >= self.reserved_entry_no:
+            self._reserve_entry_nos(config)
+
+        rec = self.build_record(raw_barcode, first_key_ns, enter_ns)
+        barcode_formatted = rec.Barcode
+
+        append_spool(config, rec)
+        spool_latency = (scan_trace.now_ns() - enter_ns) / 1e9
+        metrics.ENTER_TO_SPOOL.observe(spool_latency)
+        metrics.SCANS.inc()
+        self.session.scan(rec)
+        if not config.spool_file:
+            # With a spool, the spool tail (or the reserved block) is what the next start recovers EntryNo from.
+            save_entry_no(config, entry_no + 1)
+
+        allowed, suppressed = self.scan_log_limiter.allow()
+        if allowed:
+            note = f" ({suppressed} scan lines suppressed)" if suppressed else ""
+            log(config, f"SCAN saved to spool: EntryNo={entry_no} Barcode={barcode_formatted}{note}",
+                EntryNo=entry_no, Barcode=barcode_formatted,
+                spool_latency_ms=round(spool_latency * 1000, 2), suppressed=suppressed)
+        startup_timing.report_startup(config, "first_scan")
+
+        if self.on_scan:
+            try:
+                
+                try:
+                    self.on_scan(entry_no, barcode_formatted)
+                except TypeError:
+                    self.on_scan(entry_no)
+            except Exception as ex:
+                log(config, f"on_scan callback failed: {ex}")
+        self.entry_no += 1
+        self._validate(config, rec)
+        return rec
+
+    def _reserve_entry_nos(self, config: Config) -> None:
+        """
+        An unsynced spool line can vanish on power loss, and its EntryNo
+        would be handed out again. Reserve the next block durably first;
+        a crash then skips the rest of it.
+        """
+        self.reserved_entry_no = self.entry_no + ENTRY_NO_RESERVE
+        save_entry_no(config, self.reserved_entry_no, fsync=True)
+
+    def _validate(self, config: Config, rec: ScanRecord) -> None:
+        """Check the parsed label against cached master data; the record is already spooled."""
+        problem = master_data.cache.validate(config, rec)
+        if problem is None:
+            return
+        log(config, f"Label check failed ({problem}): EntryNo={rec.EntryNo} Barcode={rec.Barcode}",
+            EntryNo=rec.EntryNo, problem=problem, FlightNo=rec.FlightNo, OrderDate=rec.OrderDate,
+            ContainerCode=rec.ContainerCode)
+        if self.alerts is not None:
+            self.alerts.enqueue("invalid_label")
+        if self.on_invalid:
+            try:
+                self.on_invalid(rec.EntryNo, rec.Barcode, problem)
+            except Exception as ex:
+                log(config, f"on_invalid callback failed: {ex}")
+
+
+def key_down_code(event, categorize, ecodes):
+    """The keycode of an evdev key-down event, or None for anything else."""
+    if event.type != ecodes.EV_KEY:
+        return None
+    key_event = categorize(event)
+    if key_event.keystate != key_event.key_down:
+        return None
+    keycode = key_event.keycode
+    if isinstance(keycode, list):
+        keycode = keycode[0]
+    return keycode
@@ -0,0 +1,306 @@
+"""
+The flusher's checkpoint: spool offset and next EntryNo in one record, flight totals beside it.
+
+Previously the capture path rewrote state_file (temp file + rename) on every
+scan, and the flush worker rewrote the offset file on every loop, even when
+idle. Now only the flush worker writes, one JSON record to checkpoint_file
+(default: spool_offset_file):
+
+    {"offset": 18234, "done": [[90112, 90987]], "next_entry_no": 412, "spool_inode": 39211, "epoch": 3}
+
+`offset` is the low-water mark: every byte before it is committed. `done`
+lists inclusive byte ranges committed beyond it, out of order. The live
+lane commits new scans while the backlog lane is still draining older
+bytes (see SpoolFlusher). A range that reaches the offset is folded into it.
+`epoch` counts spool rotations.
+
+Flight totals, which grow with every flight of the keep window, are not
+part of it. They go to their own file (flight_summary.totals_path) at most
+every flight_totals_interval_sec and on rotation and shutdown, tagged with
+the checkpoint position (epoch, offset, done) they count up to. That
+position is always one already written here.
+
+It is written only when something in it changed, and at most every
+checkpoint_interval_sec. Rotation and shutdown write it at once. No scan
+causes a state write any more; the fsynced spool line is the scan's only
+write.
+
+Crash recovery. The spool is the source of truth; the checkpoint may lag
+it by up to checkpoint_interval_sec.
+
+  1. Offset behind the spool: the records after it are flushed again. The
+     (DeviceID, EntryNo) key turns them into skipped duplicates. Flight
+     totals are restored from their file, and the committed bytes its tag
+     does not cover are counted again from the spool (uncounted()). They
+     therefore count each record of the current spool once, replayed or
+     not. Totals saved before the last rotation counted that whole spool
+     (rotation saves them first), so only the new spool is counted again.
+  2. spool_inode differs from the spool on disk, or the offset is past its
+     end: the spool was replaced, so it is read from offset 0. The server
+     still skips duplicates; the local flight totals may count them again.
+     Committed ranges are dropped with it.
+  3. Missing or unreadable checkpoint: offset 0, with the same duplicate
+     handling. A legacy offset file (a bare integer) and a legacy
+     state_file are still read once.
+  4. Committed ranges beyond the offset are skipped record by record when
+     the backlog lane drains the gaps between them. A record is sent
+     again only if its commit happened after the last write. In that case
+     it is absent from `done` and from the totals' tag, so it is counted once.
+     Past the bytes the spool held at start, a duplicate is not ours to
+     count: flight totals take only the rows the server inserted.
+  5. Next EntryNo at capture start is the largest of starting_entry_no,
+     next_entry_no, state_file, and the last EntryNo in the spool plus
+     one. With spool_fsync on, every spooled line is durable, so no
+     EntryNo written to the spool is ever handed out twice. With it off,
+     lines can vanish on power loss, so capture reserves EntryNos in
+     fsynced blocks in state_file (ScanPipeline). A crash then skips the
+     rest of the block instead of reusing it. Without a state_file there
+     is nowhere to reserve them, so spool_fsync=false is ignored.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import io_accounting
+from config_utils import Config
+from intervals import IntervalSet
+from scan_record import ScanRecord
+
+logger = logging.getLogger("checkpoint")
+
+TAIL_BYTES = 64 * 1024
+
+
+def checkpoint_path(config: Config) -> str | None:
+    return config.checkpoint_file or config.spool_offset_file
+
+
+def read_checkpoint(config: Config) -> dict:
+    """The stored record, with legacy bare-offset files read as {"offset": n}."""
+    path = checkpoint_path(config)
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read().strip()
+    except FileNotFoundError:
+        return {}
+    except OSError as e:
+        logger.error("Error loading checkpoint %s: %s", path, e)
+        return {}
+    if not text:
+        return {}
+    try:
+        data = json.loads(text)
+    except ValueError:
+        logger.error("Checkpoint %s unreadable; flushing the spool from the start", path)
+        return {}
+    return {"offset": data} if isinstance(data, int) else data
+
+
+def _spool_inode(spool_file: str | None):
+    try:
+        return os.stat(spool_file).st_ino if spool_file else None
+    except OSError:
+        return None
+
+
+def resume_offset(config: Config, record: dict | None = None) -> int:
+    """The committed low-water mark, after rule 2."""
+    record = read_checkpoint(config) if record is None else record
+    offset = int(record.get("offset", 0))
+    spool_file = config.spool_file
+    try:
+        size = os.path.getsize(spool_file) if spool_file else 0
+    except OSError:
+        size = 0
+    inode = record.get("spool_inode")
+    if offset and (offset > size or (inode is not None and inode != _spool_inode(spool_file))):
+        logger.warning("Spool %s was replaced since the checkpoint (offset %d); reading it from the start",
+                       spool_file, offset)
+        return 0
+    return offset
+
+
+def _resume_done(config: Config, record: dict, offset: int) -> IntervalSet:
+    """Committed ranges beyond `offset`, or none if the spool they describe is gone (rule 2)."""
+    done = IntervalSet((lo, hi) for lo, hi in record.get("done", ()) if lo >= offset)
+    if not done:
+        return done
+    try:
+        size = os.path.getsize(config.spool_file)
+    except (OSError, TypeError):
+        size = 0
+    inode = record.get("spool_inode")
+    if offset != int(record.get("offset", 0)) or done.ranges[-1][1] >= size or (
+            inode is not None and inode != _spool_inode(config.spool_file)):
+        return IntervalSet()
+    return done
+
+
+def last_spooled_entry_no(spool_file: str | None, end: int | None = None):
+    """EntryNo of the last complete record in the spool (or before byte `end`), or None."""
+    if not spool_file:
+        return None
+    try:
+        with open(spool_file, "rb") as f:
+            size = f.seek(0, os.SEEK_END) if end is None else end
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read(size - f.tell())
+    except OSError:
+        return None
+    for line in reversed(tail.split(b"\n")):
+        if not line.strip():
+            continue
+        try:
+            return int(ScanRecord.from_spool_line(line.decode("utf-8")).EntryNo)
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def _legacy_state_entry_no(config: Config):
+    if not config.state_file:
+        return None
+    try:
+        with open(config.state_file, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("last_entry_no"))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error("Error loading state file: %s", e)
+        return None
+
+
+def recover_next_entry_no(config: Config) -> int:
+    """Rule 5."""
+    candidates = [config.starting_entry_no, read_checkpoint(config).get("next_entry_no"), _legacy_state_entry_no(config)]
+    last = last_spooled_entry_no(config.spool_file)
+    if last is not None:
+        candidates.append(last + 1)
+    return max(int(c) for c in candidates if c is not None)
+
+
+class Checkpoint:
+    """
+    The flush worker's position. Only the flusher and its backlog lane may
+    hold one; they share `lock` so flight totals and ranges change together.
+    `totals` (a flight_summary.FlightTotals, when the summary is on) is
+    saved by save() whenever it matches a written position.
+    """
+
+    def __init__(self, config: Config):
+        record = read_checkpoint(config)
+        self.lock = threading.RLock()
+        self.offset = resume_offset(config, record)
+        self.done = _resume_done(config, record, self.offset)
+        self.next_entry_no = record.get("next_entry_no")
+        self.epoch = int(record.get("epoch", 0))
+        # Totals stored in the record itself by earlier versions; read once.
+        self.flights = record.get("flights")
+        self.totals = None
+        self._written = self._state() if record else None
+        self._written_at = time.monotonic()
+        self._totals_at = time.monotonic()
+
+    def _state(self) -> tuple:
+        return self.epoch, self.offset, tuple(self.done), self.next_entry_no
+
+    def _committed(self) -> IntervalSet:
+        committed = IntervalSet([(0, self.offset - 1)] if self.offset else [])
+        for lo, hi in self.done:
+            committed.add(lo, hi)
+        return committed
+
+    def position(self) -> dict:
+        """What flight totals saved now count up to."""
+        with self.lock:
+            return {"epoch": self.epoch, "offset": self.offset, "done": [list(r) for r in self.done]}
+
+    def uncounted(self, position: dict | None) -> IntervalSet:
+        """
+        Committed byte ranges that totals saved at `position` do not count
+        (rule 1). None means they count exactly what is committed.
+        """
+        with self.lock:
+            if position is None:
+                return IntervalSet()
+            committed = self._committed()
+            epoch = int(position.get("epoch", 0))
+            if epoch != self.epoch:
+                if epoch != self.epoch - 1:
+                    logger.warning("Flight totals are from spool epoch %d, the checkpoint from %d; "
+                                   "rotations in between are not counted", epoch, self.epoch)
+                return committed
+            counted = IntervalSet([(0, int(position.get("offset", 0)) - 1)] if position.get("offset") else [])
+            for lo, hi in position.get("done", ()):
+                counted.add(lo, hi)
+            return committed - counted
+
+    @property
+    def pending(self) -> bool:
+        """True while the stored record lags this one."""
+        with self.lock:
+            return self._state() != self._written
+
+    @property
+    def resume_point(self) -> int:
+        """End of the last committed byte: the live lane resumes here, the backlog lane drains up to it."""
+        with self.lock:
+            return self.done.ranges[-1][1] + 1 if self.done else self.offset
+
+    def committed(self, start: int, end: int) -> bool:
+        """True if bytes [start, end) are already committed."""
+        with self.lock:
+            return end <= self.offset or self.done.covers(start, end - 1)
+
+    def commit(self, start: int, end: int, last_entry_no=None) -> None:
+        """Record bytes [start, end) as committed; the caller adds their records to `totals` under `lock`."""
+        with self.lock:
+            if end > start:
+                self.done.add(start, end - 1)
+            while self.done and self.done.ranges[0][0] <= self.offset:
+                self.offset = max(self.offset, self.done.ranges.pop(0)[1] + 1)
+            if last_entry_no is not None:
+                self.next_entry_no = max(self.next_entry_no or 0, last_entry_no + 1)
+
+    def reset(self, offset: int) -> None:
+        """Start over at `offset` with nothing committed beyond it (spool rotation)."""
+        with self.lock:
+            self.offset = offset
+            self.done = IntervalSet()
+            self.epoch += 1
+
+    def save(self, config: Config, force: bool = False) -> bool:
+        """
+        Write if changed and the cadence allows (or `force`), then the flight
+        totals if they changed and their cadence allows (or `force`). Returns
+        True if the checkpoint was written.
+        """
+        with self.lock:
+            state = self._state()
+            wrote = False
+            if state != self._written:
+                if not force and time.monotonic() - self._written_at < config.checkpoint_interval:
+                    return False
+                path = checkpoint_path(config)
+                if not path:
+                    return False
+                record = {"offset": self.offset, "next_entry_no": self.next_entry_no,
+                          "spool_inode": _spool_inode(config.spool_file)}
+                if self.done:
+                    record["done"] = [list(r) for r in self.done]
+                if self.epoch:
+                    record["epoch"] = self.epoch
+                io_accounting.atomic_write_text("checkpoint", path, json.dumps(record, separators=(",", ":")))
+                self._written = state
+                self._written_at = time.monotonic()
+                wrote = True
+            # The in-memory totals match the position just written (or already on disk).
+            if self.totals is not None and self.totals.dirty and (
+                    force or time.monotonic() - self._totals_at >= config.flight_totals_interval):
+                self.totals.save(config, self.position())
+                self._totals_at = time.monotonic()
+            return wrote
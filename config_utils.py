@@ -1,8 +1,24 @@
-import os
+import ctypes
+import ctypes.util
 import json
+import logging
+import os
+import struct
+import threading
+from collections.abc import Mapping
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
 
+logger = logging.getLogger("config_utils")
+
+
+def config_get(config, *keys: str, default=None):
+    """Return the first non-None config value for the provided keys."""
+    for key in keys:
+        if key in config and config[key] is not None:
+            return config[key]
+    return default
+
 
 def _resolve_path(base_dir: str, path_value):
     """
@@ -14,37 +30,328 @@ def _resolve_path(base_dir: str, path_value):
     return os.path.normpath(os.path.join(base_dir, path_value))
 
 
-def load_config():
-    try:
-        base_dir = os.path.dirname(CONFIG_PATH)
-        with open(CONFIG_PATH, "r") as file:
-            config_credentials = json.load(file)
-
-        required = [
-            "Device_id",
-            "Starting_entry_no",
-            "Table_name",
-            "db_save_interval",
-            "log_file_path",
-        ]
-
-        for cred in required:
-            if cred not in config_credentials:
-                raise ValueError(f"Missing required config: {cred}")
-
-        # Normalize file paths relative to the config file location
-        path_keys = [
-            "log_file_path",
-            "state_file",
-            "spool_file",
-            "spool_offset_file",
-        ]
-        for key in path_keys:
-            if key in config_credentials:
-                config_credentials[key] = _resolve_path(base_dir, config_credentials[key])
-
-        return config_credentials
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _as_dict(value) -> dict:
+    if not isinstance(value, dict):
+        raise ValueError("expected an object")
+    return dict(value)
+
+
+def _optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+def _as_shift_starts(value) -> tuple:
+    """Shift start times as sorted minutes after midnight, from "HH:MM" strings."""
+    if isinstance(value, str):
+        value = value.split(",")
+    starts = []
+    for item in value:
+        hours, minutes = str(item).strip().split(":")
+        minute = int(hours) * 60 + int(minutes)
+        if not 0 <= minute < 24 * 60:
+            raise ValueError(f"not a time of day: {item}")
+        starts.append(minute)
+    if not starts:
+        raise ValueError("expected at least one shift start")
+    return tuple(sorted(set(starts)))
+
+
+def _as_interval(value):
+    """A number of seconds, or a per-event {name: seconds} object."""
+    if isinstance(value, dict):
+        return {str(k): float(v) for k, v in value.items()}
+    return float(value)
+
+
+# (attribute, accepted keys in priority order, converter, default, hot-reloadable)
+FIELDS = (
+    ("device_id", ("device_id", "Device_id"), str, None, False),
+    ("user_id", ("user_id", "User_id"), _optional(str), None, False),
+    ("table_name", ("table_name", "Table_name"), str, None, False),
+    ("starting_entry_no", ("Starting_entry_no", "starting_entry_no"), int, 1, False),
+    ("summary_post_entry", ("Summary_post_entry",), lambda v: int(v) == 1, False, False),
+    ("sql_connection_string", ("sql_connection_string", "Sql_connection_credentials"), _optional(str), None, False),
+    ("log_file_path", ("log_file_path",), str, "scanning/scan_data.log", False),
+    ("state_file", ("state_file",), _optional(str), None, False),
+    ("spool_file", ("spool_file",), _optional(str), None, False),
+    ("spool_offset_file", ("spool_offset_file",), _optional(str), None, False),
+    ("checkpoint_file", ("checkpoint_file",), _optional(str), None, False),
+    ("archive_dir", ("archive_dir",), _optional(str), None, False),
+    ("master_data_snapshot", ("master_data_snapshot",), _optional(str), None, False),
+    ("trace_table", ("trace_table",), _optional(str), None, False),
+    ("db_schema", ("db_schema",), str, "default", False),
+    ("db_partition_scheme", ("db_partition_scheme",), _optional(str), None, False),
+    ("db_archive_table", ("db_archive_table",), _optional(str), None, False),
+    ("trace_enabled", ("trace_enabled",), _as_bool, False, False),
+    ("flight_summary_enabled", ("flight_summary_enabled",), _as_bool, False, False),
+    ("flight_summary_table", ("flight_summary_table",), _optional(str), None, False),
+    ("scanner_stats_file", ("scanner_stats_file",), _optional(str), None, False),
+    ("scanner_input_device", ("scanner_input_device", "Scanner_input_device"), _optional(str), None, False),
+    ("scanner_device_filter", ("scanner_device_filter", "Scanner_device_filter"), _optional(str), None, False),
+    ("scanner_user_map", ("scanner_user_map",), _as_dict, {}, False),
+    ("log_format", ("log_format",), str, "text", False),
+    ("log_rotate_when", ("log_rotate_when",), _optional(str), None, False),
+    ("log_max_bytes", ("log_max_bytes",), int, 5 * 1024 * 1024, False),
+    ("log_backup_count", ("log_backup_count",), int, 5, False),
+    ("log_compress", ("log_compress",), _as_bool, True, False),
+    ("log_queue_size", ("log_queue_size",), int, 10000, False),
+    ("metrics_host", ("metrics_host",), str, "127.0.0.1", False),
+    ("metrics_port", ("metrics_port",), _optional(int), None, False),
+    ("diagnostics_enabled", ("diagnostics_enabled",), _as_bool, True, False),
+    ("diagnostics_dir", ("diagnostics_dir",), _optional(str), None, False),
+    ("diagnostics_socket", ("diagnostics_socket",), _optional(str), None, False),
+    ("diagnostics_profile_sec", ("diagnostics_profile_sec",), float, 30.0, False),
+    ("diagnostics_profile_interval_ms", ("diagnostics_profile_interval_ms",), float, 5.0, False),
+    ("startup_budget_ms", ("startup_budget_ms",), _optional(float), None, False),
+    ("first_scan_budget_ms", ("first_scan_budget_ms",), _optional(float), None, False),
+    ("startup_report_file", ("startup_report_file",), _optional(str), None, False),
+
+    ("flush_interval", ("db_flush_interval_sec", "db_save_interval"), float, 1.0, True),
+    ("heartbeat_interval", ("db_heartbeat_interval_sec",), float, 10.0, True),
+    ("flush_batch_size", ("db_flush_batch_size",), int, 0, True),
+    ("catchup_threshold", ("db_catchup_threshold_records",), int, 10000, True),
+    ("catchup_connections", ("db_catchup_connections",), int, 4, True),
+    ("catchup_partition_size", ("db_catchup_partition_records",), int, 2000, True),
+    ("catchup_max_records", ("db_catchup_max_records",), int, 200000, True),
+    ("spool_fsync", ("spool_fsync",), _as_bool, True, True),
+    ("spool_rotate_bytes", ("spool_rotate_bytes",), int, 0, True),
+    ("checkpoint_interval", ("checkpoint_interval_sec",), float, 5.0, True),
+    ("io_report_interval", ("io_report_interval_sec",), float, 3600.0, True),
+    ("reconcile_interval", ("reconcile_interval_sec",), float, 0.0, True),
+    ("reconcile_days", ("reconcile_days",), int, 7, True),
+    ("flight_summary_keep_days", ("flight_summary_keep_days",), int, 14, True),
+    ("flight_totals_interval", ("flight_totals_interval_sec",), float, 60.0, True),
+    ("master_data_query", ("master_data_query",), _optional(str), None, True),
+    ("master_data_incremental_query", ("master_data_incremental_query",), _optional(str), None, True),
+    ("master_data_refresh", ("master_data_refresh_sec",), float, 300.0, True),
+    ("master_data_full_refresh", ("master_data_full_refresh_sec",), float, 3600.0, True),
+    ("master_data_ttl", ("master_data_ttl_sec",), float, 86400.0, True),
+    ("master_data_days_back", ("master_data_days_back",), int, 1, True),
+    ("master_data_days_ahead", ("master_data_days_ahead",), int, 2, True),
+    ("scan_log_max_per_sec", ("scan_log_max_per_sec",), float, 5.0, True),
+    ("scan_log_burst", ("scan_log_burst",), _optional(int), None, True),
+    ("speaker_enabled", ("SPEAKER_ENABLED", "speaker_enabled"), _as_bool, True, True),
+    ("voice_files", ("voice_files", "speaker_voice_files"), _as_dict, {}, True),
+    ("speaker_priorities", ("speaker_priorities",), _as_dict, {}, True),
+    ("speaker_min_interval", ("speaker_min_interval_sec",), _optional(_as_interval), None, True),
+    ("speaker_max_alert_age", ("speaker_max_alert_age_sec",), _optional(float), None, True),
+    ("speaker_queue_size", ("speaker_queue_size",), int, 50, True),
+    ("network_fail_threshold", ("network_check_fail_threshold",), int, 2, True),
+    ("probe_enabled", ("connectivity_probe_enabled",), _as_bool, True, True),
+    ("probe_interval", ("connectivity_probe_interval_sec", "network_check_interval_sec"), float, 2.0, True),
+    ("probe_max_interval", ("connectivity_probe_max_interval_sec",), float, 60.0, True),
+    ("probe_timeout", ("connectivity_probe_timeout_sec",), float, 3.0, True),
+    ("ui_refresh_hz", ("ui_refresh_hz",), float, 10.0, True),
+    ("shift_starts", ("shift_starts",), _as_shift_starts, (360, 840, 1320), True),
+    ("key_reset_gap_ms", ("scanner_key_reset_ms",), float, 0.0, True),
+    ("human_key_gap_ms", ("scanner_human_key_gap_ms",), float, 30.0, True),
+    ("reject_human_input", ("scanner_reject_human_input",), _as_bool, False, True),
+    ("process_mode", ("process_mode",), str, "threads", False),
+)
+
+RELOADABLE = frozenset(f[0] for f in FIELDS if f[4])
+
+PATH_KEYS = [
+    "log_file_path",
+    "state_file",
+    "spool_file",
+    "spool_offset_file",
+    "checkpoint_file",
+    "archive_dir",
+    "master_data_snapshot",
+    "scanner_stats_file",
+    "startup_report_file",
+    "diagnostics_dir",
+    "diagnostics_socket",
+]
+
+REQUIRED = [
+    "Device_id",
+    "Starting_entry_no",
+    "Table_name",
+    "db_save_interval",
+    "log_file_path",
+]
+
+
+class ConfigStore:
+    """Holds the live Config; swapped atomically on hot reload."""
+
+    def __init__(self, config: "Config"):
+        self.current = config
+        self._subscribers = []
+
+    def subscribe(self, callback) -> None:
+        """callback(old, new) is called after every successful reload."""
+        self._subscribers.append(callback)
+
+    def publish(self, new: "Config") -> None:
+        old, self.current = self.current, new
+        for callback in list(self._subscribers):
+            try:
+                callback(old, new)
+            except Exception as e:
+                logger.error("Config reload subscriber failed: %s", e)
+
+
+class Config(Mapping):
+    """
+    Validated, read-only configuration. Aliased keys (Device_id/device_id, ...)
+    are resolved once into typed attributes; the normalized raw dict stays
+    reachable through the Mapping interface for rarely read keys.
+
+    latest() returns the newest reloaded Config, so long-running workers pick
+    up tunables by calling it once per loop.
+    """
+
+    __slots__ = tuple(f[0] for f in FIELDS) + ("raw", "store")
+
+    def __init__(self, raw: dict):
+        values = {}
+        for attr, keys, convert, default, _ in FIELDS:
+            value = config_get(raw, *keys, default=None)
+            if value is None:
+                values[attr] = dict(default) if isinstance(default, dict) else default
+                continue
+            try:
+                values[attr] = convert(value)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid config {keys[0]}={value!r}: {e}") from None
+        for attr, value in values.items():
+            object.__setattr__(self, attr, value)
+        object.__setattr__(self, "raw", dict(raw))
+        object.__setattr__(self, "store", ConfigStore(self))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("Config is read-only")
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def latest(self) -> "Config":
+        return self.store.current
+
+    def with_reloaded(self, new: "Config") -> tuple["Config", list]:
+        """
+        `new` with every non-reloadable field taken from self, sharing self's
+        store. Returns the merged Config and the names of ignored changes.
+        """
+        merged = object.__new__(Config)
+        ignored = []
+        for attr, keys, _, _, reloadable in FIELDS:
+            value = getattr(new if reloadable else self, attr)
+            if not reloadable and getattr(new, attr) != getattr(self, attr):
+                ignored.append(keys[0])
+            object.__setattr__(merged, attr, value)
+        raw = dict(new.raw)
+        for attr, keys, _, _, reloadable in FIELDS:
+            if not reloadable:
+                for key in keys:
+                    raw.pop(key, None)
+                    if key in self.raw:
+                        raw[key] = self.raw[key]
+        object.__setattr__(merged, "raw", raw)
+        object.__setattr__(merged, "store", self.store)
+        return merged, ignored
+
+
+def compile_config(raw: dict, base_dir: str | None = None) -> Config:
+    """Validate a raw config dict and build a Config; relative paths resolve against base_dir."""
+    raw = dict(raw)
+    if base_dir is not None:
+        for key in PATH_KEYS:
+            if key in raw:
+                raw[key] = _resolve_path(base_dir, raw[key])
+    return Config(raw)
+
+
+def _read_config_file(path: str) -> dict:
+    with open(path, "r") as file:
+        config_credentials = json.load(file)
+
+    for cred in REQUIRED:
+        if cred not in config_credentials:
+            raise ValueError(f"Missing required config: {cred}")
+    return config_credentials
 
+
+def config_path(path: str | None = None) -> str:
+    """The config file in use: `path`, else $SCANNING_CONFIG, else config.json next to this module."""
+    return os.path.abspath(path or os.environ.get("SCANNING_CONFIG") or CONFIG_PATH)
+
+
+def load_config(path: str | None = None) -> Config:
+    path = config_path(path)
+    try:
+        config_credentials = _read_config_file(path)
     except FileNotFoundError:
         raise FileNotFoundError("Configuration file not found.")
-        return {}
+    return compile_config(config_credentials, os.path.dirname(os.path.abspath(path)))
+
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def inotify_fd(directory: str):
+    """An inotify fd watching `directory`, or None where inotify is unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        wd = libc.inotify_add_watch(fd, directory.encode(), _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def read_inotify_names(fd: int) -> set:
+    """Names of the files in the events waiting on `fd`; call only when it is readable."""
+    data = os.read(fd, 4096)
+    names = set()
+    pos = 0
+    while pos + _EVENT_HEADER.size <= len(data):
+        _, _, _, length = _EVENT_HEADER.unpack_from(data, pos)
+        pos += _EVENT_HEADER.size
+        names.add(data[pos:pos + length].rstrip(b"\0").decode(errors="replace"))
+        pos += length
+    return names
+
+
+def reload_config(config: Config, path: str) -> None:
+    """Re-read `path` and publish its hot-reloadable changes to `config`'s subscribers."""
+    try:
+        new = compile_config(_read_config_file(path), os.path.dirname(os.path.abspath(path)))
+    except Exception as e:
+        logger.error("Config reload rejected, keeping current settings: %s", e)
+        return
+    merged, ignored = config.latest().with_reloaded(new)
+    if ignored:
+        logger.warning("Config changes need a restart to apply: %s", ", ".join(ignored))
+    changed = [a for a in RELOADABLE if getattr(merged, a) != getattr(config.latest(), a)]
+    if not changed:
+        return
+    config.store.publish(merged)
+    logger.info("Config reloaded: %s", ", ".join(sorted(changed)))
@@ -0,0 +1,166 @@
+import logging
+import re
+import threading
+import time
+from typing import Callable
+
+from config_utils import Config
+
+logger = logging.getLogger("connectivity")
+
+UNKNOWN = "unknown"
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+def resolve_db_endpoint(config: Config) -> tuple[str, int] | None:
+    """
+    Return (host, port) of the SQL Server the service writes to, taken from the
+    config.json connection string or from db_cred.yaml.
+    """
+    connection_string = config.sql_connection_string
+    if connection_string:
+        parts = {}
+        for item in connection_string.split(";"):
+            if "=" in item:
+                k, v = item.split("=", 1)
+                parts[k.strip().upper()] = v.strip()
+        server = parts.get("SERVER") or parts.get("ADDRESS") or ""
+        server = re.sub(r"^tcp:", "", server, flags=re.IGNORECASE)
+        port = parts.get("PORT")
+        if "," in server:
+            server, port = server.split(",", 1)
+        server = server.split("\\", 1)[0].strip()
+        if not server:
+            return None
+        return server, int(port or 1433)
+
+    try:
+        from db_utils import DatabaseConnector
+        cfg = DatabaseConnector().cfg
+    except Exception as e:
+        logger.warning("Cannot resolve DB endpoint from db_cred.yaml: %s", e)
+        return None
+    if not cfg.get("server"):
+        return None
+    return str(cfg["server"]), int(cfg.get("port") or 1433)
+
+
+class ConnectivityMonitor:
+    """
+    Single source of truth for "can we reach the database".
+
+    Workers feed it passive signals (successful flushes, DB errors); state is
+    only changed by those. While the state is not ONLINE, the runtime's probe
+    task checks the DB host/port with exponential backoff so a reconnect can
+    be attempted as soon as the server is reachable again. Subscribers are called
+    with (old_state, new_state, reason) on every transition, never for repeats.
+    """
+
+    def __init__(self, config: Config):
+        self._apply_config(config)
+        config.store.subscribe(lambda old, new: self._apply_config(new))
+
+        self.state = UNKNOWN
+        self.reason = ""
+        self.last_change = time.time()
+        self.last_success = None
+        self.last_failure = None
+        self._fail_count = 0
+        self._subscribers: list[Callable[[str, str, str], None]] = []
+        self._reachable_callbacks: list[Callable[[], None]] = []
+        self._cond = threading.Condition()
+        self._reachable_seq = 0
+        self._closed = False
+
+    def _apply_config(self, config: Config) -> None:
+        self.config = config
+        self.fail_threshold = max(1, config.network_fail_threshold)
+        self.probe_enabled = config.probe_enabled
+        self.probe_interval = config.probe_interval
+        self.probe_max_interval = config.probe_max_interval
+        self.probe_timeout = config.probe_timeout
+
+    def subscribe(self, callback: Callable[[str, str, str], None]) -> None:
+        with self._cond:
+            self._subscribers.append(callback)
+
+    def subscribe_reachable(self, callback: Callable[[], None]) -> None:
+        """Call `callback` whenever wait_reachable() would return early; the async form of it."""
+        with self._cond:
+            self._reachable_callbacks.append(callback)
+
+    def report_success(self, source: str) -> None:
+        with self._cond:
+            self._fail_count = 0
+            self.last_success = time.time()
+            self._reachable_seq += 1
+            self._cond.notify_all()
+            transition = self._set_state(ONLINE, source)
+            callbacks = list(self._reachable_callbacks)
+        self._publish(transition)
+        self._call(callbacks)
+
+    def report_reachable(self) -> None:
+        """A probe reached the DB host; the state only changes once a worker connects."""
+        with self._cond:
+            self._reachable_seq += 1
+            self._cond.notify_all()
+            callbacks = list(self._reachable_callbacks)
+        self._call(callbacks)
+
+    def report_failure(self, source: str, error=None) -> None:
+        with self._cond:
+            self._fail_count += 1
+            self.last_failure = time.time()
+            transition = None
+            if self._fail_count >= self.fail_threshold:
+                reason = f"{source}: {error}" if error is not None else source
+                transition = self._set_state(OFFLINE, reason)
+        self._publish(transition)
+
+    def is_online(self) -> bool:
+        return self.state == ONLINE
+
+    def wait_reachable(self, timeout: float) -> bool:
+        """
+        Sleep up to `timeout` seconds, returning early (True) when a probe or
+        passive signal shows the database host is reachable again.
+        """
+        with self._cond:
+            seq = self._reachable_seq
+            return self._cond.wait_for(lambda: self._reachable_seq != seq or self._closed, timeout)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _set_state(self, new_state: str, reason: str):
+        old_state = self.state
+        if new_state == old_state:
+            return None
+        self.state = new_state
+        self.reason = reason
+        self.last_change = time.time()
+        self._cond.notify_all()
+        return old_state, new_state, reason, list(self._subscribers)
+
+    def _publish(self, transition) -> None:
+        if transition is None:
+            return
+        old_state, new_state, reason, subscribers = transition
+        logger.info("Connectivity %s -> %s (%s)", old_state, new_state, reason)
+        for callback in subscribers:
+            try:
+                callback(old_state, new_state, reason)
+            except Exception as e:
+                logger.error("Connectivity subscriber failed: %s", e)
+
+    @staticmethod
+    def _call(callbacks) -> None:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Connectivity callback failed: %s", e)
@@ -1,12 +1,15 @@
 import os
-import yaml
 from pathlib import Path
 
-try:
-    import pyodbc  
-except Exception: 
-    pyodbc = None 
-    
+
+def _import_pyodbc():
+    try:
+        import pyodbc
+    except Exception:
+        pyodbc = None
+    return pyodbc
+
+
 class DatabaseConnector:
     def __init__(self):
         self.cfg = self._load_config()
@@ -27,6 +30,7 @@ class DatabaseConnector:
         yml = Path(__file__).resolve().parent / "db_cred.yaml"
         if yml.exists():
             try:
+                import yaml
                 with open(yml, "r", encoding="utf-8") as f:
                     data = yaml.safe_load(f) or {}
                 for k in cfg:
@@ -55,6 +59,7 @@ class DatabaseConnector:
         return cfg
 
     def create_connection(self):
+        pyodbc = _import_pyodbc()
         try:
             if pyodbc is None:
                 print("pyodbc not available; skipping DB connection.")
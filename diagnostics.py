@@ -0,0 +1,240 @@
+"""
+On-demand diagnostics for the running service, without stopping capture.
+
+    kill -USR1 <pid>   dump every thread's stack (and a status report)
+    kill -USR2 <pid>   start/stop the sampling profiler (auto-stops after
+                       diagnostics_profile_sec)
+
+With diagnostics_socket set, the same is available over a Unix socket:
+
+    echo stacks       | socat - UNIX-CONNECT:/run/scanning/diag.sock
+    echo "profile 20" | socat - UNIX-CONNECT:/run/scanning/diag.sock
+    echo status       | socat - UNIX-CONNECT:/run/scanning/diag.sock
+
+Output files go to diagnostics_dir (default: the log file's directory).
+Nothing runs until triggered: the signal handlers are idle and the socket
+thread sits in accept(). Under runtime.py the signals are handled on the
+event loop (loop.add_signal_handler), never inside a Python signal handler.
+"""
+import collections
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from config_utils import Config
+
+logger = logging.getLogger("diagnostics")
+
+_status_providers: dict = {}
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def register_status(name: str, provider) -> None:
+    """Add a callable whose return value is included in status reports."""
+    _status_providers[name] = provider
+
+
+def _output_dir(config: Config) -> str:
+    path = config.diagnostics_dir or os.path.dirname(config.log_file_path) or "."
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _output_path(config: Config, kind: str, ext: str) -> str:
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(_output_dir(config), f"{kind}-{os.getpid()}-{stamp}.{ext}")
+
+
+def format_thread_stacks() -> str:
+    names = {t.ident: t for t in threading.enumerate()}
+    out = []
+    for ident, frame in sys._current_frames().items():
+        thread = names.get(ident)
+        label = thread.name if thread else "unknown"
+        daemon = " daemon" if thread is not None and thread.daemon else ""
+        out.append(f"--- Thread {label} (ident={ident}{daemon}) ---")
+        out.append("".join(traceback.format_stack(frame)))
+    return "\n".join(out)
+
+
+def status_report() -> dict:
+    report = {"pid": os.getpid(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "threads": sorted(t.name for t in threading.enumerate())}
+    for name, provider in _status_providers.items():
+        try:
+            report[name] = provider()
+        except Exception as e:
+            report[name] = f"error: {e}"
+    with _profiler_lock:
+        report["profiler_running"] = _profiler is not None
+    return report
+
+
+def dump_stacks(config: Config) -> str:
+    path = _output_path(config, "stacks", "txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(format_thread_stacks())
+        f.write("\n--- Status ---\n")
+        f.write(json.dumps(status_report(), indent=2, default=str))
+        f.write("\n")
+    logger.info("Thread stacks written to %s", path)
+    return path
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack at a fixed interval and writes the counts as
+    folded stacks ("thread;outer;inner count"), the input format of
+    flamegraph.pl / speedscope, plus a top-functions summary.
+    """
+
+    def __init__(self, config: Config, duration: float, interval: float):
+        self.config = config
+        self.duration = duration
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="diagnostics-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(parts))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+        self._write()
+        _profiler_finished(self)
+
+    def _write(self) -> None:
+        path = _output_path(self.config, "profile", "folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        leaf = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        top = ", ".join(f"{name}={count}" for name, count in leaf.most_common(5))
+        logger.info("Profile (%d samples) written to %s; top leaves: %s", self.samples, path, top)
+
+
+def _profiler_finished(profiler: SamplingProfiler) -> None:
+    global _profiler
+    with _profiler_lock:
+        if _profiler is profiler:
+            _profiler = None
+
+
+def toggle_profiler(config: Config, duration: float | None = None) -> str:
+    global _profiler
+    with _profiler_lock:
+        if _profiler is not None:
+            _profiler.stop()
+            return "profiler stopping"
+        duration = float(duration or config.diagnostics_profile_sec)
+        interval = config.diagnostics_profile_interval_ms / 1000
+        _profiler = SamplingProfiler(config, duration, interval)
+        _profiler.start()
+    logger.info("Sampling profiler started for %.0fs", duration)
+    return f"profiler started for {duration:.0f}s"
+
+
+def _handle_command(config: Config, line: str) -> str:
+    parts = line.strip().split()
+    if not parts:
+        return "commands: stacks | status | profile [seconds]"
+    cmd = parts[0].lower()
+    if cmd == "stacks":
+        dump_stacks(config)
+        return format_thread_stacks()
+    if cmd == "status":
+        return json.dumps(status_report(), indent=2, default=str)
+    if cmd == "profile":
+        return toggle_profiler(config, float(parts[1]) if len(parts) > 1 else None)
+    return f"unknown command: {cmd}"
+
+
+def _serve_socket(config: Config, path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(2)
+    logger.info("Diagnostics socket listening on %s", path)
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                conn.settimeout(5)
+                data = conn.makefile("r", encoding="utf-8").readline()
+                conn.sendall((_handle_command(config, data) + "\n").encode("utf-8"))
+            except Exception as e:
+                logger.error("Diagnostics command failed: %s", e)
+
+
+def _in_thread(name: str, target, config: Config):
+    def handler(*_):
+        threading.Thread(target=target, args=(config,), name=name, daemon=True).start()
+    return handler
+
+
+def signal_handlers(config: Config) -> dict:
+    """
+    {signal: handler} for SIGUSR1 (stack dump) and SIGUSR2 (profiler), empty
+    when diagnostics are off. runtime.py registers them with
+    loop.add_signal_handler. Each handler only starts a short-lived thread:
+    dump_stacks writes files, and toggle_profiler takes _profiler_lock,
+    which a handler interrupting a holder of it on the same thread would
+    wait for forever.
+    """
+    if not config.diagnostics_enabled or not hasattr(signal, "SIGUSR1"):
+        return {}
+    return {signal.SIGUSR1: _in_thread("diagnostics-dump", dump_stacks, config),
+            signal.SIGUSR2: _in_thread("diagnostics-profile", toggle_profiler, config)}
+
+
+def install(config: Config, name: str | None = None, signals: bool = True) -> None:
+    """
+    Install the optional command socket and, with `signals` on the main
+    thread, the signal handlers. Processes that run runtime.py pass
+    signals=False; the runtime registers them on its event loop instead.
+    `name` distinguishes supervised processes: their socket is diagnostics_socket.<name>.
+    """
+    if not config.diagnostics_enabled:
+        return
+    if signals and threading.current_thread() is threading.main_thread():
+        for sig, handler in signal_handlers(config).items():
+            signal.signal(sig, handler)
+    path = config.diagnostics_socket
+    if path and name:
+        path = f"{path}.{name}"
+    if path:
+        threading.Thread(target=_serve_socket, args=(config, path), name="diagnostics-socket", daemon=True).start()
@@ -0,0 +1,177 @@
+"""
+Per-flight scan totals for Summary_post_entry tables.
+
+In summary mode the scan table only receives the seven base columns, so
+FlightNo, OrderDate and ContainerCode never reach SQL Server. With
+flight_summary_enabled, every flushed batch also updates one row per
+(OrderDate, FlightNo, ContainerCode, Item, DeviceID) in the summary table
+(default {table_name}_FlightSummary), in the batch's own transaction:
+
+    Item = ''       Scans = parent labels scanned, Quantity = child quantity on them
+    Item = 'X'      Scans = labels carrying child X,  Quantity = total quantity of X
+
+Only rows that were actually inserted are added, so a batch replayed
+after a crash (its duplicates skipped) does not count twice on the server.
+Each device owns its own rows, so devices never contend for them;
+dashboards sum over DeviceID.
+
+The same totals are kept in memory (`totals`), updated as the spool
+offset advances, so the device can report its shift totals offline. The
+checkpoint saves them to their own file every flight_totals_interval_sec,
+pruned to flight_summary_keep_days (see checkpoint.py). Scans without a
+FlightNo and a parseable OrderDate are not summarized.
+"""
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+import io_accounting
+
+logger = logging.getLogger("flight_summary")
+
+KEY_WIDTH = 50
+
+SUMMARY_TABLE_TEMPLATE = """
+CREATE TABLE {table_name} (
+    OrderDate DATE NOT NULL,
+    FlightNo NVARCHAR(50) NOT NULL,
+    ContainerCode NVARCHAR(50) NOT NULL,
+    Item NVARCHAR(50) NOT NULL,
+    DeviceID NVARCHAR(50) NOT NULL,
+    Scans INT NOT NULL,
+    Quantity INT NOT NULL,
+    LastEntryNo INT NOT NULL,
+    UpdatedAt DATETIME2(0) NOT NULL,
+
+    CONSTRAINT {pk_name} PRIMARY KEY CLUSTERED (OrderDate, FlightNo, ContainerCode, Item, DeviceID)
+);
+""".strip()
+
+
+def child_items(barcode: str) -> list:
+    """[(item, qty)] from a formatted 'PARENT [ITEM_QTY|ITEM_QTY]' barcode."""
+    if not barcode or "[" not in barcode:
+        return []
+    inner = barcode.split("[", 1)[1].rsplit("]", 1)[0]
+    items = []
+    for part in inner.split("|"):
+        item, _, qty = part.strip().rpartition("_")
+        if item and qty.isdigit():
+            items.append((item[:KEY_WIDTH], int(qty)))
+    return items
+
+
+def aggregate(recs) -> dict:
+    """{(OrderDate, FlightNo, ContainerCode, Item, DeviceID): [scans, quantity, last_entry_no]}"""
+    delta = {}
+    for rec in recs:
+        if not rec.FlightNo or not rec.OrderDate:
+            continue
+        base = (rec.OrderDate, rec.FlightNo[:KEY_WIDTH], (rec.ContainerCode or "")[:KEY_WIDTH])
+        items = child_items(rec.Barcode)
+        for item, qty in [("", sum(q for _, q in items))] + items:
+            row = delta.setdefault(base + (item, rec.DeviceID), [0, 0, rec.EntryNo])
+            row[0] += 1
+            row[1] += qty
+            row[2] = max(row[2], rec.EntryNo)
+    return delta
+
+
+def upsert(cur, quoted_table: str, delta: dict) -> None:
+    """Add `delta` to the summary table on `cur`; the caller commits."""
+    now = datetime.now().replace(microsecond=0)
+    # Key-range locks so two catch-up connections adding the same new row
+    # serialize instead of one failing on the primary key. Sorted to keep
+    # lock order stable.
+    update_sql = (f"UPDATE {quoted_table} WITH (UPDLOCK, SERIALIZABLE) "
+                  f"SET Scans = Scans + ?, Quantity = Quantity + ?, "
+                  f"LastEntryNo = CASE WHEN LastEntryNo > ? THEN LastEntryNo ELSE ? END, UpdatedAt = ? "
+                  f"WHERE OrderDate = ? AND FlightNo = ? AND ContainerCode = ? AND Item = ? AND DeviceID = ?")
+    insert_sql = (f"INSERT INTO {quoted_table} "
+                  f"(OrderDate, FlightNo, ContainerCode, Item, DeviceID, Scans, Quantity, LastEntryNo, UpdatedAt) "
+                  f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    for key in sorted(delta):
+        scans, qty, last_entry_no = delta[key]
+        cur.execute(update_sql, scans, qty, last_entry_no, last_entry_no, now, *key)
+        if cur.rowcount == 0:
+            cur.execute(insert_sql, *key, scans, qty, last_entry_no, now)
+
+
+def totals_path(config) -> str | None:
+    """The totals file, next to the checkpoint (where totals were kept before they had a position)."""
+    base = config.checkpoint_file or config.spool_offset_file
+    return base + ".flights.json" if base else None
+
+
+class FlightTotals:
+    """In-memory totals for everything up to the spool checkpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rows: dict = {}
+        self.dirty = False
+
+    def add(self, recs) -> None:
+        delta = aggregate(recs)
+        with self._lock:
+            self.dirty = True
+            for key, (scans, qty, last_entry_no) in delta.items():
+                row = self.rows.setdefault(key, [0, 0, last_entry_no])
+                row[0] += scans
+                row[1] += qty
+                row[2] = max(row[2], last_entry_no)
+
+    def load_rows(self, rows) -> None:
+        with self._lock:
+            self.rows = {tuple(r[:5]): list(r[5:8]) for r in rows or ()}
+
+    def load(self, config, rows=None):
+        """
+        Restore the saved totals. Returns the checkpoint position they count
+        up to ({} for none), or None when they are taken as exact: `rows`
+        from an older checkpoint record, or a legacy totals file.
+        """
+        path = totals_path(config)
+        data = None
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.error("Flight totals %s unreadable, counting the spool again: %s", path, e)
+        if isinstance(data, dict):
+            self.load_rows(data.get("rows"))
+            return data.get("position") or {}
+        if rows is None and data is None:
+            self.load_rows(None)
+            return {}
+        self.load_rows(rows if rows is not None else data)
+        return None
+
+    def save(self, config, position: dict) -> None:
+        """Write the totals that count up to checkpoint `position`, dropping days older than flight_summary_keep_days."""
+        path = totals_path(config)
+        if not path:
+            return
+        oldest = (date.today() - timedelta(days=config.flight_summary_keep_days)).isoformat()
+        with self._lock:
+            self.rows = {k: v for k, v in self.rows.items() if k[0] >= oldest}
+            rows = [list(k) + v for k, v in self.rows.items()]
+            self.dirty = False
+        text = json.dumps({"position": position, "rows": rows}, separators=(",", ":"))
+        io_accounting.atomic_write_text("flight_totals", path, text)
+
+    def status(self) -> dict:
+        """Per-flight parent scan counts, for diagnostics."""
+        with self._lock:
+            out = {}
+            for (order_date, flight_no, _, item, _), (scans, _, _) in self.rows.items():
+                if item == "":
+                    out[f"{order_date} {flight_no}"] = out.get(f"{order_date} {flight_no}", 0) + scans
+            return out
+
+
+totals = FlightTotals()
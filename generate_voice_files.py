@@ -3,6 +3,7 @@ import pathlib, pyttsx3
 voice_text = {
     "device_ready": "Device is ready",
     "network_lost": "Internet connection lost, check your network",
+    "invalid_label": "Label not valid for this flight, check the label",
 }
 
 sounds = pathlib.Path("sounds")
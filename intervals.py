@@ -0,0 +1,79 @@
+"""Sorted, disjoint integer ranges: EntryNo coverage in reconcile, committed spool bytes in checkpoint."""
+import bisect
+
+
+class IntervalSet:
+    """Sorted, disjoint, inclusive integer ranges."""
+
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for lo, hi in sorted(ranges):
+            if self.ranges and lo <= self.ranges[-1][1] + 1:
+                self.ranges[-1][1] = max(self.ranges[-1][1], hi)
+            else:
+                self.ranges.append([lo, hi])
+
+    @classmethod
+    def from_values(cls, values) -> "IntervalSet":
+        out = cls()
+        for v in sorted(set(values)):
+            if out.ranges and v == out.ranges[-1][1] + 1:
+                out.ranges[-1][1] = v
+            else:
+                out.ranges.append([v, v])
+        return out
+
+    def __iter__(self):
+        return (tuple(r) for r in self.ranges)
+
+    def __len__(self) -> int:
+        return sum(hi - lo + 1 for lo, hi in self.ranges)
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_right(self.ranges, [value, float("inf")]) - 1
+        return i >= 0 and self.ranges[i][0] <= value <= self.ranges[i][1]
+
+    def covers(self, lo: int, hi: int) -> bool:
+        """True if all of [lo, hi] is in the set."""
+        i = bisect.bisect_right(self.ranges, [lo, float("inf")]) - 1
+        return i >= 0 and self.ranges[i][0] <= lo and hi <= self.ranges[i][1]
+
+    def add(self, lo: int, hi: int) -> None:
+        """Add [lo, hi], merging it with the ranges it touches."""
+        self.ranges = IntervalSet(list(self) + [(lo, hi)]).ranges
+
+    def __and__(self, other: "IntervalSet") -> "IntervalSet":
+        out, i, j = [], 0, 0
+        a, b = self.ranges, other.ranges
+        while i < len(a) and j < len(b):
+            lo, hi = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+            if lo <= hi:
+                out.append((lo, hi))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet(out)
+
+    def __sub__(self, other: "IntervalSet") -> "IntervalSet":
+        out = []
+        j = 0
+        b = other.ranges
+        for lo, hi in self.ranges:
+            while j < len(b) and b[j][1] < lo:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= hi:
+                if b[k][0] > lo:
+                    out.append((lo, b[k][0] - 1))
+                lo = max(lo, b[k][1] + 1)
+                k += 1
+            if lo <= hi:
+                out.append((lo, hi))
+        return IntervalSet(out)
+
+    def __repr__(self) -> str:
+        return "IntervalSet(" + ", ".join(f"{lo}-{hi}" if lo != hi else str(lo) for lo, hi in self) + ")"
@@ -0,0 +1,104 @@
+"""
+Storage write accounting per component, to keep SD-card wear visible.
+
+Components call wrote() with the bytes they wrote, the fsyncs they issued
+and the files they created. A temp-file-plus-rename counts as one create,
+since it allocates a new inode and dirties the directory. Totals are
+exported as scanning_io_* metrics, shown in the "io" diagnostics status,
+and logged every io_report_interval_sec: by the runtime's io_report task,
+or by io_report_worker in the multi-process supervisor. The report is
+per scan when scans happened in the window, and per idle hour when
+none did.
+"""
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("io_accounting")
+
+_lock = threading.Lock()
+_totals: dict = {}   # component -> [bytes, fsyncs, creates]
+
+
+def wrote(component: str, nbytes: int = 0, fsyncs: int = 0, creates: int = 0) -> None:
+    with _lock:
+        row = _totals.setdefault(component, [0, 0, 0])
+        row[0] += nbytes
+        row[1] += fsyncs
+        row[2] += creates
+    if nbytes:
+        metrics.IO_BYTES.labels(component).inc(nbytes)
+    if fsyncs:
+        metrics.IO_FSYNCS.labels(component).inc(fsyncs)
+    if creates:
+        metrics.IO_CREATES.labels(component).inc(creates)
+
+
+def atomic_write_text(component: str, path: str, text: str, fsync: bool = False) -> None:
+    """Write `text` to a temp file and rename it over `path`, counting the I/O."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = text.encode("utf-8")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    wrote(component, len(data), fsyncs=1 if fsync else 0, creates=1)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {c: {"bytes": b, "fsyncs": s, "creates": n} for c, (b, s, n) in _totals.items()}
+
+
+class IoReporter:
+    """Logs the writes since its previous report()."""
+
+    def __init__(self):
+        self.last = snapshot()
+        self.last_scans = metrics.SCANS.labels().value
+        self.last_time = time.monotonic()
+
+    def report(self) -> None:
+        now = time.monotonic()
+        current, scans = snapshot(), metrics.SCANS.labels().value
+        window, scanned = now - self.last_time, scans - self.last_scans
+        delta = {}
+        for component, row in current.items():
+            prev = self.last.get(component, {})
+            d = {k: v - prev.get(k, 0) for k, v in row.items()}
+            if any(d.values()):
+                delta[component] = d
+        if scanned:
+            per = {c: round(d["bytes"] / scanned, 1) for c, d in delta.items()}
+            message = f"I/O last {window / 60:.0f} min: {int(scanned)} scans; bytes per scan {per}"
+        else:
+            per = {c: round(d["bytes"] * 3600 / window) for c, d in delta.items()}
+            message = f"I/O last {window / 60:.0f} min: idle; bytes per hour {per}"
+        logger.info(message, extra={"fields": {"window_sec": round(window), "scans": int(scanned), "io": delta}})
+        self.last, self.last_scans, self.last_time = current, scans, now
+
+
+def io_report_worker(config, stop_event) -> None:
+    """Log the writes of the last io_report_interval_sec (0 disables the report until a reload sets it)."""
+    reporter = IoReporter()
+    reloaded = threading.Event()
+    config.store.subscribe(lambda old, new: reloaded.set())
+    while not stop_event.is_set():
+        reloaded.clear()
+        interval = config.latest().io_report_interval
+        if not interval:
+            # Off until a reload; keep an eye on stop_event meanwhile.
+            while not reloaded.wait(1.0):
+                if stop_event.is_set():
+                    return
+            continue
+        if stop_event.wait(max(interval, 60.0)):
+            return
+        if config.latest().io_report_interval:
+            reporter.report()
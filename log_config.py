@@ -1,14 +1,196 @@
+import atexit
+import gzip
+import json
 import logging
-from config_utils import load_config
+import logging.handlers
 import os
+import queue
+import shutil
+import threading
+import time
 
-config = load_config()
-log_file_path = config.get("log_file_path", "scanning/scan_data.log")
+import io_accounting
+from config_utils import Config
 
-os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
 
-logging.basicConfig(
-    filename=log_file_path,
-    level = logging.INFO,
-    format= '%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-    encoding='utf-8')
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the
+    record is dropped and counted, and the count is reported with the next
+    record that gets through.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.LogRecord("log_config", logging.WARNING, __file__, 0,
+                                       "Log queue full; dropped %d records", (dropped,), None)
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped += dropped
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; only freeze the message here.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from extra={"fields": {...}}."""
+
+    def format(self, record):
+        out = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+    io_accounting.wrote("log", os.path.getsize(dest), creates=1)
+
+
+def _count_writes(handler: logging.Handler) -> None:
+    """Count what `handler` writes (plus the newline) under the "log" I/O component."""
+    fmt = handler.format
+
+    def _format(record):
+        text = fmt(record)
+        io_accounting.wrote("log", len(text.encode("utf-8")) + 1)
+        return text
+
+    handler.format = _format
+
+
+def _build_file_handler(config: Config, log_file_path: str) -> logging.Handler:
+    rotate_when = config.log_rotate_when
+    backup_count = config.log_backup_count
+    if rotate_when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file_path, when=rotate_when, backupCount=backup_count, encoding="utf-8")
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file_path, maxBytes=config.log_max_bytes,
+            backupCount=backup_count, encoding="utf-8")
+    if config.log_compress:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    if config.log_format == "json":
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    _count_writes(handler)
+    return handler
+
+
+def setup_logging(config: Config, log_queue=None) -> None:
+    """
+    Route all logging through a bounded queue drained by a background
+    listener thread, so callers never wait on the log file. Safe to call more
+    than once; only the first call installs handlers. The supervisor passes a
+    multiprocessing queue that its child processes forward into.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        log_file_path = config.log_file_path
+        os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+
+        if log_queue is None:
+            log_queue = queue.Queue(maxsize=config.log_queue_size)
+        file_handler = _build_file_handler(config, log_file_path)
+
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(DroppingQueueHandler(log_queue))
+
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def forward_logging(log_queue) -> None:
+    """In a supervised child: send records to the supervisor's listener instead of the file."""
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def queue_depth() -> int | None:
+    """Records waiting for the listener thread, or None before setup."""
+    listener = _listener
+    return listener.queue.qsize() if listener is not None else None
+
+
+class LogRateLimiter:
+    """
+    Token bucket for hot-path log lines: allows `rate` lines per second with
+    bursts up to `burst`. allow() returns (allowed, suppressed_since_last).
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, int(rate)))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self) -> tuple[bool, int]:
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False, 0
+        self.tokens -= 1
+        suppressed, self.suppressed = self.suppressed, 0
+        return True, suppressed
@@ -0,0 +1,231 @@
+"""
+Flight and container master data, cached locally to validate scans.
+
+The DB side (MasterDataRefresher, a runtime timer next to the flusher) runs
+master_data_query for the operating window (today - master_data_days_back
+to today + master_data_days_ahead, bound as two ? parameters). It stores
+the rows in memory and writes them to a JSON snapshot. Rows are read by
+column name: FlightNo, OrderDate, ContainerCode, and optionally ModifiedAt.
+A row may describe a flight, a container or both. When
+master_data_incremental_query is set, it is run every
+master_data_refresh_sec with the newest ModifiedAt seen as an extra first
+parameter. The full query runs every master_data_full_refresh_sec, so
+deleted rows drop out.
+
+Capture validates each scan against `cache` with dict/set lookups and no
+database query. In the multi-process layout capture has no DB connection;
+it loads the snapshot on first use and reloads it when its mtime changes.
+A cache whose last full load is older than master_data_ttl_sec, including
+a stale snapshot at an offline start, is not used, so it raises no false
+alarms.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import io_accounting
+import metrics
+from config_utils import Config
+
+logger = logging.getLogger("master_data")
+
+SNAPSHOT_CHECK_SEC = 5.0
+
+
+def snapshot_path(config: Config) -> str:
+    if config.master_data_snapshot:
+        return config.master_data_snapshot
+    base = config.spool_file or config.state_file or config.log_file_path
+    return os.path.join(os.path.dirname(base) or ".", "master_data.json")
+
+
+def _iso_date(value) -> str | None:
+    """OrderDate as YYYY-MM-DD, the form fetch_barcode_segments produces."""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if value is None:
+        return None
+    return str(value).strip()[:10] or None
+
+
+def _watermark(value):
+    # Kept as text so it survives the JSON snapshot; milliseconds so SQL
+    # Server converts it to DATETIME as well as DATETIME2. Truncating only
+    # makes the next incremental query re-read a row, which merges harmlessly.
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="milliseconds")
+    return value
+
+
+class MasterDataCache:
+    """
+    flights: {FlightNo: {OrderDate, ...}}, containers: {ContainerCode}.
+    Updates build new containers and swap them in, so validate() needs no lock.
+    """
+
+    def __init__(self):
+        self.flights: dict = {}
+        self.containers: frozenset = frozenset()
+        self.loaded_at = 0.0       # wall time of the last full load
+        self.watermark = None      # newest ModifiedAt seen, for incremental queries
+        self._lock = threading.Lock()
+        self._snapshot_mtime = None
+        self._next_snapshot_check = 0.0
+
+    # ---- capture side ----
+
+    def is_fresh(self, config: Config) -> bool:
+        return bool(self.flights or self.containers) and time.time() - self.loaded_at < config.master_data_ttl
+
+    def validate(self, config: Config, rec) -> str | None:
+        """None when the scan is valid or cannot be checked, otherwise the problem."""
+        self._maybe_reload_snapshot(config)
+        if not self.is_fresh(config):
+            metrics.SCAN_VALIDATION.labels("unchecked").inc()
+            return None
+        problem = None
+        if rec.FlightNo and self.flights:
+            dates = self.flights.get(rec.FlightNo)
+            if dates is None:
+                problem = "unknown_flight"
+            elif rec.OrderDate and dates and rec.OrderDate not in dates:
+                problem = "flight_date_mismatch"
+        if problem is None and rec.ContainerCode and self.containers and rec.ContainerCode not in self.containers:
+            problem = "unknown_container"
+        metrics.SCAN_VALIDATION.labels(problem or "valid").inc()
+        return problem
+
+    def _maybe_reload_snapshot(self, config: Config) -> None:
+        now = time.monotonic()
+        if now < self._next_snapshot_check:
+            return
+        self._next_snapshot_check = now + SNAPSHOT_CHECK_SEC
+        path = snapshot_path(config)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._snapshot_mtime:
+            self.load_snapshot(path)
+
+    def load_snapshot(self, path: str) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            mtime = os.stat(path).st_mtime_ns
+        except (OSError, ValueError) as e:
+            logger.warning("Master data snapshot %s unreadable: %s", path, e)
+            return False
+        with self._lock:
+            self.flights = {k: frozenset(v) for k, v in data.get("flights", {}).items()}
+            self.containers = frozenset(data.get("containers", ()))
+            self.loaded_at = float(data.get("loaded_at", 0.0))
+            self.watermark = data.get("watermark")
+            self._snapshot_mtime = mtime
+        logger.info("Loaded master data snapshot: %d flights, %d containers", len(self.flights), len(self.containers))
+        return True
+
+    # ---- DB side ----
+
+    def save_snapshot(self, path: str) -> None:
+        data = {
+            "loaded_at": self.loaded_at,
+            "watermark": self.watermark,
+            "flights": {k: sorted(v) for k, v in self.flights.items()},
+            "containers": sorted(self.containers),
+        }
+        io_accounting.atomic_write_text("master_data", path, json.dumps(data, separators=(",", ":")), fsync=True)
+        self._snapshot_mtime = os.stat(path).st_mtime_ns
+
+    def refresh(self, conn, config: Config, full: bool) -> int:
+        """Run the full or incremental query and merge the result. Returns rows read."""
+        today = date.today()
+        window = (today - timedelta(days=config.master_data_days_back), today + timedelta(days=config.master_data_days_ahead))
+        incremental = not full and config.master_data_incremental_query and self.watermark is not None
+        sql = config.master_data_incremental_query if incremental else config.master_data_query
+        params = ((self.watermark,) + window) if incremental else window
+
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, *params)
+            names = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+
+        with self._lock:
+            flights = {} if not incremental else {k: set(v) for k, v in self.flights.items()}
+            containers = set() if not incremental else set(self.containers)
+            watermark = None if not incremental else self.watermark
+            for row in rows:
+                values = dict(zip(names, row))
+                flight_no = values.get("FlightNo")
+                if flight_no:
+                    dates = flights.setdefault(str(flight_no).strip(), set())
+                    order_date = _iso_date(values.get("OrderDate"))
+                    if order_date:
+                        dates.add(order_date)
+                container = values.get("ContainerCode")
+                if container:
+                    containers.add(str(container).strip())
+                modified = _watermark(values.get("ModifiedAt"))
+                if modified is not None and (watermark is None or modified > watermark):
+                    watermark = modified
+            self.flights = {k: frozenset(v) for k, v in flights.items()}
+            self.containers = frozenset(containers)
+            self.watermark = watermark
+            if not incremental:
+                self.loaded_at = time.time()
+        return len(rows)
+
+
+cache = MasterDataCache()
+
+
+class MasterDataRefresher:
+    """Keeps `cache` and its snapshot current, one refresh() at a time."""
+
+    def __init__(self, config: Config):
+        if os.path.exists(snapshot_path(config)):
+            cache.load_snapshot(snapshot_path(config))
+        self.last_full = cache.loaded_at
+
+    def refresh(self, config: Config) -> float:
+        """Refresh if master_data_query is set; returns the seconds until the next refresh."""
+        from sql_connection import connect_db, log
+
+        wait = config.master_data_refresh
+        if not config.master_data_query:
+            return wait
+        full = time.time() - self.last_full >= config.master_data_full_refresh or not config.master_data_incremental_query
+        try:
+            conn = connect_db(config)
+            if conn is None:
+                # Offline: the flusher already reports it; keep the cache and retry quietly.
+                metrics.MASTER_DATA_REFRESHES.labels("offline").inc()
+                logger.debug("Master data refresh skipped: no DB connection")
+                return min(wait, 60.0)
+            try:
+                rows = cache.refresh(conn, config, full)
+            finally:
+                conn.close()
+        except Exception as e:
+            metrics.MASTER_DATA_REFRESHES.labels("error").inc()
+            log(config, f"Master data refresh failed: {e}")
+            return min(wait, 60.0)
+        if full:
+            self.last_full = cache.loaded_at
+        metrics.MASTER_DATA_REFRESHES.labels("full" if full else "incremental").inc()
+        try:
+            cache.save_snapshot(snapshot_path(config))
+        except OSError as e:
+            log(config, f"Master data snapshot not saved: {e}")
+        logger.info("Master data %s refresh: %d rows, %d flights, %d containers",
+                    "full" if full else "incremental", rows, len(cache.flights), len(cache.containers))
+        return wait
+
@@ -0,0 +1,279 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config_utils import Config
+
+logger = logging.getLogger("metrics")
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+KEY_GAP_BUCKETS = (0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: dict = {}
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _new_child = staticmethod(_CounterChild)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function) -> None:
+        """Compute the value at scrape time instead of on every change."""
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logger.debug("Gauge %s callback failed: %s", name, e)
+                return []
+            if value is None:
+                return []
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(float(value))}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _new_child = staticmethod(_GaugeChild)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def set_function(self, function) -> None:
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(list(self.buckets) + [float("inf")], counts):
+            cumulative += n
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        if not metric.labelnames:
+            metric.labels()
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Pipeline metrics shared by the workers.
+SCANS = registry.counter("scanning_scans_total", "Barcodes accepted by the scanner worker.")
+SPOOLED = registry.counter("scanning_spool_records_total", "Records appended to the spool.")
+SPOOL_BYTES = registry.counter("scanning_spool_bytes_total", "Bytes appended to the spool.")
+FLUSHED_ROWS = registry.counter("scanning_db_rows_flushed_total", "Rows committed to SQL Server.")
+SKIPPED_ROWS = registry.counter("scanning_db_rows_skipped_total", "Rows skipped as duplicates during row-by-row fallback.")
+DB_ERRORS = registry.counter("scanning_db_errors_total", "Database errors seen by the flush worker.", ("kind",))
+SPOOL_BACKLOG_BYTES = registry.gauge("scanning_spool_backlog_bytes", "Spool bytes not yet flushed to SQL Server.")
+SPOOL_BACKLOG_RECORDS = registry.gauge("scanning_spool_backlog_records", "Spool records not yet flushed to SQL Server.")
+DB_CONNECTED = registry.gauge("scanning_db_connected", "1 when the database is reachable, 0 when offline.")
+KEY_TO_ENTER = registry.histogram("scanning_keydown_to_enter_seconds", "First key-down to Enter for one barcode.")
+ENTER_TO_SPOOL = registry.histogram("scanning_enter_to_spool_durable_seconds", "Enter to spool record fsynced.")
+SPOOL_TO_COMMIT = registry.histogram("scanning_spool_to_db_commit_seconds", "Spool append to DB commit per record.")
+FLUSH_BATCH_SIZE = registry.histogram("scanning_flush_batch_size", "Records per DB flush batch.", buckets=BATCH_SIZE_BUCKETS)
+CATCHUP_ACTIVE = registry.gauge("scanning_db_catchup_active", "1 while the backlog lane is draining older spool records.")
+CATCHUP_PARTITIONS = registry.counter("scanning_db_catchup_partitions_total", "Backlog lane partitions by outcome.", ("outcome",))
+RECONCILE_MISSING = registry.counter("scanning_reconcile_missing_total", "Flushed records found missing on the server.")
+RECONCILE_MISMATCHED = registry.counter("scanning_reconcile_mismatched_total", "Server rows whose Barcode differs from the spool.")
+RECONCILE_RESENT = registry.counter("scanning_reconcile_resent_total", "Missing records re-sent by reconciliation.")
+SCAN_VALIDATION = registry.counter("scanning_scan_validation_total", "Scans checked against master data by outcome.", ("outcome",))
+MASTER_DATA_REFRESHES = registry.counter("scanning_master_data_refreshes_total", "Master data refreshes by kind.", ("kind",))
+IO_BYTES = registry.counter("scanning_io_bytes_written_total", "Bytes written to local storage by component.", ("component",))
+IO_FSYNCS = registry.counter("scanning_io_fsyncs_total", "fsync calls by component.", ("component",))
+IO_CREATES = registry.counter("scanning_io_files_created_total", "Files created (including temp-and-rename) by component.", ("component",))
+SCANNER_KEY_GAP = registry.histogram("scanning_scanner_key_gap_seconds", "Key-down to key-down within one barcode.",
+                                     ("scanner",), buckets=KEY_GAP_BUCKETS)
+SCANNER_SCAN_RATE = registry.gauge("scanning_scanner_scans_per_minute", "Recent scan rate per scanner.", ("scanner",))
+SCANNER_RESETS = registry.counter("scanning_scanner_buffer_resets_total", "Partial barcodes dropped by reason.",
+                                  ("scanner", "reason"))
+SCANNER_DATE_UNPARSED = registry.counter("scanning_scanner_date_unparsed_total",
+                                         "Scans whose label date could not be parsed.", ("scanner",))
+SCANNER_HUMAN_INPUT = registry.counter("scanning_scanner_human_input_total",
+                                       "Key sequences with human-like timing.", ("scanner",))
+ALERTS = registry.counter("scanning_alerts_total", "Voice alerts by event and outcome.", ("event", "outcome"))
+ALERT_QUEUE_DEPTH = registry.gauge("scanning_alert_queue_depth", "Voice alerts waiting to be played.")
+
+DB_CONNECTED.set(0)
+
+
+def on_connectivity_change(old_state: str, new_state: str, reason: str) -> None:
+    """ConnectivityMonitor subscriber keeping scanning_db_connected current."""
+    DB_CONNECTED.set(1 if new_state == "online" else 0)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_metrics_server(config: Config):
+    """
+    Serve the registry in Prometheus text format on metrics_host:metrics_port
+    (default 127.0.0.1). Disabled unless metrics_port is set.
+    """
+    port = config.metrics_port
+    if not port:
+        return None
+    host = config.metrics_host or "127.0.0.1"
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error("Metrics endpoint failed to bind %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    # Block in select() until a request arrives instead of waking every 0.5 s;
+    # the server is never shut down, it ends with the process.
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": None}, name="metrics",
+                     daemon=True).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,350 @@
+"""
+Check that every flushed EntryNo actually reached SQL Server, and re-send
+what is missing.
+
+    python reconcile.py [--dry-run] [--overwrite] [--device ID]
+
+Local coverage is the flushed part of the spool plus the last
+reconcile_days of archive files (archive_dir). Per DeviceID it becomes an
+IntervalSet of EntryNo ranges, with a count and row-hash sum per chunk.
+A LocalIndex keeps both across background passes, so each pass reads
+only the spool bytes flushed since the last one and archive files it has
+not seen. Records are read again only for the ranges a pass re-sends or
+compares. The server side costs two set-based queries
+per device and never a per-row lookup: an islands query returns the
+EntryNo ranges present, and a grouped query returns a count and a row-hash
+sum per chunk of RECONCILE_CHUNK entry numbers. The row hash (first 4 bytes
+of MD5 over EntryNo|Barcode in UTF-16LE) is computed the same way locally.
+
+Missing ranges are re-sent with the flush path's insert, which also adds
+them to the per-flight summary table. A chunk whose sums
+differ is compared row by row to find rows whose Barcode differs from the
+spool. They are only reported, unless --overwrite is given.
+
+With reconcile_interval_sec set, the runtime's reconcile timer runs
+reconcile_pass in the background on its own connection.
+"""
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import struct
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import metrics
+import spool_archive
+from config_utils import Config, load_config
+from intervals import IntervalSet
+from scan_record import COLUMNS, SUMMARY_COLUMNS
+from sql_connection import (
+    _quote_table_name,
+    build_insert_sql,
+    connect_db,
+    insert_records,
+    load_spool_offset,
+    log,
+    read_spool_ranges,
+    summary_after_insert,
+)
+
+logger = logging.getLogger("reconcile")
+
+RECONCILE_CHUNK = 1000
+SPOOL_READ_RECORDS = 50000
+# Must match row_hash(): CONVERT(INT, binary) reads the bytes big-endian.
+ROW_HASH_SQL = "CAST(CONVERT(INT, SUBSTRING(HASHBYTES('MD5', CONCAT(EntryNo, N'|', Barcode)), 1, 4)) AS BIGINT)"
+_INT32_BE = struct.Struct(">i")
+
+
+def row_hash(entry_no: int, barcode: str) -> int:
+    digest = hashlib.md5(f"{entry_no}|{barcode or ''}".encode("utf-16-le")).digest()
+    return _INT32_BE.unpack(digest[:4])[0]
+
+
+class SourceIndex:
+    """
+    What one spool or archive file holds, per DeviceID: EntryNo coverage,
+    [count, row-hash sum] per chunk and, for the spool, the byte span each
+    chunk was read from.
+    """
+
+    def __init__(self, path: str, stamp=None, spool: bool = False):
+        self.path = path
+        self.stamp = stamp
+        self.coverage: dict = {}
+        self.sums: dict = {}
+        self.spans: dict | None = {} if spool else None
+
+    def add(self, entries) -> None:
+        """Index (start, end, ScanRecord) entries; start and end are None for archive records."""
+        new = defaultdict(list)
+        for start, end, rec in entries:
+            chunk = rec.EntryNo // RECONCILE_CHUNK
+            sums = self.sums.setdefault(rec.DeviceID, {}).setdefault(chunk, [0, 0])
+            sums[0] += 1
+            sums[1] += row_hash(rec.EntryNo, rec.Barcode)
+            if self.spans is not None:
+                span = self.spans.setdefault(rec.DeviceID, {}).setdefault(chunk, [start, end])
+                span[0], span[1] = min(span[0], start), max(span[1], end)
+            new[rec.DeviceID].append(rec.EntryNo)
+        for device_id, entry_nos in new.items():
+            self.coverage[device_id] = IntervalSet(
+                list(self.coverage.get(device_id, ())) + list(IntervalSet.from_values(entry_nos)))
+
+    def records(self, device_id, wanted: IntervalSet) -> dict:
+        """{EntryNo: ScanRecord} for the device's entries in `wanted`, read from the file again."""
+        if not (self.coverage.get(device_id, IntervalSet()) & wanted):
+            return {}
+        if self.spans is None:
+            _, recs = spool_archive.read_archive(self.path)
+        else:
+            spans = self.spans.get(device_id, {})
+            bounds = [spans[c] for lo, hi in wanted
+                      for c in range(lo // RECONCILE_CHUNK, hi // RECONCILE_CHUNK + 1) if c in spans]
+            if not bounds:
+                return {}
+            entries, _ = read_spool_ranges(self.path, min(b[0] for b in bounds), end=max(b[1] for b in bounds))
+            recs = [rec for _, _, rec in entries]
+        return {r.EntryNo: r for r in recs if r.DeviceID == device_id and r.EntryNo in wanted}
+
+
+class LocalIndex:
+    """Local coverage kept between passes: new spool bytes and new archive files are read once."""
+
+    def __init__(self):
+        self.archives: dict = {}
+        self.spool = None
+        self.spool_offset = 0
+
+    def refresh(self, config: Config) -> None:
+        wanted = {}
+        archive_dir = config.archive_dir
+        if archive_dir and os.path.isdir(archive_dir):
+            oldest = (date.today() - timedelta(days=config.reconcile_days)).isoformat()
+            for path in glob.glob(os.path.join(archive_dir, "*", "*" + spool_archive.SUFFIX)):
+                if os.path.basename(path)[:10] >= oldest:
+                    st = os.stat(path)
+                    wanted[path] = (st.st_mtime_ns, st.st_size)
+        for path in [p for p, source in self.archives.items() if source.stamp != wanted.get(p)]:
+            del self.archives[path]
+        for path in sorted(set(wanted) - set(self.archives)):
+            source = SourceIndex(path, wanted[path])
+            _, records = spool_archive.read_archive(path)
+            source.add((None, None, rec) for rec in records)
+            self.archives[path] = source
+
+        spool_file = config.spool_file
+        if not spool_file or not os.path.exists(spool_file):
+            self.spool = None
+            return
+        inode = os.stat(spool_file).st_ino
+        flushed = load_spool_offset(config)
+        if self.spool is None or self.spool.stamp != inode or flushed < self.spool_offset:
+            # A new spool (rotated or replaced): index it from the start.
+            self.spool = SourceIndex(spool_file, inode, spool=True)
+            self.spool_offset = 0
+        while self.spool_offset < flushed:
+            entries, offset = read_spool_ranges(spool_file, self.spool_offset, SPOOL_READ_RECORDS, flushed)
+            if offset == self.spool_offset:
+                break
+            self.spool.add(entries)
+            self.spool_offset = offset
+
+    def sources(self) -> list:
+        return list(self.archives.values()) + ([self.spool] if self.spool is not None else [])
+
+    def devices(self) -> set:
+        return {device_id for source in self.sources() for device_id in source.coverage}
+
+    def coverage(self, device_id) -> IntervalSet:
+        return IntervalSet(r for source in self.sources() for r in source.coverage.get(device_id, ()))
+
+    def sums(self, device_id) -> dict:
+        out = defaultdict(lambda: [0, 0])
+        for source in self.sources():
+            for chunk, (count, total) in source.sums.get(device_id, {}).items():
+                out[chunk][0] += count
+                out[chunk][1] += total
+        return out
+
+    def records(self, device_id, wanted: IntervalSet) -> dict:
+        out = {}
+        for source in self.sources():
+            out.update(source.records(device_id, wanted))
+        return out
+
+
+# Kept by the background worker between passes.
+local_index = LocalIndex()
+
+
+def server_coverage(conn, table: str, device_id, lo: int, hi: int) -> IntervalSet:
+    quoted_table = _quote_table_name(table)
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"SELECT MIN(EntryNo), MAX(EntryNo) FROM ("
+            f"SELECT EntryNo, EntryNo - ROW_NUMBER() OVER (ORDER BY EntryNo) AS grp FROM {quoted_table} "
+            f"WHERE DeviceID = ? AND EntryNo BETWEEN ? AND ?) islands GROUP BY grp",
+            device_id, lo, hi,
+        )
+        return IntervalSet((int(a), int(b)) for a, b in cur.fetchall())
+    finally:
+        cur.close()
+
+
+def server_chunk_sums(conn, table: str, device_id, lo: int, hi: int) -> dict:
+    """{chunk: (count, hash_sum)} for the device's rows in [lo, hi]."""
+    quoted_table = _quote_table_name(table)
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"SELECT EntryNo / {RECONCILE_CHUNK}, COUNT(*), SUM({ROW_HASH_SQL}) FROM {quoted_table} "
+            f"WHERE DeviceID = ? AND EntryNo BETWEEN ? AND ? GROUP BY EntryNo / {RECONCILE_CHUNK}",
+            device_id, lo, hi,
+        )
+        return {int(chunk): (int(count), int(total or 0)) for chunk, count, total in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def _server_rows(conn, table: str, device_id, lo: int, hi: int) -> dict:
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT EntryNo, Barcode FROM {_quote_table_name(table)} "
+                    f"WHERE DeviceID = ? AND EntryNo BETWEEN ? AND ?", device_id, lo, hi)
+        return {int(entry_no): barcode for entry_no, barcode in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def _overwrite(conn, config: Config, recs: list) -> None:
+    columns = [c for c in (SUMMARY_COLUMNS if config.summary_post_entry else COLUMNS)
+               if c not in ("DeviceID", "EntryNo")]
+    sql = (f"UPDATE {_quote_table_name(config.table_name)} SET {', '.join(f'{c} = ?' for c in columns)} "
+           f"WHERE DeviceID = ? AND EntryNo = ?")
+    cur = conn.cursor()
+    try:
+        for rec in recs:
+            cur.execute(sql, *[getattr(rec, c) for c in columns], rec.DeviceID, rec.EntryNo)
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def reconcile_device(conn, config: Config, device_id, index: LocalIndex,
+                     dry_run: bool = False, overwrite: bool = False) -> dict:
+    table = config.table_name
+    local = index.coverage(device_id)
+    lo, hi = local.ranges[0][0], local.ranges[-1][1]
+    present = server_coverage(conn, table, device_id, lo, hi)
+    missing = local - present
+    resend_by_entry = index.records(device_id, missing) if missing else {}
+
+    # Local sums over the entries the server has: drop the missing ones.
+    local_sums = index.sums(device_id)
+    for entry_no, rec in resend_by_entry.items():
+        chunk = local_sums[entry_no // RECONCILE_CHUNK]
+        chunk[0] -= 1
+        chunk[1] -= row_hash(entry_no, rec.Barcode)
+    server_sums = server_chunk_sums(conn, table, device_id, lo, hi)
+
+    differing = IntervalSet(
+        (max(lo, chunk * RECONCILE_CHUNK), min(hi, (chunk + 1) * RECONCILE_CHUNK - 1))
+        for chunk, (count, total) in server_sums.items() if local_sums.get(chunk, [0, 0]) != [count, total])
+    mismatched = []
+    if differing:
+        records = index.records(device_id, differing)
+        for chunk_lo, chunk_hi in differing:
+            for entry_no, barcode in _server_rows(conn, table, device_id, chunk_lo, chunk_hi).items():
+                rec = records.get(entry_no)
+                if rec is not None and (rec.Barcode or "") != (barcode or ""):
+                    mismatched.append(rec)
+
+    resend = [resend_by_entry[n] for n in sorted(resend_by_entry)]
+    result = {"device": device_id, "local": len(local), "missing_ranges": list(missing),
+              "missing": len(resend), "mismatched": [r.EntryNo for r in mismatched], "resent": 0}
+    metrics.RECONCILE_MISSING.inc(len(resend))
+    metrics.RECONCILE_MISMATCHED.inc(len(mismatched))
+    if dry_run:
+        return result
+    if resend:
+        insert_sql = build_insert_sql(table, config.summary_post_entry)
+        # Flight totals kept locally already count these: they were flushed once.
+        inserted = insert_records(conn, insert_sql, resend, config.summary_post_entry,
+                                  summary_after_insert(config))
+        result["resent"] = len(inserted)
+        metrics.RECONCILE_RESENT.inc(len(inserted))
+    if overwrite and mismatched:
+        _overwrite(conn, config, mismatched)
+    return result
+
+
+def reconcile(config: Config, conn=None, dry_run: bool = False, overwrite: bool = False,
+              device: str | None = None, index: LocalIndex | None = None) -> list | None:
+    """Reconcile every device (or just `device`); None when no connection could be opened."""
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_db(config)
+        if conn is None:
+            return None
+    index = index or LocalIndex()
+    index.refresh(config)
+    try:
+        results = []
+        for device_id in sorted(index.devices()):
+            if device and device_id != device:
+                continue
+            results.append(reconcile_device(conn, config, device_id, index, dry_run, overwrite))
+        return results
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def reconcile_pass(config: Config) -> None:
+    """One background reconciliation, logged; a no-op while reconcile_interval_sec is 0."""
+    if not config.reconcile_interval:
+        return
+    started = time.monotonic()
+    try:
+        results = reconcile(config, index=local_index)
+    except Exception as e:
+        log(config, f"Reconcile failed: {e}")
+        return
+    if results is None:
+        log(config, "Reconcile skipped: DB connection failed")
+        return
+    for r in results:
+        if r["missing"] or r["mismatched"]:
+            log(config, f"Reconcile {r['device']}: re-sent {r['resent']}/{r['missing']} missing rows "
+                        f"{r['missing_ranges']}; {len(r['mismatched'])} rows differ from the spool",
+                **{k: v for k, v in r.items() if k != "mismatched"}, mismatched=len(r["mismatched"]))
+    logger.info("Reconcile finished in %.2fs", time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile spooled scans with SQL Server")
+    parser.add_argument("--dry-run", action="store_true", help="report only, do not re-send")
+    parser.add_argument("--overwrite", action="store_true", help="update server rows whose Barcode differs")
+    parser.add_argument("--device", help="only this DeviceID")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    results = reconcile(load_config(), dry_run=args.dry_run, overwrite=args.overwrite, device=args.device)
+    if results is None:
+        raise SystemExit("DB connection failed.")
+    for r in results:
+        print(f"{r['device']}: {r['local']} local, {r['missing']} missing in {len(r['missing_ranges'])} ranges, "
+              f"{r['resent']} re-sent, {len(r['mismatched'])} mismatched")
+        for lo, hi in r["missing_ranges"][:20]:
+            print(f"  missing {lo}-{hi}")
+        if r["mismatched"]:
+            print(f"  mismatched EntryNo: {r['mismatched'][:50]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+The service's event loop: capture, flushing, probes, timers and alerts run
+as asyncio tasks on the main thread instead of as threads that mostly sleep.
+
+    scan        evdev async reads -> KeyFramer -> ScanPipeline.accept on the
+                scan thread, timed per scanner by scan_stats
+    flush       SpoolFlusher.step() on the flusher's DB thread. Between steps
+                it sleeps until a spool append (same process, or inotify
+                when capture runs in another one), the DB heartbeat, or a
+                probe finding the DB reachable.
+    probe       TCP connects to the DB endpoint, with backoff, while not ONLINE
+    config      inotify on the config directory, read through loop.add_reader
+    timers      reconcile and master data (DB work in the executor), I/O report
+    alerts      SpeakerService alerts, played on the audio thread
+    forward     alerts arriving from the supervisor's queue (alerts process)
+
+pyodbc, audio, the alert queue and the spool append (with its fsync) block,
+so each gets a small executor of its own. The flusher has one thread, so
+step() and close() can never overlap, not even when shutdown abandons a
+step. Timers share two DB threads, and capture, audio and the alert queue
+get one each; capture awaits each accept, so scans stay in order. When idle, the loop
+sleeps in epoll until the next timer, which is the DB heartbeat every
+heartbeat_interval_sec.
+
+Shutdown starts on SIGTERM, on SIGINT where it is not ignored, or when a
+task fails. Every task is cancelled and awaited, the flusher writes its
+checkpoint and disconnects, and each executor is joined after its queued
+work is dropped. stop_event is set too, for the flusher's backlog lane,
+which runs on threads of its own and checks it between partitions.
+"""
+import asyncio
+import logging
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import diagnostics
+import io_accounting
+import master_data
+import scan_stats
+import startup_timing
+from capture import KeyFramer, ScanPipeline, key_down_code
+from config_utils import Config, config_path, inotify_fd, read_inotify_names, reload_config
+from connectivity import ONLINE, UNKNOWN, ConnectivityMonitor, resolve_db_endpoint
+from sql_connection import FLUSHED, IDLE, OFFLINE, SpoolFlusher, log, stop_event
+
+logger = logging.getLogger("runtime")
+
+EXECUTOR_THREADS = {"scan": 1, "db_flush": 1, "db": 2, "audio": 1, "alert_queue": 1}
+CONFIG_POLL_SEC = 2.0
+RETRY_SEC = 5.0
+SCANNER_RETRY_SEC = 2.0
+
+
+async def _wait(event: asyncio.Event, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+class Runtime:
+    """
+    One process's tasks. `capture` reads the scanner, `flush` sends the spool
+    (with probes and DB timers), `speaker` plays alerts here, and `alerts`
+    receives the alert events raised by capture and flush (default: `speaker`).
+    `on_scan` and `on_invalid` are ScanPipeline's callbacks, for the UI.
+    """
+
+    def __init__(self, config: Config, capture: bool = False, flush: bool = False, speaker=None, alerts=None,
+                 connectivity: ConnectivityMonitor | None = None, alert_queue=None, config_file: str | None = None,
+                 on_scan=None, on_invalid=None):
+        self.config = config
+        self.capture = capture
+        self.flush = flush
+        self.speaker = speaker
+        self.alerts = alerts if alerts is not None else speaker
+        self.connectivity = connectivity
+        self.alert_queue = alert_queue
+        self.config_file = config_file
+        self.on_scan = on_scan
+        self.on_invalid = on_invalid
+        self.exit_code = 0
+        self.loop = None
+        self.ready = threading.Event()
+        self.tasks: list = []
+        self._fds: list = []
+        self._executors: dict = {}
+        self._stopping = None
+        self._scan_task = None
+        self.appended = None
+
+    # ---- plumbing ----
+
+    def _run(self, executor: str, fn, *args):
+        if executor not in self._executors:
+            self._executors[executor] = ThreadPoolExecutor(EXECUTOR_THREADS[executor], thread_name_prefix=executor)
+        return self.loop.run_in_executor(self._executors[executor], fn, *args)
+
+    def _call_soon(self, fn) -> None:
+        """Schedule `fn` on the loop from any thread (connectivity callbacks come from DB threads)."""
+        try:
+            self.loop.call_soon_threadsafe(fn)
+        except RuntimeError:
+            pass   # loop already closed: shutting down
+
+    def _spawn(self, name: str, coro) -> asyncio.Task:
+        task = self.loop.create_task(coro, name=name)
+        task.add_done_callback(self._task_done)
+        self.tasks.append(task)
+        return task
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error("Task %s failed; stopping", task.get_name(), exc_info=task.exception())
+        self.exit_code = 1
+        self.stop()
+
+    def _watch_file(self, path: str | None, event: asyncio.Event) -> bool:
+        """Set `event` whenever `path` is written and closed or renamed into place. False without inotify."""
+        if not path:
+            return False
+        directory, name = os.path.split(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd = inotify_fd(directory)
+        if fd is None:
+            return False
+
+        def _readable():
+            if name in read_inotify_names(fd):
+                event.set()
+
+        self.loop.add_reader(fd, _readable)
+        self._fds.append(fd)
+        return True
+
+    def _reload_event(self) -> asyncio.Event:
+        """An event set on every config reload; the waiter clears it."""
+        event = asyncio.Event()
+        self.config.store.subscribe(lambda old, new: self._call_soon(event.set))
+        return event
+
+    async def _interval(self, attr: str, reloaded: asyncio.Event) -> Config:
+        """
+        Sleep for the config's `attr` seconds (at least 60) and return the
+        config then. While `attr` is 0 the timer is off: wait for a reload
+        instead of waking up to check.
+        """
+        while True:
+            reloaded.clear()
+            interval = getattr(self.config.latest(), attr)
+            if not interval:
+                await reloaded.wait()
+                continue
+            await asyncio.sleep(max(interval, 60.0))
+            config = self.config.latest()
+            if getattr(config, attr):
+                return config
+
+    # ---- lifecycle ----
+
+    def start_capture(self) -> None:
+        """Start reading the scanner; callable from any thread once `ready` is set (the UI's Start)."""
+        self._call_soon(self._start_capture)
+
+    def stop_capture(self) -> None:
+        """Stop reading the scanner; flushing and alerts carry on (the UI's Stop)."""
+        self._call_soon(self._stop_capture)
+
+    def request_stop(self) -> None:
+        """stop() from another thread."""
+        self._call_soon(self.stop)
+
+    def _start_capture(self) -> None:
+        if self._scan_task is None or self._scan_task.done():
+            self._scan_task = self._spawn("scan", self._scan())
+
+    def _stop_capture(self) -> None:
+        if self._scan_task is not None:
+            self._scan_task.cancel()
+
+    def stop(self) -> None:
+        """Begin shutdown; call on the loop thread (signal handlers run there)."""
+        if self._stopping is None or self._stopping.is_set():
+            return
+        logger.info("Stopping...")
+        stop_event.set()
+        if self.connectivity is not None:
+            self.connectivity.close()
+        if self.speaker is not None:
+            self.speaker.cleanup()
+        if self.alert_queue is not None:
+            try:
+                self.alert_queue.put_nowait(None)   # unblocks _forward_alerts' get()
+            except queue.Full:
+                pass
+        self._stopping.set()
+
+    async def main(self) -> int:
+        self.loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.appended = asyncio.Event()
+        # Only the main thread can take signals; under the UI they stay with Tk.
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                if signal.getsignal(sig) is not signal.SIG_IGN:
+                    self.loop.add_signal_handler(sig, self.stop)
+            for sig, handler in diagnostics.signal_handlers(self.config).items():
+                self.loop.add_signal_handler(sig, handler)
+        self.ready.set()
+
+        if self.capture:
+            self._start_capture()
+            startup_timing.mark("capture_started")
+        if self.flush:
+            if self.connectivity is None:
+                self.connectivity = ConnectivityMonitor(self.config)
+                if self.alerts is not None:
+                    self.connectivity.subscribe(self.alerts.on_connectivity_change)
+            self._spawn("flush", self._flush())
+            self._spawn("probe", self._probe())
+            self._spawn("reconcile", self._reconcile())
+            self._spawn("master_data", self._master_data())
+        if self.speaker is not None:
+            self._spawn("alerts", self._play_alerts())
+        if self.alert_queue is not None:
+            self._spawn("forward", self._forward_alerts())
+        self._spawn("config", self._watch_config())
+        self._spawn("io_report", self._io_report())
+        startup_timing.mark("background_started")
+
+        await self._stopping.wait()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for fd in self._fds:
+            self.loop.remove_reader(fd)
+            os.close(fd)
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        return self.exit_code
+
+    # ---- tasks ----
+
+    async def _scan(self) -> None:
+        from evdev import InputDevice, categorize, ecodes
+
+        from scanner_device_resolver import resolve_scanner_device
+
+        config = self.config
+        dev_path = resolve_scanner_device(config)
+        pipeline = ScanPipeline(config, dev_path, self.on_scan, self.alerts, self.on_invalid)
+        framer = KeyFramer(pipeline.session)
+        try:
+            while True:
+                framer.reset()
+                try:
+                    dev = InputDevice(dev_path)
+                except FileNotFoundError:
+                    log(config, f"Scanner device not found: {dev_path}. Retrying in 2s.")
+                    await asyncio.sleep(SCANNER_RETRY_SEC)
+                    continue
+                except Exception as e:
+                    log(config, f"Scanner error: {e}. Retrying in 2s.")
+                    await asyncio.sleep(SCANNER_RETRY_SEC)
+                    continue
+                try:
+                    log(config, f"Scanner opened: {dev_path}")
+                    startup_timing.report_startup(config, "capture_ready")
+                    if self.alerts is not None:
+                        self.alerts.enqueue("device_ready")
+                    async for event in dev.async_read_loop():
+                        keycode = key_down_code(event, categorize, ecodes)
+                        if keycode is None:
+                            continue
+                        frame = framer.feed(keycode)
+                        if frame is not None:
+                            # Spool append (and fsync), EntryNo and validation block; the
+                            # next key-downs wait in the device queue meanwhile.
+                            await self._run("scan", pipeline.accept, *frame)
+                            self.appended.set()
+                except Exception as e:
+                    log(config, f"Scanner error: {e}. Retrying in 2s.")
+                finally:
+                    dev.close()
+                await asyncio.sleep(SCANNER_RETRY_SEC)
+        finally:
+            # Cancelled at shutdown or by stop_capture(): the shift so far goes to scanner_stats_file.
+            scan_stats.stats.save(config)
+
+    async def _flush(self) -> None:
+        flusher = await self._run("db_flush", SpoolFlusher, self.config, self.alerts, self.connectivity)
+        reachable = asyncio.Event()
+        self.connectivity.subscribe_reachable(lambda: self._call_soon(reachable.set))
+        # Capture in this process sets `appended` itself; otherwise the capture
+        # process's appends are seen through inotify, or polled as before.
+        wakes_on_append = self.capture or self._watch_file(self.config.spool_file, self.appended)
+        try:
+            while True:
+                self.appended.clear()
+                reachable.clear()
+                outcome = await self._run("db_flush", flusher.step)
+                config = flusher.config
+                if outcome == FLUSHED:
+                    # Let the next batch fill for flush_interval.
+                    await asyncio.sleep(config.flush_interval)
+                elif outcome == IDLE:
+                    if not wakes_on_append:
+                        timeout = config.flush_interval
+                    elif flusher.ckpt.pending:
+                        timeout = config.checkpoint_interval
+                    else:
+                        timeout = config.heartbeat_interval
+                    await _wait(self.appended, timeout)
+                elif outcome == OFFLINE:
+                    await _wait(reachable, RETRY_SEC)
+                else:
+                    await asyncio.sleep(RETRY_SEC)
+        finally:
+            await self._run("db_flush", flusher.close)
+
+    async def _probe(self) -> None:
+        monitor = self.connectivity
+        if not monitor.probe_enabled:
+            return
+        endpoint = resolve_db_endpoint(monitor.config)
+        if endpoint is None:
+            logger.info("No DB endpoint configured; connectivity probing disabled.")
+            return
+
+        offline = asyncio.Event()
+
+        def _on_change(old_state, new_state, reason):
+            self._call_soon(offline.clear if new_state == ONLINE else offline.set)
+
+        monitor.subscribe(_on_change)
+        if monitor.state != ONLINE:
+            offline.set()
+        delay = monitor.probe_interval
+        while True:
+            await offline.wait()
+            await asyncio.sleep(delay)
+            if monitor.state == ONLINE:
+                delay = monitor.probe_interval
+                continue
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(*endpoint), monitor.probe_timeout)
+                writer.close()
+                reached = True
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+            except (OSError, asyncio.TimeoutError):
+                reached = False
+            if reached:
+                monitor.report_reachable()
+                delay = monitor.probe_interval
+            else:
+                if monitor.state == UNKNOWN:
+                    monitor.report_failure("probe", f"{endpoint[0]}:{endpoint[1]} unreachable")
+                delay = min(delay * 2, monitor.probe_max_interval)
+
+    async def _reconcile(self) -> None:
+        from reconcile import reconcile_pass
+
+        reloaded = self._reload_event()
+        while True:
+            config = await self._interval("reconcile_interval", reloaded)
+            await self._run("db", reconcile_pass, config)
+
+    async def _master_data(self) -> None:
+        refresher = await self._run("db", master_data.MasterDataRefresher, self.config)
+        while True:
+            wait = await self._run("db", refresher.refresh, self.config.latest())
+            await asyncio.sleep(wait)
+
+    async def _io_report(self) -> None:
+        reporter = io_accounting.IoReporter()
+        reloaded = self._reload_event()
+        while True:
+            await self._interval("io_report_interval", reloaded)
+            reporter.report()
+
+    async def _watch_config(self) -> None:
+        path = config_path(self.config_file)
+        changed = asyncio.Event()
+        if self._watch_file(path, changed):
+            while True:
+                await changed.wait()
+                changed.clear()
+                reload_config(self.config, path)
+
+        logger.info("inotify unavailable; polling %s every %.0fs", path, CONFIG_POLL_SEC)
+        last = None
+        while True:
+            await asyncio.sleep(CONFIG_POLL_SEC)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if last is not None and mtime != last:
+                reload_config(self.config, path)
+            last = mtime
+
+    async def _play_alerts(self) -> None:
+        speaker = self.speaker
+        if not speaker.can_start():
+            return
+        while True:
+            name = await self._run("audio", speaker.queue.pop)
+            if name is None:
+                return
+            await self._run("audio", speaker.play, name)
+
+    async def _forward_alerts(self) -> None:
+        while True:
+            name = await self._run("alert_queue", self.alert_queue.get)
+            if self._stopping.is_set():
+                return
+            # None is a stop sentinel left by a previous alerts process.
+            if name is not None:
+                self.speaker.enqueue(name)
+
+
+def run(config: Config, **kwargs) -> int:
+    """Run a Runtime (see its arguments) until it is stopped; returns the exit code."""
+    return asyncio.run(Runtime(config, **kwargs).main())
+
+
+def start_thread(config: Config, **kwargs) -> tuple[Runtime, threading.Thread]:
+    """
+    Run a Runtime on a thread of its own, for the Tk UI, which keeps the main
+    thread. Returns once its loop is running; stop it with request_stop().
+    """
+    rt = Runtime(config, **kwargs)
+    thread = threading.Thread(target=asyncio.run, args=(rt.main(),), name="runtime", daemon=True)
+    thread.start()
+    rt.ready.wait()
+    return rt, thread
@@ -0,0 +1,59 @@
+"""
+ScanRecord: one scan as a fixed-order tuple, shared by capture, spool and flush.
+
+The spool stores each record as a JSON array in COLUMNS order with the trace
+dict last, so lines carry no key names and parse straight back into a tuple.
+Trailing null fields are left out (the trace whenever tracing is off, and
+unparsed label fields before it); from_values pads them back.
+DB parameters are slices of the tuple: the first SUMMARY_COLUMNS for
+Summary_post_entry tables, all COLUMNS otherwise.
+"""
+import json
+from collections import namedtuple
+
+SUMMARY_COLUMNS = ("DeviceID", "ScannerName", "EntryNo", "Barcode", "ScanDate", "ScanTime", "UserID")
+PARENT_COLUMNS = ("Stowage", "FlightNo", "OrderDate", "DACS_CLASS", "Leg", "Gally",
+                  "BlockNo", "ContainerCode", "DES", "DACS_ACType")
+COLUMNS = SUMMARY_COLUMNS + PARENT_COLUMNS
+
+_N_SUMMARY = len(SUMMARY_COLUMNS)
+_N_COLUMNS = len(COLUMNS)
+_PAD = (None,) * (_N_COLUMNS + 1)
+
+
+class ScanRecord(namedtuple("ScanRecord", COLUMNS + ("Trace",), defaults=(None,) * (len(PARENT_COLUMNS) + 1))):
+    __slots__ = ()
+
+    def params(self, summary: bool = False) -> tuple:
+        """Insert parameters in column order for the summary or full column set."""
+        return self[:_N_SUMMARY] if summary else self[:_N_COLUMNS]
+
+    def to_spool_line(self) -> str:
+        n = len(self)
+        while n > _N_SUMMARY and self[n - 1] is None:
+            n -= 1
+        return json.dumps(self[:n], ensure_ascii=False) + "\n"
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+    @classmethod
+    def from_values(cls, values: list) -> "ScanRecord":
+        """From a spool array; shorter arrays written by older layouts are padded."""
+        if len(values) < _N_COLUMNS + 1:
+            values = list(values) + list(_PAD[len(values):])
+        return cls._make(values[:_N_COLUMNS + 1])
+
+    @classmethod
+    def from_dict(cls, rec: dict) -> "ScanRecord":
+        """From a spool line written before records were stored as arrays."""
+        return cls._make([rec.get(name) for name in cls._fields])
+
+    @classmethod
+    def from_spool_line(cls, line: str) -> "ScanRecord":
+        data = json.loads(line)
+        if isinstance(data, list):
+            return cls.from_values(data)
+        if isinstance(data, dict):
+            return cls.from_dict(data)
+        raise ValueError("spool line is neither an array nor an object")
@@ -0,0 +1,313 @@
+"""
+Per-scanner session statistics, in constant memory, per shift.
+
+KeyFramer used to drop keystroke timing once a barcode was framed. With a
+ScannerSession attached it reports every key-down gap inside a barcode,
+every partial buffer it drops and every finished sequence. That is enough
+to tell a healthy scanner from one whose read head is degrading (slower,
+more uneven bursts, more resets, more labels whose date does not parse)
+and either of them from someone typing on the same input device.
+
+Per scanner and shift:
+
+    key gaps       count, mean, stddev, min/max and a fixed log-bucket
+                   histogram (p50/p90/p99), in milliseconds
+    scans/min      decayed over about a minute, and averaged over the shift
+    resets         partial barcodes dropped: no key for scanner_key_reset_ms
+                   ("gap"), the device reopened ("reopen"), or rejected as
+                   human input ("human")
+    date failures  scans whose OrderDate fetch_barcode_segments could not parse
+    human          sequences whose gaps were mostly >= scanner_human_key_gap_ms.
+                   With scanner_reject_human_input they are dropped before
+                   they reach the spool, otherwise only counted.
+
+Shifts start at shift_starts (local "HH:MM", default 06:00, 14:00 and
+22:00). When a shift ends, and when capture stops, the session is appended
+as one JSON line to scanner_stats_file. The last line for a scanner and
+shift is its summary, and a restart within the shift continues from it.
+Sessions are exported as scanning_scanner_* metrics, in the "scanners"
+diagnostics status, and shown by the UI.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import io_accounting
+import metrics
+
+logger = logging.getLogger("scan_stats")
+
+GAP_BUCKETS_MS = (0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 50.0, 75.0, 100.0, 200.0, 500.0, 1000.0)
+RATE_WINDOW_SEC = 60.0
+TAIL_BYTES = 64 * 1024
+
+
+def shift_start(config, now: datetime) -> datetime:
+    """Start of the shift `now` falls in."""
+    starts = config.shift_starts or (0,)
+    minute = now.hour * 60 + now.minute
+    i = bisect.bisect_right(starts, minute) - 1
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if i < 0:
+        day -= timedelta(days=1)
+    return day + timedelta(minutes=starts[i])
+
+
+class GapStats:
+    """Streaming summary of key gaps in ms: Welford mean/variance plus fixed histogram buckets."""
+
+    __slots__ = ("n", "mean", "m2", "min", "max", "counts")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.counts = [0] * (len(GAP_BUCKETS_MS) + 1)
+
+    def add(self, ms: float) -> None:
+        self.n += 1
+        delta = ms - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (ms - self.mean)
+        if self.min is None or ms < self.min:
+            self.min = ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+        self.counts[bisect.bisect_left(GAP_BUCKETS_MS, ms)] += 1
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket holding the q-quantile (the maximum for the last bucket)."""
+        if not self.n:
+            return None
+        rank = q * self.n
+        seen = 0
+        for bound, count in zip(GAP_BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {"n": self.n, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max,
+                "counts": list(self.counts)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GapStats":
+        out = cls()
+        out.n, out.mean, out.m2 = int(data["n"]), float(data["mean"]), float(data["m2"])
+        out.min, out.max = data.get("min"), data.get("max")
+        counts = list(data.get("counts", ()))
+        if len(counts) == len(out.counts):
+            out.counts = counts
+        return out
+
+
+class ScannerSession:
+    """
+    One scanner's statistics for the current shift. key(), end_sequence()
+    and discard() are called by KeyFramer and scan() by ScanPipeline, one
+    at a time (the scan task awaits each accept on its executor). Readers
+    get summary(), which only reads.
+    """
+
+    def __init__(self, config, scanner: str):
+        self.config = config
+        self.scanner = scanner
+        self._gap_metric = metrics.SCANNER_KEY_GAP.labels(scanner)
+        metrics.SCANNER_SCAN_RATE.labels(scanner).set_function(self.scans_per_minute)
+        self._thresholds(config)
+        self._seq_gaps = 0
+        self._seq_slow = 0
+        self._start(shift_start(config, datetime.now()))
+
+    def _thresholds(self, config) -> None:
+        self._reset_ns = int(config.key_reset_gap_ms * 1e6)
+        self._human_ns = int(config.human_key_gap_ms * 1e6)
+
+    def _start(self, shift: datetime) -> None:
+        self.shift = shift
+        self.started = time.time()
+        self.gaps = GapStats()
+        self.scans = 0
+        self.resets = {}
+        self.date_failures = 0
+        self.human = 0
+        self._rate = 0.0
+        self._rate_at = time.monotonic()
+
+    def _roll(self) -> None:
+        """Close the shift if it ended: write its summary and start the next one."""
+        current = shift_start(self.config, datetime.now())
+        if current != self.shift:
+            if self.scans or self.resets:
+                save(self.config, [self])
+            self._start(current)
+
+    def key(self, gap_ns: int) -> bool:
+        """A key-down `gap_ns` after the previous one in the same barcode. False: the partial barcode was dropped."""
+        if self._reset_ns and gap_ns > self._reset_ns:
+            self.discard("gap")
+            return False
+        self.gaps.add(gap_ns / 1e6)
+        self._gap_metric.observe(gap_ns / 1e9)
+        self._seq_gaps += 1
+        if gap_ns >= self._human_ns:
+            self._seq_slow += 1
+        return True
+
+    def end_sequence(self) -> bool:
+        """Enter ended a barcode. False: reject it as human input."""
+        human = self._seq_gaps >= 2 and self._seq_slow * 2 > self._seq_gaps
+        self._seq_gaps = self._seq_slow = 0
+        config = self.config = self.config.latest()
+        self._thresholds(config)
+        if not human:
+            return True
+        self.human += 1
+        metrics.SCANNER_HUMAN_INPUT.labels(self.scanner).inc()
+        if config.reject_human_input:
+            self.discard("human")
+            return False
+        return True
+
+    def discard(self, reason: str) -> None:
+        """A partial barcode was dropped."""
+        self._seq_gaps = self._seq_slow = 0
+        self._roll()
+        self.resets[reason] = self.resets.get(reason, 0) + 1
+        metrics.SCANNER_RESETS.labels(self.scanner, reason).inc()
+
+    def scan(self, rec) -> None:
+        """A framed barcode was spooled as `rec`."""
+        self._roll()
+        self.scans += 1
+        if rec.OrderDate is None:
+            self.date_failures += 1
+            metrics.SCANNER_DATE_UNPARSED.labels(self.scanner).inc()
+        now = time.monotonic()
+        self._rate = self._rate * math.exp((self._rate_at - now) / RATE_WINDOW_SEC) + 1.0
+        self._rate_at = now
+
+    def scans_per_minute(self) -> float:
+        """Recent scan rate, each scan's weight decaying with a one-minute time constant."""
+        rate = self._rate * math.exp((self._rate_at - time.monotonic()) / RATE_WINDOW_SEC)
+        return rate * 60.0 / RATE_WINDOW_SEC
+
+    def summary(self) -> dict:
+        gaps = self.gaps
+        minutes = max((time.time() - max(self.started, self.shift.timestamp())) / 60.0, 1.0)
+        return {
+            "scanner": self.scanner,
+            "shift": self.shift.isoformat(timespec="minutes"),
+            "scans": self.scans,
+            "scans_per_min": round(self.scans_per_minute(), 1),
+            "shift_scans_per_min": round(self.scans / minutes, 1),
+            "key_gap_ms": {
+                "n": gaps.n, "mean": round(gaps.mean, 2), "stddev": round(gaps.stddev, 2),
+                "min": gaps.min, "max": gaps.max,
+                "p50": gaps.quantile(0.5), "p90": gaps.quantile(0.9), "p99": gaps.quantile(0.99),
+            },
+            "resets": dict(self.resets),
+            "date_failures": self.date_failures,
+            "date_failure_share": round(self.date_failures / self.scans, 4) if self.scans else None,
+            "human_sequences": self.human,
+        }
+
+    def to_dict(self) -> dict:
+        return {"scanner": self.scanner, "shift": self.shift.isoformat(), "started": self.started,
+                "saved_at": time.time(), "gaps": self.gaps.to_dict(), "scans": self.scans,
+                "resets": self.resets, "date_failures": self.date_failures, "human": self.human,
+                "summary": self.summary()}
+
+    def restore(self, data: dict) -> None:
+        """Continue from a saved line of the same shift."""
+        self.started = float(data["started"])
+        self.gaps = GapStats.from_dict(data["gaps"])
+        self.scans = int(data["scans"])
+        self.resets = {str(k): int(v) for k, v in data.get("resets", {}).items()}
+        self.date_failures = int(data["date_failures"])
+        self.human = int(data["human"])
+
+
+def _last_lines(path: str) -> dict:
+    """The newest saved line per scanner, from the tail of scanner_stats_file."""
+    try:
+        with open(path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+    except OSError:
+        return {}
+    out = {}
+    for line in tail.split(b"\n"):
+        try:
+            data = json.loads(line)
+            out[data["scanner"]] = data
+        except (ValueError, KeyError, TypeError):
+            continue
+    return out
+
+
+def save(config, sessions) -> None:
+    """Append one line per session to scanner_stats_file."""
+    path = config.scanner_stats_file
+    if not path:
+        return
+    text = "".join(json.dumps(s.to_dict(), separators=(",", ":")) + "\n" for s in sessions)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        created = not os.path.exists(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+        io_accounting.wrote("scanner_stats", len(text.encode("utf-8")), creates=int(created))
+    except OSError as e:
+        logger.error("Scanner stats not saved to %s: %s", path, e)
+
+
+class ScannerStats:
+    """The sessions of every scanner this process captures from."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sessions: dict = {}
+
+    def session(self, config, scanner: str) -> ScannerSession:
+        """The scanner's session, restored from scanner_stats_file when it was saved during this shift."""
+        with self._lock:
+            session = self.sessions.get(scanner)
+            if session is not None:
+                return session
+            session = ScannerSession(config, scanner)
+            saved = _last_lines(config.scanner_stats_file).get(scanner) if config.scanner_stats_file else None
+            if saved is not None and saved.get("shift") == session.shift.isoformat():
+                try:
+                    session.restore(saved)
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error("Saved stats for scanner %s unreadable, starting empty: %s", scanner, e)
+            self.sessions[scanner] = session
+            return session
+
+    def save(self, config) -> None:
+        """Write every session with something in it; called when capture stops."""
+        with self._lock:
+            sessions = [s for s in self.sessions.values() if s.scans or s.resets]
+        save(config, sessions)
+
+    def status(self) -> dict:
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return {s.scanner: s.summary() for s in sessions}
+
+
+stats = ScannerStats()
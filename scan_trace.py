@@ -0,0 +1,56 @@
+import time
+
+# Stage timestamps carried in a spool record's "Trace" field. All values are
+# time.monotonic_ns() readings, which are only comparable within one boot, so
+# every trace also records the kernel boot id it was taken under.
+STAGES = ("key", "enter", "spool", "durable", "read", "commit")
+
+STAGE_LABELS = {
+    ("key", "enter"): "key_to_enter",
+    ("enter", "spool"): "enter_to_spool",
+    ("spool", "durable"): "spool_to_durable",
+    ("durable", "read"): "durable_to_flush_read",
+    ("read", "commit"): "flush_read_to_commit",
+    ("key", "commit"): "end_to_end",
+}
+
+
+def _read_boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+BOOT_ID = _read_boot_id()
+
+
+def now_ns() -> int:
+    return time.monotonic_ns()
+
+
+def new_trace(first_key_ns: int | None, enter_ns: int) -> dict:
+    return {"boot": BOOT_ID, "key": first_key_ns, "enter": enter_ns}
+
+
+def same_boot(trace: dict | None) -> bool:
+    return bool(trace) and trace.get("boot") == BOOT_ID
+
+
+def stage_durations(trace: dict) -> dict:
+    """Seconds between consecutive stages (plus end-to-end) for one trace."""
+    out = {}
+    for (start, end), label in STAGE_LABELS.items():
+        a, b = trace.get(start), trace.get(end)
+        if a is not None and b is not None and b >= a:
+            out[label] = (b - a) / 1e9
+    return out
+
+
+def percentile(sorted_values: list, pct: float):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
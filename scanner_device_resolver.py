@@ -1,21 +1,15 @@
 import os
 import pathlib
-from typing import Any
 
-def config_get(config: dict, *keys: str, default: Any = None) -> Any:
-    """Return the first non-None config value for the provided keys."""
-    for key in keys:
-        if key in config and config[key] is not None:
-            return config[key]
-    return default
+from config_utils import Config
 
 
-def resolve_scanner_device(config: dict) -> str:   
-    configured = config_get(config, "scanner_input_device", "Scanner_input_device")
+def resolve_scanner_device(config: Config) -> str:   
+    configured = config.scanner_input_device
     if configured and os.path.exists(configured):
         return configured
 
-    preferred = config_get(config, "scanner_device_filter", "Scanner_device_filter")
+    preferred = config.scanner_device_filter
     by_id = pathlib.Path("/dev/input/by-id")
     if by_id.exists():
         candidates = sorted(by_id.glob("*event-kbd"))
@@ -34,9 +28,9 @@ def resolve_scanner_device(config: dict) -> str:
     return configured or "/dev/input/event0"
 
 
-def resolve_user(config: dict, dev_path: str) -> str:
+def resolve_user(config: Config, dev_path: str) -> str:
     
-    user_map = config.get("scanner_user_map") or {}
+    user_map = config.scanner_user_map
     if dev_path in user_map:
         return user_map[dev_path]
 
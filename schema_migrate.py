@@ -0,0 +1,210 @@
+"""
+Move an existing scan table to the optimized schema ("db_schema": "optimized").
+
+    python schema_migrate.py plan   [--online] [--recluster]
+    python schema_migrate.py apply  [--online] [--recluster]
+    python schema_migrate.py archive --older-than-days 90
+
+Steps, each skipped when already done, so the tool can be re-run after an
+interruption:
+
+  1. Narrow NVARCHAR(MAX) Barcode/FlightNo to the optimized widths (refused
+     if existing data is longer).
+  2. --recluster: add a unique nonclustered (DeviceID, EntryNo) index, drop
+     the clustered primary key and cluster on (ScanDate, ID). Uniqueness is
+     enforced throughout, so the flush worker keeps running.
+  3. Create the (OrderDate, FlightNo) and ContainerCode reporting indexes.
+  4. With db_archive_table set, create the columnstore archive table.
+
+--online adds WITH (ONLINE = ON) (Enterprise/Azure SQL) so writers are not
+blocked while columns are altered and indexes are built.
+
+`archive` moves whole days older than N days into db_archive_table, one
+transaction per day.
+"""
+import argparse
+import logging
+from datetime import date, timedelta
+
+from config_utils import Config, load_config
+from sql_connection import (
+    OPTIMIZED_COLUMNS,
+    _object_base_name,
+    _quote_table_name,
+    connect_db,
+    index_exists,
+    optimized_indexes,
+)
+
+logger = logging.getLogger("schema_migrate")
+
+NARROWED_COLUMNS = ("Barcode", "FlightNo")
+
+ARCHIVE_TABLE_TEMPLATE = """
+CREATE TABLE {table_name} (
+{columns}
+);
+""".strip()
+
+
+def _scalar(conn, sql: str, *params):
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, *params)
+        row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        cur.close()
+
+
+def _table_exists(conn, table: str) -> bool:
+    return _scalar(conn, "SELECT OBJECT_ID(?, 'U')", table) is not None
+
+
+def _column_width(sql_type: str) -> int:
+    return int(sql_type.split("(", 1)[1].split(")", 1)[0])
+
+
+def _primary_key(conn, table: str):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT name, type_desc FROM sys.indexes WHERE object_id = OBJECT_ID(?) AND is_primary_key = 1", table)
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+def plan_migration(conn, config: Config, online: bool = False, recluster: bool = False) -> list:
+    """[(description, [statements])] still needed to reach the optimized schema."""
+    table = config.table_name
+    quoted_table = _quote_table_name(table)
+    base = _object_base_name(table)
+    with_online = " WITH (ONLINE = ON)" if online else ""
+    types = dict(OPTIMIZED_COLUMNS)
+    steps = []
+
+    for column in NARROWED_COLUMNS:
+        length = _scalar(conn, "SELECT CHARACTER_MAXIMUM_LENGTH FROM INFORMATION_SCHEMA.COLUMNS "
+                               "WHERE TABLE_NAME = ? AND COLUMN_NAME = ?", table.split(".")[-1], column)
+        if length != -1:
+            continue
+        width = _column_width(types[column])
+        longest = _scalar(conn, f"SELECT MAX(LEN({column})) FROM {quoted_table}") or 0
+        if longest > width:
+            raise ValueError(f"{column} has values of {longest} characters; the optimized width is {width}")
+        steps.append((f"narrow {column} to {types[column]}",
+                      [f"ALTER TABLE {quoted_table} ALTER COLUMN {column} {types[column]}{with_online}"]))
+
+    indexes = optimized_indexes(table, config.db_partition_scheme, online)
+    pk = _primary_key(conn, table)
+    if recluster and pk is not None and str(pk[1]).upper() == "CLUSTERED":
+        unique_name = f"UX_{base}_DeviceID_EntryNo"
+        statements = []
+        if not index_exists(conn, table, unique_name):
+            statements.append(f"CREATE UNIQUE NONCLUSTERED INDEX [{unique_name}] ON {quoted_table} "
+                              f"(DeviceID, EntryNo){with_online}")
+        statements.append(f"ALTER TABLE {quoted_table} DROP CONSTRAINT {_quote_table_name(pk[0])}{with_online}")
+        steps.append(("replace clustered primary key with a unique nonclustered index", statements))
+        reclustered = True
+    else:
+        reclustered = pk is None or str(pk[1]).upper() != "CLUSTERED"
+
+    for name, clustered, sql in indexes:
+        if clustered and not reclustered:
+            continue
+        if not index_exists(conn, table, name):
+            steps.append((f"create index {name}", [sql]))
+
+    archive = config.db_archive_table
+    if archive and not _table_exists(conn, archive):
+        columns = ",\n".join(f"    {name} {sql_type}" for name, sql_type in OPTIMIZED_COLUMNS)
+        steps.append((f"create columnstore archive table {archive}", [
+            ARCHIVE_TABLE_TEMPLATE.format(table_name=_quote_table_name(archive), columns=columns),
+            f"CREATE CLUSTERED COLUMNSTORE INDEX [CCI_{_object_base_name(archive)}] ON {_quote_table_name(archive)}",
+        ]))
+    return steps
+
+
+def apply_migration(conn, steps: list) -> None:
+    for description, statements in steps:
+        logger.info("Applying: %s", description)
+        cur = conn.cursor()
+        try:
+            for sql in statements:
+                cur.execute(sql)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def archive_older_than(conn, config: Config, days: int) -> int:
+    """Move whole days older than `days` into db_archive_table. Returns rows moved."""
+    archive = config.db_archive_table
+    if not archive:
+        raise ValueError("Set db_archive_table in config.json first.")
+    quoted_table = _quote_table_name(config.table_name)
+    quoted_archive = _quote_table_name(archive)
+    columns = ", ".join(name for name, _ in OPTIMIZED_COLUMNS)
+    cutoff = date.today() - timedelta(days=days)
+
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT DISTINCT ScanDate FROM {quoted_table} WHERE ScanDate < ? ORDER BY ScanDate", cutoff)
+        days_to_move = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+    moved = 0
+    for day in days_to_move:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"INSERT INTO {quoted_archive} ({columns}) SELECT {columns} FROM {quoted_table} WHERE ScanDate = ?", day)
+            cur.execute(f"DELETE FROM {quoted_table} WHERE ScanDate = ?", day)
+            moved += max(cur.rowcount, 0)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        logger.info("Archived %s", day)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimized schema migration")
+    parser.add_argument("command", choices=("plan", "apply", "archive"))
+    parser.add_argument("--online", action="store_true", help="use ONLINE = ON (Enterprise/Azure SQL)")
+    parser.add_argument("--recluster", action="store_true", help="move the clustered index to (ScanDate, ID)")
+    parser.add_argument("--older-than-days", type=int, default=90)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    config = load_config()
+    conn = connect_db(config)
+    try:
+        if args.command == "archive":
+            print(f"moved {archive_older_than(conn, config, args.older_than_days)} rows to {config.db_archive_table}")
+            return
+        if not _table_exists(conn, config.table_name):
+            raise SystemExit(f"{config.table_name} does not exist; the flush worker creates it with db_schema.")
+        steps = plan_migration(conn, config, args.online, args.recluster)
+        if not steps:
+            print("Schema is already optimized.")
+            return
+        for description, statements in steps:
+            print(f"-- {description}")
+            for sql in statements:
+                print(sql + ";")
+        if args.command == "apply":
+            apply_migration(conn, steps)
+            print("Done.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
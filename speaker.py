@@ -1,47 +1,180 @@
-import queue
+import heapq
+import importlib.util
+import itertools
 import threading
 import logging
+import time
 from typing import Optional
 
-try:
-    import simpleaudio  
-except Exception:
-    simpleaudio = None
+import metrics
+from config_utils import Config
 
 logger = logging.getLogger("speaker")
 
-def config_get(config: dict, *keys: str, default=None):
-    for key in keys:
-        if key in config and config[key] is not None:
-            return config[key]
-    return default
+# simpleaudio is imported on the audio thread by the first alert, so that
+# constructing the service does not delay scanner start-up.
+simpleaudio = None
 
 
-class SpeakerService:    
-    def __init__(self, config: dict, stop_event, max_queue_size: int = 50):
+def _simpleaudio_installed() -> bool:
+    return simpleaudio is not None or importlib.util.find_spec("simpleaudio") is not None
+
+
+def _load_simpleaudio():
+    global simpleaudio
+    if simpleaudio is None:
+        try:
+            import simpleaudio as _simpleaudio
+        except Exception as e:
+            logger.error("simpleaudio import failed: %s", e)
+            return None
+        simpleaudio = _simpleaudio
+    return simpleaudio
+
+# Lower number = more urgent. Events not listed here get DEFAULT_PRIORITY.
+DEFAULT_PRIORITIES = {
+    "network_lost": 0,
+    "invalid_label": 1,
+    "device_ready": 5,
+}
+DEFAULT_PRIORITY = 5
+
+# Minimum seconds between two plays of the same event.
+DEFAULT_MIN_INTERVAL_SEC = {
+    "network_lost": 30.0,
+}
+
+class AlertScheduler:
+    """
+    Pending voice alerts ordered by (priority, arrival).
+
+    An event that is already pending is not queued twice, an event played less
+    than its minimum interval ago is dropped, and when the scheduler is full the
+    least urgent pending alert is evicted. Consumers block on a condition, so an
+    idle worker does not wake up at all.
+    """
+
+    def __init__(self, max_size: int = 50, priorities: dict | None = None,
+                 min_intervals: dict | None = None, default_min_interval: float = 0.0,
+                 max_age: float | None = None):
+        self._cond = threading.Condition()
+        self._heap: list = []
+        self._pending: dict = {}
+        self._last_played: dict = {}
+        self._seq = itertools.count()
+        self._closed = False
+        self.configure(max_size, priorities, min_intervals, default_min_interval, max_age)
+
+    def configure(self, max_size: int = 50, priorities: dict | None = None,
+                  min_intervals: dict | None = None, default_min_interval: float = 0.0,
+                  max_age: float | None = None) -> None:
+        """Replace the scheduling policy; pending alerts keep their queued priority."""
+        with self._cond:
+            self.max_size = max(1, max_size)
+            self.priorities = dict(DEFAULT_PRIORITIES)
+            self.priorities.update(priorities or {})
+            self.min_intervals = dict(DEFAULT_MIN_INTERVAL_SEC)
+            self.min_intervals.update(min_intervals or {})
+            self.default_min_interval = default_min_interval
+            self.max_age = max_age
+
+    def priority_of(self, event_name: str) -> int:
+        return int(self.priorities.get(event_name, DEFAULT_PRIORITY))
+
+    def min_interval_of(self, event_name: str) -> float:
+        return float(self.min_intervals.get(event_name, self.default_min_interval))
+
+    def push(self, event_name: str) -> bool:
+        """Schedule an alert. Returns False if it was coalesced, rate-limited or dropped."""
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return False
+            if event_name in self._pending:
+                return False
+            last = self._last_played.get(event_name)
+            if last is not None and now - last < self.min_interval_of(event_name):
+                return False
+
+            entry = [self.priority_of(event_name), next(self._seq), event_name, now, True]
+            if len(self._pending) >= self.max_size:
+                victim = max(
+                    (e for e in self._heap if e[4]),
+                    key=lambda e: (e[0], -e[1]),
+                )
+                if entry[0] > victim[0]:
+                    return False
+                victim[4] = False
+                del self._pending[victim[2]]
+                logger.warning("Voice queue full; evicted event=%s", victim[2])
+
+            heapq.heappush(self._heap, entry)
+            self._pending[event_name] = entry
+            self._cond.notify()
+            return True
+
+    def pop(self) -> Optional[str]:
+        """Block until an alert is due; returns None once the scheduler is closed."""
+        with self._cond:
+            while True:
+                while self._heap and not self._heap[0][4]:
+                    heapq.heappop(self._heap)
+                if self._closed:
+                    return None
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                entry = heapq.heappop(self._heap)
+                del self._pending[entry[2]]
+                if self.max_age is not None and time.monotonic() - entry[3] > self.max_age:
+                    logger.info("Dropping stale voice event=%s", entry[2])
+                    continue
+                self._last_played[entry[2]] = time.monotonic()
+                return entry[2]
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+
+class SpeakerService:
+    def __init__(self, config: Config, stop_event):
         self.config = config
         self.stop_event = stop_event
-        self.queue: "queue.Queue[str]" = queue.Queue(maxsize=max_queue_size)
-        self.thread: Optional[threading.Thread] = None
-
-        self.enabled = bool(config_get(config, "SPEAKER_ENABLED", "speaker_enabled", default=True))
-        self.voice_files = config_get(config, "voice_files", "speaker_voice_files", default=None) or {}
-        if not isinstance(self.voice_files, dict):
-            self.voice_files = {}
+        self.queue = AlertScheduler()
+        self._apply_config(config)
+        config.store.subscribe(lambda old, new: self._apply_config(new))
+        metrics.ALERT_QUEUE_DEPTH.set_function(lambda: len(self.queue))
 
-        self.audio_available = simpleaudio is not None and bool(self.voice_files)
+    def _apply_config(self, config: Config) -> None:
+        """Also the hot-reload hook: a disabled speaker is not started later on."""
+        self.config = config
+        self.enabled = config.speaker_enabled
+        self.voice_files = config.voice_files
+        min_interval = config.speaker_min_interval
+        self.queue.configure(
+            max_size=config.speaker_queue_size,
+            priorities=config.speaker_priorities,
+            min_intervals=min_interval if isinstance(min_interval, dict) else None,
+            default_min_interval=min_interval if isinstance(min_interval, float) else 0.0,
+            max_age=config.speaker_max_alert_age,
+        )
+        self.audio_available = _simpleaudio_installed() and bool(self.voice_files)
 
-    def start(self) -> None:
-        if self.thread is not None:
-            return
+    def can_start(self) -> bool:
         if not self.enabled:
             logger.info("Speaker disabled in config; skipping start.")
-            return
+            return False
         if not self.audio_available:
             logger.warning("Speaker audio unavailable (simpleaudio missing or no voice files); skipping start.")
-            return
-        self.thread = threading.Thread(target=self._worker, daemon=True)
-        self.thread.start()
+            return False
+        return True
 
     def enqueue(self, event_name: str) -> None:
         if not self.enabled or not self.audio_available:
@@ -50,13 +183,20 @@ class SpeakerService:
         if not path:
             logger.warning("No voice file mapped for event=%s", event_name)
             return
-        try:
-            self.queue.put_nowait(event_name)
+        if self.queue.push(event_name):
+            metrics.ALERTS.labels(event_name, "queued").inc()
             logger.info("Queued voice event=%s path=%s", event_name, path)
-        except queue.Full:
-            logger.warning("Voice queue full; dropping event=%s", event_name)
+        else:
+            metrics.ALERTS.labels(event_name, "suppressed").inc()
+            logger.debug("Voice event=%s coalesced or rate-limited", event_name)
+
+    def on_connectivity_change(self, old_state: str, new_state: str, reason: str) -> None:
+        """ConnectivityMonitor subscriber: announce when the database becomes unreachable."""
+        if new_state == "offline":
+            self.enqueue("network_lost")
 
     def _play_audio(self, path: str) -> None:
+        simpleaudio = _load_simpleaudio()
         if not simpleaudio:
             return
         try:
@@ -67,21 +207,17 @@ class SpeakerService:
         except Exception as e:
             logger.error("Voice playback failed for %s: %s", path, e)
 
-    def _worker(self) -> None:
-        while not self.stop_event.is_set():
-            try:
-                name = self.queue.get(timeout=0.2)
-            except queue.Empty:
-                continue
-
-            path = self.voice_files.get(name)
-            if not path:
-                logger.warning("No file path for queued voice event=%s", name)
-                continue
-            try:
-                self._play_audio(path)
-            except Exception as e:
-                logger.error("Voice worker error for %s: %s", path, e)
+    def play(self, name: str) -> None:
+        """Play one popped alert; blocks until the sound ends."""
+        path = self.voice_files.get(name)
+        if not path:
+            logger.warning("No file path for queued voice event=%s", name)
+            return
+        try:
+            self._play_audio(path)
+            metrics.ALERTS.labels(name, "played").inc()
+        except Exception as e:
+            logger.error("Voice worker error for %s: %s", path, e)
 
     def cleanup(self) -> None:
-        return
+        self.queue.close()
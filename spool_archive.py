@@ -0,0 +1,297 @@
+"""
+Compressed columnar archive of spool records, per device and day.
+
+    python spool_archive.py export [--unflushed] [--out DIR]
+    python spool_archive.py import PATH [PATH ...]
+    python spool_archive.py cat FILE
+
+The flush worker rotates the spool when spool_rotate_bytes is set: once
+everything in the spool is flushed and it has grown past that size, the
+file is moved aside. A thread of its own archives it into archive_dir and
+deletes it, while flushing carries on; rotated files left over by a crash
+or a failed archive are picked up again on the next idle pass. Each
+archiving run writes new files named <date>-<first>-<last>.scol after
+their EntryNo range, so it costs what it archives and never reads or
+rewrites earlier files. `export` writes the flushed (or, with --unflushed,
+the pending) part of the live spool without touching it, for copying off a
+site that has been offline; give it --out, as exported rows are archived
+again when the spool rotates. `import` bulk-loads archive files into
+table_name, skipping rows that are already there, so files can be imported
+more than once.
+
+File layout (.scol): MAGIC, a 4-byte big-endian header length, a JSON
+header, then one compressed blob per column. Each blob is the column as a
+JSON array (EntryNo as deltas), compressed with zstd (level 3) when the
+zstandard package is installed and with lzma (preset 6) otherwise.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import lzma
+import os
+import struct
+import sys
+from collections import defaultdict
+
+import io_accounting
+from scan_record import COLUMNS, ScanRecord
+
+logger = logging.getLogger("spool_archive")
+
+MAGIC = b"SCOL1\n"
+SUFFIX = ".scol"
+_HEADER_LEN = struct.Struct(">I")
+ZSTD_LEVEL = 3
+LZMA_PRESET = 6
+
+
+def _zstd_available() -> bool:
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return lzma.compress(data, preset=LZMA_PRESET)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    raise ValueError(f"Unknown archive codec: {codec}")
+
+
+def _encode_column(name: str, values: list) -> list:
+    if name == "EntryNo" and all(isinstance(v, int) for v in values):
+        prev = 0
+        deltas = []
+        for v in values:
+            deltas.append(v - prev)
+            prev = v
+        return deltas
+    return values
+
+
+def _decode_column(name: str, values: list) -> list:
+    if name == "EntryNo":
+        total = 0
+        out = []
+        for v in values:
+            total += v
+            out.append(total)
+        return out
+    return values
+
+
+def write_archive(path: str, records: list, codec: str | None = None) -> int:
+    """Write `records` (ScanRecords) to `path` atomically. Returns the file size."""
+    codec = codec or ("zstd" if _zstd_available() else "lzma")
+    entry_nos = [r.EntryNo for r in records]
+    blobs = []
+    for i, name in enumerate(COLUMNS):
+        column = _encode_column(name, [r[i] for r in records])
+        blobs.append(_compress(json.dumps(column, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), codec))
+    header = {
+        "version": 1,
+        "codec": codec,
+        "columns": list(COLUMNS),
+        "rows": len(records),
+        "device": records[0].DeviceID if records else None,
+        "date": records[0].ScanDate if records else None,
+        "entry_no": [min(entry_nos), max(entry_nos)] if entry_nos else None,
+        "blobs": [len(b) for b in blobs],
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, path)
+    io_accounting.wrote("archive", size, fsyncs=1, creates=1)
+    return size
+
+
+def read_archive(path: str) -> tuple[dict, list]:
+    """Return (header, ScanRecords) for an archive file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a spool archive: {path}")
+        (length,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+        header = json.loads(f.read(length))
+        columns = {}
+        for name, size in zip(header["columns"], header["blobs"]):
+            values = json.loads(_decompress(f.read(size), header["codec"]))
+            columns[name] = _decode_column(name, values)
+    rows = header["rows"]
+    ordered = [columns.get(name) or [None] * rows for name in COLUMNS]
+    return header, [ScanRecord._make(row + (None,)) for row in zip(*ordered)]
+
+
+def archive_path(archive_dir: str, device_id, scan_date, first_entry_no, last_entry_no) -> str:
+    """<archive_dir>/<device>/<date>-<first>-<last>.scol; the date prefix is what reconcile_days filters on."""
+    device = str(device_id or "unknown").replace(os.sep, "_")
+    return os.path.join(archive_dir, device, f"{scan_date or 'undated'}-{first_entry_no}-{last_entry_no}{SUFFIX}")
+
+
+def archive_records(records: list, archive_dir: str) -> list:
+    """
+    Write records to new per-device, per-day files (one row per
+    DeviceID/EntryNo), leaving earlier files alone. Archiving the same
+    records again replaces the same files. Returns the paths written.
+    """
+    groups = defaultdict(dict)
+    for rec in records:
+        groups[(rec.DeviceID, rec.ScanDate)][rec.EntryNo] = rec._replace(Trace=None)
+
+    written = []
+    for (device_id, scan_date), by_entry in groups.items():
+        entry_nos = sorted(by_entry)
+        path = archive_path(archive_dir, device_id, scan_date, entry_nos[0], entry_nos[-1])
+        write_archive(path, [by_entry[k] for k in entry_nos])
+        written.append(path)
+    return written
+
+
+def read_spool_range(spool_path: str, start: int = 0, end: int | None = None) -> list:
+    """ScanRecords from spool bytes [start, end); undecodable lines are skipped."""
+    records = []
+    with open(spool_path, "r", encoding="utf-8") as f:
+        f.seek(start)
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                records.append(ScanRecord.from_spool_line(line))
+            except ValueError:
+                continue
+    return records
+
+
+def archive_spool_file(spool_path: str, archive_dir: str, start: int = 0, end: int | None = None) -> list:
+    records = read_spool_range(spool_path, start, end)
+    if not records:
+        return []
+    written = archive_records(records, archive_dir)
+    logger.info("Archived %d spool records from %s into %d files", len(records), spool_path, len(written))
+    return written
+
+
+def _archive_files(paths: list) -> list:
+    out = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                out.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(SUFFIX))
+        else:
+            out.append(path)
+    return out
+
+
+def import_archives(config, paths: list) -> tuple[int, int]:
+    """
+    Bulk-load archive files into table_name. Rows whose (DeviceID, EntryNo)
+    already exist are skipped, so re-importing a file is harmless.
+    Returns (inserted, skipped).
+    """
+    from sql_connection import _quote_table_name, build_insert_sql, connect_db, ensure_table_exists
+
+    table = config.table_name
+    quoted_table = _quote_table_name(table)
+    summary = config.summary_post_entry
+    insert_sql = build_insert_sql(table, summary)
+    existing_sql = f"SELECT EntryNo FROM {quoted_table} WHERE DeviceID = ? AND EntryNo BETWEEN ? AND ?"
+
+    conn = None
+    inserted = skipped = 0
+    try:
+        conn = connect_db(config)
+        if conn is None:
+            raise ConnectionError("connect returned None")
+        ensure_table_exists(conn, table, config.db_schema == "optimized", config.db_partition_scheme)
+        for path in _archive_files(paths):
+            header, records = read_archive(path)
+            by_device = defaultdict(list)
+            for rec in records:
+                by_device[rec.DeviceID].append(rec)
+            cur = conn.cursor()
+            try:
+                if hasattr(cur, "fast_executemany"):
+                    cur.fast_executemany = True
+                rows = []
+                for device_id, recs in by_device.items():
+                    entry_nos = [r.EntryNo for r in recs]
+                    cur.execute(existing_sql, device_id, min(entry_nos), max(entry_nos))
+                    present = {row[0] for row in cur.fetchall()}
+                    rows.extend(r.params(summary) for r in recs if r.EntryNo not in present)
+                if rows:
+                    cur.executemany(insert_sql, rows)
+                conn.commit()
+            finally:
+                cur.close()
+            inserted += len(rows)
+            skipped += len(records) - len(rows)
+            logger.info("Imported %s: %d rows, %d already present", path, len(rows), len(records) - len(rows))
+    finally:
+        if conn is not None:
+            conn.close()
+    return inserted, skipped
+
+
+def main():
+    from config_utils import load_config
+    from sql_connection import load_spool_offset
+
+    parser = argparse.ArgumentParser(description="Columnar spool archives")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="archive the live spool without modifying it")
+    export.add_argument("--unflushed", action="store_true", help="archive records not yet flushed to the DB")
+    export.add_argument("--out", help="output directory (default: archive_dir)")
+    imp = sub.add_parser("import", help="load archive files or directories into the DB")
+    imp.add_argument("paths", nargs="+")
+    cat = sub.add_parser("cat", help="print an archive as JSON lines")
+    cat.add_argument("path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "cat":
+        _, records = read_archive(args.path)
+        for rec in records:
+            print(json.dumps(rec.to_dict(), ensure_ascii=False))
+        return
+
+    config = load_config()
+    if args.command == "import":
+        inserted, skipped = import_archives(config, args.paths)
+        print(f"inserted {inserted} rows, skipped {skipped} already present")
+        return
+
+    out = args.out or config.archive_dir
+    if not out:
+        raise SystemExit("Set archive_dir in config.json or pass --out.")
+    offset = load_spool_offset(config)
+    start, end = (offset, None) if args.unflushed else (0, offset)
+    spool_size = os.path.getsize(config.spool_file)
+    written = archive_spool_file(config.spool_file, out, start, end)
+    archived = sum(os.path.getsize(p) for p in written)
+    span = (spool_size if end is None else end) - start
+    print(f"{len(written)} files, {archived} bytes from {span} spool bytes")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
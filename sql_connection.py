@@ -1,16 +1,81 @@
+import fcntl
 import json
 import logging
 import os
+import queue
+import re
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-import pyodbc
+import checkpoint
+import flight_summary
+import io_accounting
+import metrics
+import scan_trace
+from config_utils import Config
+from connectivity import ConnectivityMonitor
 from db_utils import DatabaseConnector
+from scan_record import COLUMNS, SUMMARY_COLUMNS, ScanRecord
 
 logger = logging.getLogger("sql_connection")
 
+# Imported on first use by the DB thread so that importing this module (for
+# append_spool on the capture path) does not load the ODBC driver.
+pyodbc = None
+
+
+def _load_pyodbc():
+    global pyodbc
+    if pyodbc is None:
+        import pyodbc as _pyodbc
+        pyodbc = _pyodbc
+    return pyodbc
+
 stop_event = threading.Event()
 
+
+class FlushStatus:
+    """
+    Progress published by append_spool and db_flush_worker. Plain attribute
+    writes, so readers such as the UI can poll it without locking. `offset`
+    and `last_flushed_entry_no` follow the live lane; `lane_records` and
+    `lane_bytes` are what the backlog lane still has to send.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_spooled_entry_no = None
+        self.offset = None
+        self.last_flush_time = None
+        self.last_flushed_entry_no = None
+        self.rows_flushed = 0
+        self.lane_records = 0
+        self.lane_bytes = 0
+
+    def record_flush(self, offset: int, rows: int, last_entry_no) -> None:
+        with self._lock:
+            self.offset = offset
+            self.rows_flushed += rows
+            if last_entry_no is not None:
+                self.last_flushed_entry_no = last_entry_no
+            self.last_flush_time = time.time()
+
+    def record_backlog(self, rows: int, records: int) -> None:
+        with self._lock:
+            self.rows_flushed += rows
+            self.lane_records = max(0, self.lane_records - records)
+            self.last_flush_time = time.time()
+
+    def backlog_records(self):
+        if self.last_spooled_entry_no is None or self.last_flushed_entry_no is None:
+            return None
+        return max(0, self.last_spooled_entry_no - self.last_flushed_entry_no) + self.lane_records
+
+
+flush_status = FlushStatus()
+
 CREATE_TABLE_TEMPLATE = """
 CREATE TABLE {table_name} (
     ID BIGINT IDENTITY(1,1) NOT NULL,
@@ -37,23 +102,69 @@ CREATE TABLE {table_name} (
 );
 """.strip()
 
+# "db_schema": "optimized": bounded widths so reporting columns can be index
+# keys. Clustered on (ScanDate, ID), which follows insert order; the
+# (DeviceID, EntryNo) key that deduplicates flushes becomes nonclustered.
+OPTIMIZED_COLUMNS = (
+    ("DeviceID", "NVARCHAR(50) NOT NULL"),
+    ("ScannerName", "NVARCHAR(255) NULL"),
+    ("EntryNo", "INT NOT NULL"),
+    ("Barcode", "NVARCHAR(4000) NOT NULL"),
+    ("ScanDate", "DATE NOT NULL"),
+    ("ScanTime", "TIME(0) NOT NULL"),
+    ("UserID", "NVARCHAR(50) NULL"),
+    ("Stowage", "NVARCHAR(50) NULL"),
+    ("FlightNo", "NVARCHAR(50) NULL"),
+    ("OrderDate", "DATE NULL"),
+    ("DACS_CLASS", "NVARCHAR(20) NULL"),
+    ("Leg", "NVARCHAR(20) NULL"),
+    ("Gally", "NVARCHAR(20) NULL"),
+    ("BlockNo", "NVARCHAR(50) NULL"),
+    ("ContainerCode", "NVARCHAR(50) NULL"),
+    ("DES", "NVARCHAR(50) NULL"),
+    ("DACS_ACType", "NVARCHAR(50) NULL"),
+)
 
-def config_get(config: dict, *keys: str, default=None):
-    for key in keys:
-        if key in config and config[key] is not None:
-            return config[key]
-    return default
+OPTIMIZED_TABLE_TEMPLATE = """
+CREATE TABLE {table_name} (
+    ID BIGINT IDENTITY(1,1) NOT NULL,
+{columns},
 
+    CONSTRAINT {pk_name} PRIMARY KEY NONCLUSTERED (DeviceID, EntryNo){pk_filegroup}
+);
+""".strip()
 
-def log(config: dict, message: str) -> None:
-    logger.info(message)
+TRACE_TABLE_TEMPLATE = """
+CREATE TABLE {table_name} (
+    DeviceID NVARCHAR(50) NOT NULL,
+    EntryNo INT NOT NULL,
+    BootID CHAR(36) NULL,
+    FirstKeyNs BIGINT NULL,
+    EnterNs BIGINT NULL,
+    SpoolNs BIGINT NULL,
+    DurableNs BIGINT NULL,
+    FlushReadNs BIGINT NULL,
+    CommitNs BIGINT NULL,
+    CommittedAt DATETIME2(3) NOT NULL,
+
+    CONSTRAINT {pk_name} PRIMARY KEY CLUSTERED (DeviceID, EntryNo)
+);
+""".strip()
+
+
+def log(config: Config, message: str, **fields) -> None:
+    """Log via the queued handler; keyword fields become JSON keys when log_format is json."""
+    if fields:
+        logger.info(message, extra={"fields": fields})
+    else:
+        logger.info(message)
 
 
-def connect_db(config: dict):
-    connection_string = config_get(config, "sql_connection_string", "Sql_connection_credentials")
+def connect_db(config: Config):
+    connection_string = config.sql_connection_string
     if connection_string:
         log(config, "Connecting with config.json connection string.")
-        return pyodbc.connect(connection_string, autocommit=False)
+        return _load_pyodbc().connect(connection_string, autocommit=False)
     
     db = DatabaseConnector()
     log(config, "Connecting with db_cred.yaml settings.")
@@ -74,10 +185,58 @@ def _quote_table_name(table: str) -> str:
     return ".".join(quoted_parts)
 
 
-def ensure_table_exists(conn, table: str) -> bool:
+def _object_base_name(table: str) -> str:
+    return table.split(".")[-1].strip("[]").replace("]", "")
+
+
+def optimized_indexes(table: str, partition_scheme: str | None = None, online: bool = False) -> list:
+    """(index name, clustered, CREATE statement) for the optimized schema, clustered index first."""
+    quoted_table = _quote_table_name(table)
+    base = _object_base_name(table)
+    tail = (" WITH (ONLINE = ON)" if online else "") + (
+        f" ON {_quote_table_name(partition_scheme)}(ScanDate)" if partition_scheme else "")
+    return [
+        (f"CIX_{base}_ScanDate", True,
+         f"CREATE CLUSTERED INDEX [CIX_{base}_ScanDate] ON {quoted_table} (ScanDate, ID){tail}"),
+        (f"IX_{base}_OrderDate_FlightNo", False,
+         f"CREATE NONCLUSTERED INDEX [IX_{base}_OrderDate_FlightNo] ON {quoted_table} (OrderDate, FlightNo) "
+         f"INCLUDE (ContainerCode, DACS_CLASS, Leg, Gally, DeviceID, EntryNo){tail}"),
+        (f"IX_{base}_ContainerCode", False,
+         f"CREATE NONCLUSTERED INDEX [IX_{base}_ContainerCode] ON {quoted_table} (ContainerCode) "
+         f"INCLUDE (OrderDate, FlightNo, ScanDate){tail}"),
+    ]
+
+
+def index_exists(conn, table: str, index_name: str) -> bool:
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM sys.indexes WHERE name = ? AND object_id = OBJECT_ID(?)", index_name, table)
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+
+
+def create_optimized_indexes(conn, table: str, partition_scheme: str | None = None,
+                             online: bool = False, clustered: bool = True) -> list:
+    """Create whichever optimized-schema indexes are missing. Returns the names created."""
+    created = []
+    for name, is_clustered, sql in optimized_indexes(table, partition_scheme, online):
+        if (is_clustered and not clustered) or index_exists(conn, table, name):
+            continue
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+            conn.commit()
+        finally:
+            cur.close()
+        created.append(name)
+    return created
+
+
+def ensure_table_exists(conn, table: str, optimized: bool = False, partition_scheme: str | None = None) -> bool:
     """
     Ensure the target table exists. Returns True if created, False if already existed.
-   .
+    An existing table is never restructured here; see schema_migrate.py.
     """
     if conn is None:
         raise ValueError("No DB connection")
@@ -108,9 +267,20 @@ def ensure_table_exists(conn, table: str) -> bool:
             cur.execute(f"SELECT 1 FROM {quoted_table} WHERE 1=0")
             return False
 
-        create_sql = CREATE_TABLE_TEMPLATE.format(table_name=quoted_table)
+        if optimized:
+            create_sql = OPTIMIZED_TABLE_TEMPLATE.format(
+                table_name=quoted_table,
+                columns=",\n".join(f"    {name} {sql_type}" for name, sql_type in OPTIMIZED_COLUMNS),
+                pk_name=_quote_table_name("PK_" + _object_base_name(table)),
+                # A partitioned clustered index would otherwise force the unique key onto the scheme too.
+                pk_filegroup=" ON [PRIMARY]" if partition_scheme else "",
+            )
+        else:
+            create_sql = CREATE_TABLE_TEMPLATE.format(table_name=quoted_table)
         cur.execute(create_sql)
         conn.commit()
+        if optimized:
+            create_optimized_indexes(conn, table, partition_scheme)
         return True
     finally:
         try:
@@ -119,277 +289,934 @@ def ensure_table_exists(conn, table: str) -> bool:
             pass
 
 
-def load_entry_no(config: dict) -> int:
-    state_file = config_get(config, "state_file")
-    start_entry_no = int(config_get(config, "Starting_entry_no", "starting_entry_no", default=1))
-    if not state_file:
-        return start_entry_no
+def ensure_trace_table_exists(conn, trace_table: str) -> bool:
+    """Create the per-scan trace side table if missing. Returns True if created."""
+    quoted_table = _quote_table_name(trace_table)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT OBJECT_ID(?, 'U')", trace_table)
+        row = cur.fetchone()
+        if row and row[0] is not None:
+            return False
+        pk_name = "PK_" + _object_base_name(trace_table)
+        cur.execute(TRACE_TABLE_TEMPLATE.format(table_name=quoted_table, pk_name=_quote_table_name(pk_name)))
+        conn.commit()
+        return True
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
 
+
+def ensure_flight_summary_table_exists(conn, summary_table: str) -> bool:
+    """Create the per-flight summary table if missing. Returns True if created."""
+    cur = conn.cursor()
     try:
-        with open(state_file, "r", encoding="utf-8") as f:
-            state_data = json.load(f)
-            return int(state_data.get("last_entry_no", start_entry_no))
-    except (FileNotFoundError, json.JSONDecodeError):
-        return start_entry_no
-    except Exception as e:
-        logger.error("Error loading state file: %s", e)
-        return start_entry_no
-
-
-def save_entry_no(config: dict, next_entry_no: int) -> None:
-    state_file = config_get(config, "state_file")
+        cur.execute("SELECT OBJECT_ID(?, 'U')", summary_table)
+        row = cur.fetchone()
+        if row and row[0] is not None:
+            return False
+        pk_name = "PK_" + _object_base_name(summary_table)
+        cur.execute(flight_summary.SUMMARY_TABLE_TEMPLATE.format(
+            table_name=_quote_table_name(summary_table), pk_name=_quote_table_name(pk_name)))
+        conn.commit()
+        return True
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def flight_summary_table_name(config: Config) -> str | None:
+    """Name of the per-flight summary table, or None unless enabled in Summary_post_entry mode."""
+    if not config.summary_post_entry or not config.flight_summary_enabled:
+        return None
+    return config.flight_summary_table or f"{config.table_name}_FlightSummary"
+
+
+def trace_table_name(config: Config) -> str | None:
+    """Name of the trace side table, or None when tracing to the DB is off."""
+    if config.trace_table:
+        return config.trace_table
+    if config.trace_enabled:
+        return f"{config.table_name}_Trace"
+    return None
+
+
+def load_entry_no(config: Config) -> int:
+    """Next EntryNo to hand out; see checkpoint.recover_next_entry_no."""
+    return checkpoint.recover_next_entry_no(config)
+
+
+def save_entry_no(config: Config, next_entry_no: int, fsync: bool = False) -> None:
+    """
+    Per scan without a spool, per reserved block with an unsynced spool; with
+    a synced spool, its tail and the checkpoint carry the EntryNo.
+    """
+    state_file = config.state_file
     if not state_file:
         return
+    io_accounting.atomic_write_text("state", state_file, json.dumps({"last_entry_no": next_entry_no}), fsync=fsync)
 
-    os.makedirs(os.path.dirname(state_file), exist_ok=True)
-    tmp = state_file + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump({"last_entry_no": next_entry_no}, f)
-    os.replace(tmp, state_file)
 
+def load_spool_offset(config: Config) -> int:
+    """The flushed spool offset, as the flush worker will resume from it."""
+    return checkpoint.resume_offset(config)
 
-def load_spool_offset(config: dict) -> int:
-    spool_offset_file = config_get(config, "spool_offset_file")
-    if not spool_offset_file:
-        return 0
+
+def spool_backlog_bytes(config: Config, offset: int | None) -> int | None:
+    """Bytes appended to the spool that db_flush_worker has not flushed yet, in either lane."""
+    spool_file = config.spool_file
+    if not spool_file or offset is None:
+        return None
     try:
-        with open(spool_offset_file, "r", encoding="utf-8") as f:
-            return int(f.read().strip() or "0")
-    except FileNotFoundError:
-        return 0
-    except Exception as e:
-        logger.error("Error loading spool offset file: %s", e)
-        return 0
-
-
-def save_spool_offset(config: dict, offset: int) -> None:
-    spool_offset_file = config_get(config, "spool_offset_file")
-    if not spool_offset_file:
-        return
+        return max(0, os.path.getsize(spool_file) - offset) + flush_status.lane_bytes
+    except OSError:
+        return None
 
-    os.makedirs(os.path.dirname(spool_offset_file), exist_ok=True)
-    tmp = spool_offset_file + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        f.write(str(offset))
-    os.replace(tmp, spool_offset_file)
 
+def spool_fsync_enabled(config: Config) -> bool:
+    """spool_fsync, forced on without a state_file to reserve EntryNos in (checkpoint rule 5)."""
+    return config.spool_fsync or not config.state_file
 
-def append_spool(config: dict, record: dict) -> None:
-    spool_file = config_get(config, "spool_file")
+
+def append_spool(config: Config, record: ScanRecord) -> None:
+    spool_file = config.spool_file
     if not spool_file:
         return
 
     os.makedirs(os.path.dirname(spool_file), exist_ok=True)
-    line = json.dumps(record, ensure_ascii=False)
-    with open(spool_file, "a", encoding="utf-8", buffering=1) as f:
-        f.write(line + "\n")
+    trace = record.Trace
+    if trace is not None:
+        trace["spool"] = scan_trace.now_ns()
+    line = record.to_spool_line()
+    nbytes = len(line.encode("utf-8"))
+    fsync = spool_fsync_enabled(config)
+    with _open_spool_for_append(spool_file) as f:
+        f.write(line)
         f.flush()
-        os.fsync(f.fileno())
+        if fsync:
+            os.fsync(f.fileno())
+    io_accounting.wrote("spool", nbytes, fsyncs=1 if fsync else 0)
+    _remember_durable(record.EntryNo, scan_trace.now_ns())
+    flush_status.last_spooled_entry_no = record.EntryNo
+    metrics.SPOOLED.inc()
+    metrics.SPOOL_BYTES.inc(nbytes)
 
 
-def db_flush_worker(config: dict, speaker=None) -> None:
-    Summary_post_entry = int(config_get(config, "Summary_post_entry", default=0)) == 1
-    table = config_get(config, "table_name", "Table_name")
-    if not table:
-        raise ValueError("Missing table name: table_name/Table_name")
-    quoted_table = _quote_table_name(table)
+def _open_spool_for_append(spool_file: str):
+    """
+    Open the spool for appending under a shared lock. rotate_spool takes the
+    lock exclusively before moving the file aside; if it did so between our
+    open() and flock(), reopen so the record lands in the new spool.
+    """
+    while True:
+        f = open(spool_file, "a", encoding="utf-8", buffering=1)
+        fcntl.flock(f, fcntl.LOCK_SH)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(spool_file).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
 
-    flush_interval = float(config_get(config, "db_flush_interval_sec", "db_save_interval", default=1.0))
-    heartbeat_interval = float(config_get(config, "db_heartbeat_interval_sec", default=10.0))
-    conn = None
-    offset = load_spool_offset(config)
-    last_heartbeat = 0.0
-
-    if Summary_post_entry:
-        insert_sql = f"""
-        INSERT INTO {quoted_table}
-        (DeviceID, ScannerName, EntryNo, Barcode, ScanDate, ScanTime, UserID)
-        VALUES (?, ?, ?, ?, ?, ?, ?)"""
-    else:
-        insert_sql = f"""
-            INSERT INTO {quoted_table}
-            (DeviceID, ScannerName, EntryNo, Barcode, ScanDate, ScanTime, UserID,
-            Stowage, FlightNo, OrderDate, DACS_CLASS, Leg, Gally, BlockNo, ContainerCode, DES, DACS_ACType)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
 
-    network_alerted = False
+def rotate_spool(config: Config, ckpt: checkpoint.Checkpoint) -> str | None:
+    """
+    Move the spool aside once every record in it is flushed and it has grown
+    past spool_rotate_bytes. Returns the rotated path, or None if the spool
+    was left in place. Only the flush worker may call this: it owns the checkpoint.
+    """
+    spool_file = config.spool_file
+    offset = ckpt.offset
+    if not config.spool_rotate_bytes or offset < config.spool_rotate_bytes:
+        return None
+    with open(spool_file, "a", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.fstat(f.fileno()).st_size != offset:
+            return None
+        rotated = f"{spool_file}.{time.strftime('%Y%m%d-%H%M%S')}"
+        # Flight totals first, counting the whole spool: after the reset they
+        # would be tagged with the new, empty one.
+        ckpt.save(config, force=True)
+        # Offset first: a crash before the rename re-sends the old spool, which
+        # the row-by-row duplicate handling absorbs; the reverse would skip records.
+        ckpt.reset(0)
+        ckpt.save(config, force=True)
+        os.replace(spool_file, rotated)
+    return rotated
+
 
-    def _params(rec):
-        if Summary_post_entry:
-            return (
-                rec["DeviceID"], rec.get("ScannerName"), rec["EntryNo"], rec["Barcode"],
-                rec["ScanDate"], rec["ScanTime"], rec.get("UserID"),
-            )
-        return (
-            rec["DeviceID"], rec.get("ScannerName"), rec["EntryNo"], rec["Barcode"],
-            rec["ScanDate"], rec["ScanTime"], rec.get("UserID"),
-            rec.get("Stowage"), rec.get("FlightNo"), rec.get("OrderDate"),
-            rec.get("DACS_CLASS"), rec.get("Leg"), rec.get("Gally"),
-            rec.get("BlockNo"), rec.get("ContainerCode"), rec.get("DES"), rec.get("DACS_ACType"),
-        ) 
-
-    while not stop_event.is_set():
-        batch = []
-        new_offset = offset
+def rotated_spools(config: Config) -> list:
+    """Rotated spools (spool_file.YYYYMMDD-HHMMSS) still waiting to be archived and removed, oldest first."""
+    spool_file = config.spool_file
+    if not spool_file:
+        return []
+    directory = os.path.dirname(spool_file) or "."
+    pattern = re.compile(re.escape(os.path.basename(spool_file)) + r"\.\d{8}-\d{6}$")
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if pattern.match(name)]
 
+
+def archive_rotated_spools(config: Config, paths: list) -> bool:
+    """
+    Archive rotated spools into archive_dir (when set) and delete them.
+    Runs on the flusher's archive thread. Returns False if one failed; it
+    stays in place for the next attempt.
+    """
+    ok = True
+    for rotated in paths:
+        if config.archive_dir:
+            import spool_archive
+            try:
+                spool_archive.archive_spool_file(rotated, config.archive_dir)
+            except Exception as e:
+                log(config, f"Spool archive failed, keeping {rotated}: {e}")
+                ok = False
+                continue
         try:
-            if conn is None:
-                conn = connect_db(config)
-                if conn is None:
-                    log(config, "DB connect returned None; retry in 5s.")
-                    if speaker is not None and not network_alerted:
-                        log(config, "Enqueueing network_lost (connect returned None).")
-                        try:
-                            speaker.enqueue("network_lost")
-                        except Exception as ex:
-                            log(config, f"Failed to enqueue network_lost (connect): {ex}")
-                        network_alerted = True
-                    time.sleep(5)
-                    continue
-                try:
-                    created = ensure_table_exists(conn, table)
-                    if created:
-                        log(config, f"Created missing table: {table}")
-                except Exception as e:
-                    log(config, f"Table check/create failed for {table}: {e}")
-                log(config, "DB connected.")
-                network_alerted = False
+            os.remove(rotated)
+        except OSError as e:
+            log(config, f"Rotated spool {rotated} not removed: {e}")
+            ok = False
+    return ok
 
-            time.sleep(flush_interval)
 
-            spool_path = config_get(config, "spool_file")
-            if not spool_path or not os.path.exists(spool_path):
+# The fsync-complete time cannot be written into the line being fsynced, so
+# append_spool keeps it here for the flusher, for untraced records too (they
+# have no stamps in the spool). After a restart, or with capture in another
+# process, it is gone and the flusher falls back to the "spool" (write
+# issued) stamp, or to ScanDate/ScanTime.
+_durable_ns: dict = {}
+_DURABLE_NS_MAX = 10000
+_durable_lock = threading.Lock()
+
+
+def _remember_durable(entry_no, ns: int) -> None:
+    with _durable_lock:
+        if len(_durable_ns) >= _DURABLE_NS_MAX:
+            _durable_ns.pop(next(iter(_durable_ns)))
+        _durable_ns[entry_no] = ns
+
+
+def _stamp_read(batch: list, read_ns: int) -> None:
+    with _durable_lock:
+        for rec in batch:
+            trace = rec.Trace
+            if trace is None:
                 continue
+            durable = _durable_ns.pop(rec.EntryNo, None)
+            if durable is not None and scan_trace.same_boot(trace):
+                trace["durable"] = durable
+            trace["read"] = read_ns
 
-            with open(spool_path, "r", encoding="utf-8") as f:
-                f.seek(offset)
-                while True:
-                    line = f.readline()
-                    if not line:
-                        break
-                    line = line.strip()
-                    if not line:
-                        new_offset = f.tell()
-                        continue
+
+def _trace_params(rec: ScanRecord, commit_ns: int, committed_at: datetime):
+    trace = rec.Trace or {}
+    return (
+        rec.DeviceID, rec.EntryNo, trace.get("boot"),
+        trace.get("key"), trace.get("enter"), trace.get("spool"), trace.get("durable"),
+        trace.get("read") if scan_trace.same_boot(trace) else None,
+        commit_ns if scan_trace.same_boot(trace) else None,
+        committed_at,
+    )
+
+
+def read_spool_batch(spool_path: str, offset: int, max_records: int = 0) -> tuple[list, int]:
+    """
+    Read complete records after `offset`, at most `max_records` when > 0.
+    Returns (ScanRecords, new_offset); blank and undecodable lines are
+    skipped but still advance the offset.
+    """
+    batch = []
+    new_offset = offset
+    with open(spool_path, "r", encoding="utf-8") as f:
+        f.seek(offset)
+        while not max_records or len(batch) < max_records:
+            line = f.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                new_offset = f.tell()
+                continue
+            try:
+                batch.append(ScanRecord.from_spool_line(line))
+                new_offset = f.tell()
+            except Exception:
+                new_offset = f.tell()
+    return batch, new_offset
+
+
+def _observe_commit_latency(batch: list, committed_at: float) -> None:
+    """
+    Spool-to-commit latency per record: from the monotonic trace stamps when
+    the record was spooled during this boot, from the durable time
+    append_spool kept for an untraced one, otherwise from ScanDate/ScanTime
+    (1 s resolution).
+    """
+    commit_ns = scan_trace.now_ns()
+    for rec in batch:
+        trace = rec.Trace
+        if scan_trace.same_boot(trace) and trace.get("spool") is not None:
+            spooled = trace.get("durable") or trace["spool"]
+            metrics.SPOOL_TO_COMMIT.observe(max(0.0, (commit_ns - spooled) / 1e9))
+            continue
+        if trace is None:
+            with _durable_lock:
+                spooled = _durable_ns.pop(rec.EntryNo, None)
+            if spooled is not None:
+                metrics.SPOOL_TO_COMMIT.observe(max(0.0, (commit_ns - spooled) / 1e9))
+                continue
+        try:
+            scanned_at = datetime.fromisoformat(f"{rec.ScanDate}T{rec.ScanTime}").timestamp()
+        except (TypeError, ValueError):
+            continue
+        metrics.SPOOL_TO_COMMIT.observe(max(0.0, committed_at - scanned_at))
+
+
+def read_spool_ranges(spool_path: str, offset: int, max_records: int = 0, end: int | None = None) -> tuple[list, int]:
+    """
+    Like read_spool_batch, with byte positions: returns ([(start, end, ScanRecord)], new_offset).
+    Stops at `end` when given, and before a line with no newline yet.
+    """
+    entries = []
+    pos = offset
+    with open(spool_path, "rb") as f:
+        f.seek(offset)
+        while not max_records or len(entries) < max_records:
+            if end is not None and pos >= end:
+                break
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break
+            start, pos = pos, pos + len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append((start, pos, ScanRecord.from_spool_line(line.decode("utf-8"))))
+            except Exception:
+                continue
+    return entries, pos
+
+
+def _complete_lines_end(spool_path: str, offset: int) -> int:
+    """End of the last newline-terminated line in the spool, and never before `offset`."""
+    with open(spool_path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        start = max(offset, size - checkpoint.TAIL_BYTES)
+        f.seek(start)
+        i = f.read(size - start).rfind(b"\n")
+    return offset if i < 0 else start + i + 1
+
+
+def summary_after_insert(config: Config):
+    """
+    after_insert for insert_records that adds the inserted rows to the
+    per-flight summary table in the same transaction, or None when it is off.
+    """
+    summary_table = flight_summary_table_name(config)
+    if not summary_table:
+        return None
+    quoted_summary_table = _quote_table_name(summary_table)
+
+    def after_insert(cur, recs):
+        if recs:
+            flight_summary.upsert(cur, quoted_summary_table, flight_summary.aggregate(recs))
+    return after_insert
+
+
+def build_insert_sql(table: str, summary: bool) -> str:
+    """INSERT for ScanRecord.params(summary): the summary or the full column set."""
+    columns = SUMMARY_COLUMNS if summary else COLUMNS
+    return f"""
+        INSERT INTO {_quote_table_name(table)}
+        ({", ".join(columns)})
+        VALUES ({", ".join("?" * len(columns))})
+    """
+
+
+def insert_records(conn, insert_sql: str, recs: list, summary: bool, after_insert=None) -> list:
+    """
+    Insert and commit `recs`; on a duplicate, retry row by row. after_insert(cur, inserted)
+    runs in the same transaction. Returns the inserted records.
+    """
+    after_insert = after_insert or (lambda cur, inserted: None)
+    pyodbc = _load_pyodbc()
+    cur = conn.cursor()
+    try:
+        try:
+            for rec in recs:
+                cur.execute(insert_sql, *rec.params(summary))
+            after_insert(cur, recs)
+            conn.commit()
+            return recs
+        except pyodbc.IntegrityError:
+            conn.rollback()
+        inserted = []
+        for rec in recs:
+            try:
+                cur.execute(insert_sql, *rec.params(summary))
+                inserted.append(rec)
+            except pyodbc.IntegrityError:
+                continue
+        after_insert(cur, inserted)
+        conn.commit()
+        return inserted
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+class BacklogLane:
+    """
+    Drains spool bytes [start, end) in bulk while SpoolFlusher.step(), the
+    live lane, keeps sending what is appended after `end`. So after an
+    outage new scans reach SQL Server within a flush interval instead of
+    waiting behind the whole backlog.
+
+    The range is read catchup_max_records at a time and split into
+    partitions of catchup_partition_size, sent over catchup_connections
+    connections. Each partition is committed to the checkpoint as a byte
+    range as soon as its transaction commits, so a crash re-sends only the
+    partitions in flight. Records already inside a committed range (a
+    drain resumed after a restart) are not sent again. Failed partitions
+    are retried once the DB is reachable. The lane ends when the range is
+    drained, or on stop().
+    """
+
+    def __init__(self, flusher: "SpoolFlusher", start: int, end: int):
+        self.flusher = flusher
+        self.start = start
+        self.end = end
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="db_backlog", daemon=True)
+
+    def begin(self) -> "BacklogLane":
+        self.thread.start()
+        return self
+
+    def is_alive(self) -> bool:
+        return self.thread.is_alive()
+
+    def stop(self) -> None:
+        """Finish the partitions in flight, then return."""
+        self._stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def _stopping(self) -> bool:
+        return self._stop.is_set() or stop_event.is_set()
+
+    def _run(self) -> None:
+        config = self.flusher.config
+        last = checkpoint.last_spooled_entry_no(config.spool_file, self.end)
+        totals = {"rows": 0, "skipped": 0}
+        started = time.monotonic()
+        log(config, f"Backlog lane: draining spool bytes {self.start}-{self.end}.",
+            start_offset=self.start, end_offset=self.end)
+        metrics.CATCHUP_ACTIVE.set(1)
+        pos = self.start
+        try:
+            while pos < self.end and not self._stopping():
+                config = self.flusher.config
+                entries, chunk_end = read_spool_ranges(config.spool_file, pos, config.catchup_max_records, self.end)
+                if chunk_end == pos:
+                    log(config, f"Backlog lane: spool ends before offset {self.end}; stopping at {pos}.")
+                    return
+                if pos == self.start and entries and last is not None:
+                    flush_status.lane_records = max(0, last - entries[0][2].EntryNo + 1)
+                if not self._drain(config, self._partitions(entries, pos, chunk_end), totals):
+                    return
+                pos = chunk_end
+                flush_status.lane_bytes = self.end - pos
+        except Exception as e:
+            log(config, f"Backlog lane error at offset {pos}: {e}")
+            metrics.DB_ERRORS.labels("backlog").inc()
+            return
+        finally:
+            metrics.CATCHUP_ACTIVE.set(0)
+            flush_status.lane_records = flush_status.lane_bytes = 0
+            self.flusher.ckpt.save(self.flusher.config, force=True)
+        if pos >= self.end:
+            elapsed = time.monotonic() - started
+            log(config, f"Backlog lane done: inserted {totals['rows']} rows ({totals['skipped']} duplicates) "
+                        f"in {elapsed:.1f}s.",
+                inserted=totals["rows"], skipped=totals["skipped"], seconds=round(elapsed, 3), end_offset=self.end)
+
+    def _partitions(self, entries: list, start: int, end: int) -> list:
+        """
+        (start, end, records, count) per partition. The byte ranges tile
+        [start, end), so blank and undecodable lines are committed with their
+        neighbours; `records` leaves out those already committed.
+        """
+        config = self.flusher.config
+        ckpt = self.flusher.ckpt
+        size = max(1, config.catchup_partition_size)
+        groups = [entries[i:i + size] for i in range(0, len(entries), size)] or [[]]
+        bounds = [start] + [group[0][0] for group in groups[1:]] + [end]
+        return [(bounds[i], bounds[i + 1], [rec for s, e, rec in group if not ckpt.committed(s, e)], len(group))
+                for i, group in enumerate(groups)]
+
+    def _drain(self, config: Config, partitions: list, totals: dict) -> bool:
+        """Commit every partition, retrying failed ones. False if stopped first."""
+        pending = queue.SimpleQueue()
+        for part in partitions:
+            pending.put(part)
+        while not pending.empty():
+            if self._stopping():
+                return False
+            workers = max(1, min(config.catchup_connections, pending.qsize()))
+            threads = [threading.Thread(target=self._send, args=(config, pending, totals), name=f"db_backlog_{i}",
+                                        daemon=True) for i in range(workers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if not pending.empty() and not self._stopping():
+                self.flusher.connectivity.wait_reachable(5)
+        return True
+
+    def _send(self, config: Config, pending, totals: dict) -> None:
+        flusher = self.flusher
+        conn = None
+        try:
+            while not self._stopping():
+                try:
+                    start, end, recs, count = pending.get_nowait()
+                except queue.Empty:
+                    return
+                inserted = []
+                if recs:
                     try:
-                        rec = json.loads(line)
-                        batch.append(rec)
-                        new_offset = f.tell()
-                    except Exception:
-                        new_offset = f.tell()
+                        if conn is None:
+                            conn = connect_db(config)
+                            if conn is None:
+                                raise ConnectionError("connect returned None")
+                        _stamp_read(recs, scan_trace.now_ns())
+                        inserted = insert_records(conn, flusher.insert_sql, recs, flusher.summary,
+                                                  flusher._after_insert)
+                    except Exception as e:
+                        log(config, f"Backlog partition EntryNo {recs[0].EntryNo}-{recs[-1].EntryNo} failed: {e}")
+                        metrics.CATCHUP_PARTITIONS.labels("failed").inc()
+                        pending.put((start, end, recs, count))
+                        # A broken connection fails every partition after it; leave them for the retry.
+                        return
+                    _observe_commit_latency(inserted, time.time())
+                    metrics.FLUSHED_ROWS.inc(len(inserted))
+                    metrics.SKIPPED_ROWS.inc(len(recs) - len(inserted))
+                flusher._commit(start, end, recs, inserted)
+                metrics.CATCHUP_PARTITIONS.labels("done").inc()
+                flush_status.record_backlog(len(inserted), count)
+                with self._lock:
+                    totals["rows"] += len(inserted)
+                    totals["skipped"] += len(recs) - len(inserted)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+# What SpoolFlusher.step() did, which tells the caller how long to wait before the next step.
+FLUSHED = "flushed"   # sent records: wait flush_interval so the next batch can fill
+IDLE = "idle"         # nothing new in the spool: wait for an append, or the heartbeat
+OFFLINE = "offline"   # the DB is unreachable: wait until a probe says otherwise (5 s at most)
+FAILED = "failed"     # anything else: back off 5 s
+
+ARCHIVE_RETRY_SEC = 300.0
+
+RECOUNT_READ_RECORDS = 50000
+
+
+class SpoolFlusher:
+    """
+    Sends the spool to SQL Server one step() at a time. step() blocks on
+    pyodbc, so it runs on the DB thread (db_flush_worker) or in the
+    runtime's DB executor. It must never run on two threads at once.
+    close() stops the backlog lane, writes the checkpoint and closes the
+    connection.
+
+    step() is the live lane: it sends what was appended since the last
+    step, in batches of flush_batch_size. When it finds catchup_threshold
+    records or more waiting (db_catchup_threshold_records, default 10000;
+    0 turns it off), everything up to the end of the spool is handed to a
+    BacklogLane and the live lane moves on to the end, so scans taken
+    during the drain are not queued behind it. Both lanes commit byte
+    ranges to the same checkpoint; `offset` here is only the live lane's
+    read position.
+    """
+
+    def __init__(self, config: Config, speaker=None, connectivity=None):
+        self.pyodbc = _load_pyodbc()
+        self.config = config
+        self.summary = config.summary_post_entry
+        self.table = config.table_name
+        if not self.table:
+            raise ValueError("Missing table name: table_name/Table_name")
+
+        self.conn = None
+        self.ckpt = checkpoint.Checkpoint(config)
+        # Past the committed ranges; the gap before them is drained again by a backlog lane.
+        self.offset = self.ckpt.resume_point
+        # Bytes the spool already held at start: a duplicate among them is a
+        # replay of our own commit after the last checkpoint write (rule 1).
+        try:
+            self.replay_end = os.path.getsize(config.spool_file) if config.spool_file else 0
+        except OSError:
+            self.replay_end = 0
+        self.lane = None
+        self.last_heartbeat = 0.0
+        # Rotated spools are archived on a thread of their own; the first idle
+        # pass also picks up any a crash or a failed archive left behind.
+        self._archiver = None
+        self._archiving = None
+        self._archive_due = True
+        self._archive_retry_at = 0.0
+        flush_status.offset = self.offset
+        metrics.SPOOL_BACKLOG_BYTES.set_function(lambda: spool_backlog_bytes(self.config, flush_status.offset))
+        metrics.SPOOL_BACKLOG_RECORDS.set_function(flush_status.backlog_records)
+
+        self.insert_sql = build_insert_sql(self.table, self.summary)
+
+        self.trace_table = trace_table_name(config)
+        self.trace_insert_sql = None
+        if self.trace_table:
+            self.trace_insert_sql = f"""
+                INSERT INTO {_quote_table_name(self.trace_table)}
+                (DeviceID, EntryNo, BootID, FirstKeyNs, EnterNs, SpoolNs, DurableNs, FlushReadNs, CommitNs, CommittedAt)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """
+
+        self.summary_table = flight_summary_table_name(config)
+        self._summary_after_insert = summary_after_insert(config)
+        if self.summary_table:
+            position = flight_summary.totals.load(config, self.ckpt.flights)
+            self._recount_flights(self.ckpt.uncounted(position))
+            self.ckpt.totals = flight_summary.totals
+
+        if connectivity is None:
+            connectivity = ConnectivityMonitor(config)
+            if speaker is not None:
+                connectivity.subscribe(speaker.on_connectivity_change)
+        self.connectivity = connectivity
+
+    def _recount_flights(self, ranges) -> None:
+        """Add the records in committed spool byte `ranges` to the flight totals (checkpoint rule 1)."""
+        counted = 0
+        for lo, hi in ranges:
+            pos = lo
+            while pos <= hi:
+                entries, new_pos = read_spool_ranges(self.config.spool_file, pos, RECOUNT_READ_RECORDS, hi + 1)
+                if new_pos == pos:
+                    break
+                flight_summary.totals.add(rec for _, _, rec in entries)
+                counted += len(entries)
+                pos = new_pos
+        if counted:
+            logger.info("Flight totals: counted %d committed records again from the spool", counted)
+
+    def _after_insert(self, cur, recs):
+        """Trace rows and per-flight totals, in the batch's transaction."""
+        if self._summary_after_insert is not None:
+            self._summary_after_insert(cur, recs)
+        if self.trace_insert_sql is None:
+            return
+        commit_ns = scan_trace.now_ns()
+        committed_at = datetime.now()
+        for rec in recs:
+            if rec.Trace is not None:
+                cur.execute(self.trace_insert_sql, *_trace_params(rec, commit_ns, committed_at))
+
+    def _commit(self, start: int, end: int, recs: list, inserted: list) -> None:
+        """
+        Mark spool bytes [start, end) committed, with `recs` the records sent
+        from them and `inserted` those the server took. Only inserted rows go
+        in the flight totals, except in bytes replayed after a restart, where
+        a duplicate is a row committed before the last checkpoint write. Both
+        lanes call this; the checkpoint is written at most every
+        checkpoint_interval_sec.
+        """
+        counted = recs if start < self.replay_end else inserted
+        with self.ckpt.lock:
+            if self.summary_table and counted:
+                flight_summary.totals.add(counted)
+            self.ckpt.commit(start, end, recs[-1].EntryNo if recs else None)
+            self.ckpt.save(self.config)
+
+    def _lane_active(self) -> bool:
+        return self.lane is not None and self.lane.is_alive()
+
+    def _start_lane(self, start: int, end: int) -> None:
+        self.lane = BacklogLane(self, start, end).begin()
+
+    def _connect(self) -> bool:
+        config = self.config
+        self.conn = connect_db(config)
+        if self.conn is None:
+            log(config, "DB connect returned None; retry in 5s.")
+            metrics.DB_ERRORS.labels("connect").inc()
+            self.connectivity.report_failure("db_connect", "connect returned None")
+            return False
+        table = self.table
+        try:
+            created = ensure_table_exists(self.conn, table, config.db_schema == "optimized",
+                                          config.db_partition_scheme)
+            if created:
+                log(config, f"Created missing table: {table}")
+        except Exception as e:
+            log(config, f"Table check/create failed for {table}: {e}")
+        if self.trace_table:
+            try:
+                if ensure_trace_table_exists(self.conn, self.trace_table):
+                    log(config, f"Created missing trace table: {self.trace_table}")
+            except Exception as e:
+                log(config, f"Trace table check/create failed for {self.trace_table}: {e}")
+        if self.summary_table:
+            try:
+                if ensure_flight_summary_table_exists(self.conn, self.summary_table):
+                    log(config, f"Created missing flight summary table: {self.summary_table}")
+            except Exception as e:
+                log(config, f"Flight summary table check/create failed for {self.summary_table}: {e}")
+        log(config, "DB connected.")
+        self.connectivity.report_success("db_connect")
+        return True
+
+    def _drop_connection(self) -> None:
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    def step(self) -> str:
+        """One pass: connect if needed, then flush, catch up or idle. Returns FLUSHED, IDLE, OFFLINE or FAILED."""
+        pyodbc = self.pyodbc
+        # Tunables may have been hot-reloaded since the last pass.
+        config = self.config = self.config.latest()
+        batch = []
+        try:
+            if self.conn is None and not self._connect():
+                return OFFLINE
+
+            spool_path = config.spool_file
+            if not spool_path or not os.path.exists(spool_path):
+                return IDLE
+
+            offset = self.offset
+            if not self._lane_active() and self.ckpt.offset < offset:
+                # A drain interrupted by a restart or an error: pick up the bytes it left.
+                self._start_lane(self.ckpt.offset, offset)
+            threshold = 0 if self._lane_active() else config.catchup_threshold
+            limit = config.flush_batch_size
+            if os.path.getsize(spool_path) == offset:
+                # Idle: nothing appended, so do not even open the spool.
+                batch, new_offset = [], offset
+            else:
+                # Never more than the threshold: a larger backlog goes to the lane unparsed.
+                batch, new_offset = read_spool_batch(spool_path, offset,
+                                                     max(limit, threshold) if threshold else limit)
+
+            if threshold and len(batch) >= threshold:
+                boundary = _complete_lines_end(spool_path, new_offset)
+                self._start_lane(offset, boundary)
+                self.offset = offset = boundary
+                flush_status.offset = offset
+                batch, new_offset = read_spool_batch(spool_path, offset, limit)
+            elif limit and len(batch) > limit:
+                batch, new_offset = read_spool_batch(spool_path, offset, limit)
 
             if not batch:
-                offset = new_offset
-                save_spool_offset(config, offset)
-                if conn is not None and (time.time() - last_heartbeat) >= heartbeat_interval:
-                    try:
-                        cur = conn.cursor()
-                        try:
-                            cur.execute("SELECT 1")
-                            cur.fetchone()
-                        finally:
-                            try:
-                                cur.close()
-                            except Exception:
-                                pass
-                        network_alerted = False
-                    except pyodbc.Error as e:
-                        log(config, f"DB heartbeat failed: {e}. Reconnecting in 5s.")
-                        if speaker is not None and not network_alerted:
-                            log(config, "Enqueueing network_lost (heartbeat failed).")
-                            try:
-                                speaker.enqueue("network_lost")
-                            except Exception:
-                                log(config, "Failed to enqueue network_lost (heartbeat): %s", e)
-                            network_alerted = True
-                        try:
-                            conn.close()
-                        except Exception:
-                            pass
-                        conn = None
-                        time.sleep(5)
-                    last_heartbeat = time.time()
-                continue
+                return self._idle(new_offset)
 
-            cur = conn.cursor()
+            _stamp_read(batch, scan_trace.now_ns())
+            cur = self.conn.cursor()
             try:
                 for rec in batch:
-                    cur.execute(
-                        insert_sql,
-                        *(_params(rec)) 
-                    )
-                conn.commit()
+                    cur.execute(self.insert_sql, *rec.params(self.summary))
+                self._after_insert(cur, batch)
+                self.conn.commit()
             finally:
                 try:
                     cur.close()
                 except Exception:
                     pass
 
-            offset = new_offset
-            save_spool_offset(config, offset)
-            log(config, f"DB flush: inserted {len(batch)} rows. offset={offset}")
-            network_alerted = False
+            self._commit(offset, new_offset, batch, batch)
+            self.offset = new_offset
+            flush_status.record_flush(self.offset, len(batch), batch[-1].EntryNo)
+            metrics.FLUSH_BATCH_SIZE.observe(len(batch))
+            metrics.FLUSHED_ROWS.inc(len(batch))
+            _observe_commit_latency(batch, time.time())
+            log(config, f"DB flush: inserted {len(batch)} rows. offset={self.offset}",
+                batch_size=len(batch), offset=self.offset,
+                first_entry_no=batch[0].EntryNo, last_entry_no=batch[-1].EntryNo)
+            self.connectivity.report_success("db_flush")
+            return FLUSHED
 
         except pyodbc.IntegrityError as e:
             log(config, f"DB integrity error: {e}. Trying row-by-row.")
+            metrics.DB_ERRORS.labels("integrity").inc()
+            return self._flush_row_by_row(batch, new_offset)
+
+        except pyodbc.Error as e:
+            log(config, f"DB error: {e}. Reconnecting in 5s.")
+            metrics.DB_ERRORS.labels("db").inc()
+            self.connectivity.report_failure("db_error", e)
             try:
-                conn.rollback()
+                self.conn.rollback()
             except Exception:
                 pass
+            self._drop_connection()
+            return OFFLINE
+
+        except Exception as e:
+            log(config, f"DB worker error: {e}")
+            metrics.DB_ERRORS.labels("worker").inc()
+            return FAILED
 
+    def _idle(self, new_offset: int) -> str:
+        """Nothing to send: checkpoint, maybe rotate, and keep the connection alive."""
+        config = self.config
+        if new_offset != self.offset:
+            self._commit(self.offset, new_offset, [], [])
+            self.offset = new_offset
+        self.ckpt.save(config)
+        rotated = None if self._lane_active() else rotate_spool(config, self.ckpt)
+        if rotated:
+            self.offset = 0
+            self.replay_end = 0
+            log(config, f"Spool rotated to {rotated}")
+            self._archive_due = True
+        self._archive_rotations()
+        flush_status.offset = self.offset
+        if self.conn is None or (time.time() - self.last_heartbeat) < config.heartbeat_interval:
+            return IDLE
+        self.last_heartbeat = time.time()
+        try:
+            cur = self.conn.cursor()
             try:
-                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            finally:
                 try:
-                    ok = 0
-                    for rec in batch:
-                        try:
-                            cur.execute(insert_sql, *_params(rec))
-                            ok += 1
-                        except pyodbc.IntegrityError:
-                            continue
-                    conn.commit()
-                finally:
+                    cur.close()
+                except Exception:
+                    pass
+            self.connectivity.report_success("db_heartbeat")
+            return IDLE
+        except self.pyodbc.Error as e:
+            log(config, f"DB heartbeat failed: {e}. Reconnecting in 5s.")
+            metrics.DB_ERRORS.labels("heartbeat").inc()
+            self.connectivity.report_failure("db_heartbeat", e)
+            self._drop_connection()
+            return OFFLINE
+
+    def _flush_row_by_row(self, batch: list, new_offset: int) -> str:
+        config = self.config
+        pyodbc = self.pyodbc
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+        try:
+            cur = self.conn.cursor()
+            try:
+                inserted = []
+                for rec in batch:
                     try:
-                        cur.close()
-                    except Exception:
-                        pass
-
-                offset = new_offset
-                save_spool_offset(config, offset)
-                log(config, f"DB flush row-by-row: inserted {ok}/{len(batch)}. offset={offset}")
-            except Exception as e2:
-                log(config, f"DB row-by-row failed: {e2}")
+                        cur.execute(self.insert_sql, *rec.params(self.summary))
+                        inserted.append(rec)
+                    except pyodbc.IntegrityError:
+                        continue
+                self._after_insert(cur, inserted)
+                self.conn.commit()
+                ok = len(inserted)
+            finally:
                 try:
-                    conn.rollback()
+                    cur.close()
                 except Exception:
                     pass
-                time.sleep(5)
 
-        except pyodbc.Error as e:
-            log(config, f"DB error: {e}. Reconnecting in 5s.")
-            if speaker is not None and not network_alerted:
-                log(config, "Enqueueing network_lost (DB error).")
-                try:
-                    speaker.enqueue("network_lost")
-                except Exception as ex:
-                    log(config, f"Failed to enqueue network_lost (DB error): {ex}")
-                network_alerted = True
+            self._commit(self.offset, new_offset, batch, inserted)
+            self.offset = new_offset
+            flush_status.record_flush(self.offset, ok, batch[-1].EntryNo)
+            metrics.FLUSH_BATCH_SIZE.observe(len(batch))
+            metrics.FLUSHED_ROWS.inc(ok)
+            metrics.SKIPPED_ROWS.inc(len(batch) - ok)
+            _observe_commit_latency(inserted, time.time())
+            log(config, f"DB flush row-by-row: inserted {ok}/{len(batch)}. offset={self.offset}",
+                batch_size=len(batch), inserted=ok, offset=self.offset)
+            return FLUSHED
+        except Exception as e2:
+            log(config, f"DB row-by-row failed: {e2}")
+            metrics.DB_ERRORS.labels("row_by_row").inc()
             try:
-                conn.rollback()
-                conn.close()
+                self.conn.rollback()
             except Exception:
                 pass
-            conn = None
-            time.sleep(5)
+            return FAILED
 
-        except Exception as e:
-            log(config, f"DB worker error: {e}")
-            time.sleep(5)
+    def _archive_rotations(self) -> None:
+        """Hand rotated spools to the archive thread, unless it is busy; retry failures after ARCHIVE_RETRY_SEC."""
+        if self._archiving is not None:
+            if not self._archiving.done():
+                return
+            if not self._archiving.result():
+                self._archive_retry_at = time.monotonic() + ARCHIVE_RETRY_SEC
+                self._archive_due = True
+            self._archiving = None
+        if not self._archive_due or time.monotonic() < self._archive_retry_at:
+            return
+        self._archive_due = False
+        paths = rotated_spools(self.config)
+        if not paths:
+            return
+        if self._archiver is None:
+            self._archiver = ThreadPoolExecutor(1, thread_name_prefix="archive")
+        self._archiving = self._archiver.submit(archive_rotated_spools, self.config, paths)
 
-    if conn is not None:
+    def close(self) -> None:
+        if self.lane is not None:
+            self.lane.stop()
+        if self._archiver is not None:
+            # A running archive finishes before the process exits; rotated files not reached yet wait for the next start.
+            self._archiver.shutdown(wait=False, cancel_futures=True)
         try:
-            conn.commit()
-            conn.close()
-        except Exception:
-            pass
+            self.ckpt.save(self.config, force=True)
+        except OSError as e:
+            log(self.config, f"Checkpoint not saved at shutdown: {e}")
+        if self.conn is not None:
+            try:
+                self.conn.commit()
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+def db_flush_worker(config: Config, speaker=None, connectivity=None) -> None:
+    """Thread form of SpoolFlusher, for tools and the benchmarks; the service and the UI run it from runtime.py."""
+    flusher = SpoolFlusher(config, speaker, connectivity)
+    try:
+        while not stop_event.is_set():
+            outcome = flusher.step()
+            if outcome == OFFLINE:
+                flusher.connectivity.wait_reachable(5)
+            elif outcome == FAILED:
+                stop_event.wait(5)
+            else:
+                stop_event.wait(flusher.config.flush_interval)
+    finally:
+        flusher.close()
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from config_utils import Config
+
+logger = logging.getLogger("startup_timing")
+
+
+def _process_start_monotonic() -> float:
+    """
+    Monotonic timestamp of process creation, so interpreter start-up and module
+    imports are part of the measured cold start. Falls back to "now" when
+    /proc is unavailable.
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        started_ago = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.monotonic() - max(0.0, started_ago)
+    except Exception:
+        return time.monotonic()
+
+
+class StartupTimer:
+    """Records the monotonic time each start-up phase completed."""
+
+    def __init__(self):
+        self.origin = _process_start_monotonic()
+        self.phases: list[tuple[str, float]] = []
+        self._lock = threading.Lock()
+        self._seen: set[str] = set()
+
+    def mark(self, phase: str) -> bool:
+        """Record `phase` once; later marks of the same phase are ignored."""
+        with self._lock:
+            if phase in self._seen:
+                return False
+            self._seen.add(phase)
+            self.phases.append((phase, time.monotonic()))
+            return True
+
+    def elapsed_ms(self, phase: str) -> float | None:
+        for name, at in self.phases:
+            if name == phase:
+                return (at - self.origin) * 1000
+        return None
+
+    def report(self) -> dict:
+        with self._lock:
+            phases = list(self.phases)
+        out = []
+        prev = self.origin
+        for name, at in phases:
+            out.append({
+                "phase": name,
+                "since_start_ms": round((at - self.origin) * 1000, 1),
+                "duration_ms": round((at - prev) * 1000, 1),
+            })
+            prev = at
+        return {"pid": os.getpid(), "wall_time": time.time(), "phases": out}
+
+
+timer = StartupTimer()
+
+# Phase -> the Config field holding its budget in ms from process start.
+BUDGETS = {"capture_ready": "startup_budget_ms", "first_scan": "first_scan_budget_ms"}
+
+
+def mark(phase: str) -> None:
+    timer.mark(phase)
+
+
+def report_startup(config: Config, phase: str) -> None:
+    """
+    Log the per-phase report once `phase` has been reached, warn when it took
+    longer than its budget (startup_budget_ms for capture_ready,
+    first_scan_budget_ms for first_scan), and append it to startup_report_file.
+    """
+    if not timer.mark(phase):
+        return
+    report = timer.report()
+    elapsed = timer.elapsed_ms(phase)
+    summary = ", ".join(f"{p['phase']}=+{p['duration_ms']}ms" for p in report["phases"])
+    logger.info("Startup reached %s in %.1fms (%s)", phase, elapsed, summary)
+
+    budget = getattr(config, BUDGETS[phase]) if phase in BUDGETS else None
+    if budget is not None and elapsed > budget:
+        logger.warning("Startup over budget: %s took %.1fms (budget %sms)", phase, elapsed, budget)
+
+    report_file = config.startup_report_file
+    if report_file:
+        try:
+            os.makedirs(os.path.dirname(report_file), exist_ok=True)
+            with open(report_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"reached": phase, **report}) + "\n")
+        except OSError as e:
+            logger.error("Failed to write startup report: %s", e)
@@ -0,0 +1,227 @@
+"""
+Optional multi-process layout, enabled with "process_mode": "multi".
+
+    supervisor --+-- capture   evdev -> ScanPipeline -> spool (fsync)
+                 +-- flusher   spool -> SQL Server, probes, reconcile, master data, metrics
+                 +-- alerts    voice alerts
+
+Capture shares no interpreter, GIL or driver with the DB side, so a pyodbc
+call blocked for the whole connection timeout cannot delay evdev reads. The
+spool file is the hand-off between capture and flusher: it is already
+durable and ordered, and the flusher resumes from its saved offset after a
+restart. Alert events travel over a bounded multiprocessing queue, and child
+log records are forwarded to the supervisor, the only writer of the log file.
+
+Each child is restarted on its own with exponential backoff when it exits.
+In this mode the metrics endpoint is served by the flusher, so capture-side
+counters (scans, spool latency) are not exported.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import threading
+import time
+
+import diagnostics
+import flight_summary
+import io_accounting
+import log_config
+import metrics
+from config_utils import config_path, load_config
+from sql_connection import stop_event
+
+logger = logging.getLogger("supervisor")
+
+RESTART_MIN_SEC = 1.0
+RESTART_MAX_SEC = 30.0
+# A child that ran this long before exiting restarts without backoff.
+STABLE_AFTER_SEC = 60.0
+ALERT_QUEUE_SIZE = 100
+
+
+class AlertSender:
+    """Stands in for SpeakerService in processes that do not play audio."""
+
+    def __init__(self, alert_queue):
+        self.alert_queue = alert_queue
+
+    def enqueue(self, event_name: str) -> None:
+        try:
+            self.alert_queue.put_nowait(event_name)
+        except queue.Full:
+            logger.warning("Alert queue full; dropped event=%s", event_name)
+
+    def on_connectivity_change(self, old_state: str, new_state: str, reason: str) -> None:
+        if new_state == "offline":
+            self.enqueue("network_lost")
+
+
+def _child_setup(name: str, path: str, log_queue):
+    log_config.forward_logging(log_queue)
+    config = load_config(path)
+    # The supervisor owns Ctrl-C; children stop on SIGTERM from it (or systemd).
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    # Each process counts and reports its own writes (capture the spool, flusher
+    # the checkpoint); its runtime watches the config file and logs the report.
+    diagnostics.register_status("io", io_accounting.snapshot)
+    diagnostics.install(config, name, signals=False)
+    logger.info("%s process started", name)
+    return config
+
+
+def capture_main(path: str, log_queue, alert_queue) -> None:
+    config = _child_setup("capture", path, log_queue)
+    import runtime
+    import scan_stats
+
+    diagnostics.register_status("scanners", scan_stats.stats.status)
+
+    raise SystemExit(runtime.run(config, capture=True, alerts=AlertSender(alert_queue), config_file=path))
+
+
+def flusher_main(path: str, log_queue, alert_queue) -> None:
+    config = _child_setup("flusher", path, log_queue)
+    import runtime
+    from connectivity import ConnectivityMonitor
+    from sql_connection import flush_status
+
+    alerts = AlertSender(alert_queue)
+    connectivity = ConnectivityMonitor(config)
+    connectivity.subscribe(alerts.on_connectivity_change)
+    connectivity.subscribe(metrics.on_connectivity_change)
+    metrics.start_metrics_server(config)
+    diagnostics.register_status("connectivity", lambda: connectivity.state)
+    diagnostics.register_status("rows_flushed", lambda: flush_status.rows_flushed)
+    diagnostics.register_status("flight_totals", flight_summary.totals.status)
+
+    raise SystemExit(runtime.run(config, flush=True, alerts=alerts, connectivity=connectivity, config_file=path))
+
+
+def alerts_main(path: str, log_queue, alert_queue) -> None:
+    config = _child_setup("alerts", path, log_queue)
+    import runtime
+    from speaker import SpeakerService
+
+    speaker = SpeakerService(config, stop_event)
+    raise SystemExit(runtime.run(config, speaker=speaker, alert_queue=alert_queue, config_file=path))
+
+
+class ChildProcess:
+    def __init__(self, name: str, target, args: tuple):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.restarts = 0
+
+    def start(self, ctx) -> None:
+        self.process = ctx.Process(target=self.target, args=self.args, name=self.name, daemon=False)
+        self.process.start()
+        self.started_at = time.monotonic()
+        logger.info("Started %s (pid %s)", self.name, self.process.pid)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    """Starts the capture, flusher and alerts processes and restarts each one independently."""
+
+    def __init__(self, path: str, log_queue):
+        # spawn, not fork: children must not inherit the supervisor's threads or locks.
+        self.ctx = multiprocessing.get_context("spawn")
+        self.alert_queue = self.ctx.Queue(maxsize=ALERT_QUEUE_SIZE)
+        args = (path, log_queue, self.alert_queue)
+        # Capture first so scanning is up before the DB side imports its driver.
+        self.children = [
+            ChildProcess("capture", capture_main, args),
+            ChildProcess("flusher", flusher_main, args),
+            ChildProcess("alerts", alerts_main, args),
+        ]
+        self._stopping = threading.Event()
+        # request_stop() runs in a signal handler; a byte on this pipe wakes run().
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+
+    def status(self) -> dict:
+        return {c.name: {"pid": c.process.pid if c.process else None, "alive": c.is_alive(),
+                         "restarts": c.restarts} for c in self.children}
+
+    def request_stop(self) -> None:
+        self._stopping.set()
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        """Sleep until a child exits, a restart is due or a stop is requested; no polling."""
+        for child in self.children:
+            child.start(self.ctx)
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for child in self.children:
+                if child.is_alive():
+                    continue
+                if child.restart_at == 0.0:
+                    ran = now - child.started_at
+                    child.failures = 0 if ran >= STABLE_AFTER_SEC else child.failures + 1
+                    delay = min(RESTART_MAX_SEC, RESTART_MIN_SEC * 2 ** child.failures) if child.failures else 0.0
+                    child.restart_at = now + delay
+                    logger.error("%s exited with code %s after %.0fs; restarting in %.0fs",
+                                 child.name, child.process.exitcode, ran, delay)
+                if now >= child.restart_at:
+                    child.restart_at = 0.0
+                    child.restarts += 1
+                    child.start(self.ctx)
+            due = [c.restart_at for c in self.children if c.restart_at]
+            timeout = max(0.0, min(due) - time.monotonic()) if due else None
+            sentinels = [c.process.sentinel for c in self.children if c.is_alive()]
+            multiprocessing.connection.wait(sentinels + [self._wake_r], timeout)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.request_stop()
+        for child in self.children:
+            if child.is_alive():
+                child.process.terminate()
+        deadline = time.monotonic() + timeout
+        for child in self.children:
+            if child.process is None:
+                continue
+            child.process.join(max(0.0, deadline - time.monotonic()))
+            if child.process.is_alive():
+                logger.warning("%s did not stop; killing", child.name)
+                child.process.kill()
+                child.process.join(1)
+
+
+def run_supervisor(path: str | None = None) -> None:
+    path = config_path(path)
+    config = load_config(path)
+    log_queue = multiprocessing.get_context("spawn").Queue(maxsize=config.log_queue_size)
+    log_config.setup_logging(config, log_queue)
+
+    supervisor = Supervisor(path, log_queue)
+    signal.signal(signal.SIGTERM, lambda *_: supervisor.request_stop())
+    diagnostics.register_status("processes", supervisor.status)
+    # The supervisor writes the log file for every child.
+    threading.Thread(target=io_accounting.io_report_worker, args=(config, stop_event), name="io_report",
+                     daemon=True).start()
+    diagnostics.register_status("io", io_accounting.snapshot)
+    diagnostics.install(config, "supervisor")
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Stopping child processes...")
+        stop_event.set()
+        supervisor.stop()
+        log_config.shutdown_logging()
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_utils import compile_config  # noqa: E402
+from scan_record import ScanRecord  # noqa: E402
+
+
+def make_record(entry_no: int) -> ScanRecord:
+    return ScanRecord(DeviceID="T", ScannerName="s", EntryNo=entry_no, Barcode=f"B{entry_no}",
+                      ScanDate="2025-01-01", ScanTime="10:00:00", UserID="u")
+
+
+def write_spool(path, entry_nos, torn: str = "") -> list:
+    """Append records to the spool, then `torn` without a newline; returns each line's [start, end)."""
+    bounds = []
+    with open(path, "ab") as f:
+        for entry_no in entry_nos:
+            start = f.tell()
+            f.write(make_record(entry_no).to_spool_line().encode("utf-8"))
+            bounds.append((start, f.tell()))
+        f.write(torn.encode("utf-8"))
+    return bounds
+
+
+@pytest.fixture
+def config(tmp_path):
+    return compile_config({
+        "Device_id": "T",
+        "Table_name": "T_Data",
+        "spool_file": str(tmp_path / "spool.jsonl"),
+        "spool_offset_file": str(tmp_path / "spool.offset"),
+        "state_file": str(tmp_path / "state.json"),
+        "checkpoint_interval_sec": 3600,
+    })
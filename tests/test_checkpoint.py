@@ -0,0 +1,137 @@
+import json
+import os
+
+import checkpoint
+from conftest import write_spool
+from sql_connection import read_spool_ranges
+
+
+def _write_record(config, record):
+    with open(config.spool_offset_file, "w", encoding="utf-8") as f:
+        json.dump(record, f)
+
+
+def test_rule4_done_ranges_fold_into_the_offset(config):
+    bounds = write_spool(config.spool_file, range(1, 6))
+    ckpt = checkpoint.Checkpoint(config)
+    ckpt.commit(bounds[2][0], bounds[3][1], 4)
+    assert ckpt.offset == 0
+    assert list(ckpt.done) == [(bounds[2][0], bounds[3][1] - 1)]
+    assert ckpt.committed(*bounds[3]) and not ckpt.committed(*bounds[1])
+    assert ckpt.resume_point == bounds[3][1]
+
+    ckpt.commit(bounds[0][0], bounds[1][1], 2)
+    assert ckpt.offset == bounds[3][1]
+    assert not ckpt.done
+    assert ckpt.next_entry_no == 5
+
+
+def test_saved_ranges_resume(config):
+    bounds = write_spool(config.spool_file, range(1, 6))
+    ckpt = checkpoint.Checkpoint(config)
+    ckpt.commit(*bounds[0], 1)
+    ckpt.commit(*bounds[3], 4)
+    assert ckpt.save(config, force=True)
+
+    resumed = checkpoint.Checkpoint(config)
+    assert resumed.offset == bounds[0][1]
+    assert list(resumed.done) == [(bounds[3][0], bounds[3][1] - 1)]
+    assert resumed.next_entry_no == 5
+    assert not resumed.pending
+
+
+def test_save_waits_for_the_interval(config):
+    bounds = write_spool(config.spool_file, range(1, 3))
+    ckpt = checkpoint.Checkpoint(config)
+    ckpt.commit(*bounds[0], 1)
+    assert ckpt.save(config, force=True)
+    ckpt.commit(*bounds[1], 2)
+    assert not ckpt.save(config)
+    assert ckpt.pending
+    assert checkpoint.read_checkpoint(config)["offset"] == bounds[0][1]
+
+
+def test_rule1_uncounted_ranges(config):
+    bounds = write_spool(config.spool_file, range(1, 6))
+    ckpt = checkpoint.Checkpoint(config)
+    ckpt.commit(*bounds[0], 1)
+    position = ckpt.position()
+    ckpt.commit(*bounds[1], 2)
+    ckpt.commit(*bounds[3], 4)
+    assert list(ckpt.uncounted(position)) == [(bounds[1][0], bounds[1][1] - 1), (bounds[3][0], bounds[3][1] - 1)]
+    assert not ckpt.uncounted(ckpt.position())
+    assert not ckpt.uncounted(None)
+
+    # Totals saved before the last rotation counted all of the old spool.
+    ckpt.reset(0)
+    ckpt.commit(*bounds[0], 1)
+    assert list(ckpt.uncounted(position)) == [(bounds[0][0], bounds[0][1] - 1)]
+
+
+def test_rule2_inode_change_after_rotation(config):
+    bounds = write_spool(config.spool_file, range(1, 6))
+    ckpt = checkpoint.Checkpoint(config)
+    ckpt.commit(*bounds[0], 1)
+    ckpt.commit(*bounds[2], 3)
+    ckpt.save(config, force=True)
+
+    # Rotated away and replaced by a spool of the same size: the offset fits, the inode does not.
+    os.rename(config.spool_file, config.spool_file + ".20250101-000000")
+    write_spool(config.spool_file, range(6, 11))
+    resumed = checkpoint.Checkpoint(config)
+    assert resumed.offset == 0
+    assert not resumed.done
+    assert resumed.resume_point == 0
+
+
+def test_rule2_offset_past_the_end(config):
+    write_spool(config.spool_file, range(1, 3))
+    _write_record(config, {"offset": os.path.getsize(config.spool_file) + 100})
+    assert checkpoint.resume_offset(config) == 0
+
+
+def test_rule3_missing_legacy_or_unreadable_checkpoint(config):
+    bounds = write_spool(config.spool_file, range(1, 4))
+    assert checkpoint.Checkpoint(config).offset == 0
+
+    with open(config.spool_offset_file, "w") as f:
+        f.write(str(bounds[1][1]))
+    assert checkpoint.Checkpoint(config).offset == bounds[1][1]
+
+    with open(config.spool_offset_file, "w") as f:
+        f.write("{not json")
+    assert checkpoint.Checkpoint(config).offset == 0
+
+
+def test_rule2_ranges_past_the_end_are_dropped(config):
+    bounds = write_spool(config.spool_file, range(1, 4))
+    _write_record(config, {"offset": 0, "done": [[bounds[1][0], bounds[2][1] + 50]],
+                           "spool_inode": os.stat(config.spool_file).st_ino})
+    assert not checkpoint.Checkpoint(config).done
+
+
+def test_resume_with_a_partial_trailing_line(config):
+    torn = '["T","s",4,"B4"'
+    bounds = write_spool(config.spool_file, range(1, 4), torn=torn)
+    entries, pos = read_spool_ranges(config.spool_file, 0)
+    assert [rec.EntryNo for _, _, rec in entries] == [1, 2, 3]
+    assert pos == bounds[-1][1]
+    assert checkpoint.last_spooled_entry_no(config.spool_file) == 3
+
+    # Once the line is finished it is read from where the last read stopped.
+    with open(config.spool_file, "a") as f:
+        f.write(',"2025-01-01","10:00:00","u"]\n')
+    entries, _ = read_spool_ranges(config.spool_file, pos)
+    assert [rec.EntryNo for _, _, rec in entries] == [4]
+
+
+def test_rule5_next_entry_no(config):
+    write_spool(config.spool_file, range(1, 4), torn='["T","s",99')
+    assert checkpoint.recover_next_entry_no(config) == 4
+
+    _write_record(config, {"offset": 0, "next_entry_no": 10})
+    assert checkpoint.recover_next_entry_no(config) == 10
+
+    with open(config.state_file, "w") as f:
+        json.dump({"last_entry_no": 20}, f)
+    assert checkpoint.recover_next_entry_no(config) == 20
@@ -0,0 +1,41 @@
+from intervals import IntervalSet
+
+
+def test_overlapping_and_adjacent_ranges_merge():
+    s = IntervalSet([(10, 20), (15, 30), (31, 35), (40, 45)])
+    assert list(s) == [(10, 35), (40, 45)]
+    assert len(s) == 26 + 6
+
+
+def test_add_bridges_ranges():
+    s = IntervalSet([(0, 9), (20, 29)])
+    s.add(5, 24)
+    assert list(s) == [(0, 29)]
+    s.add(31, 40)
+    assert list(s) == [(0, 29), (31, 40)]
+    s.add(30, 30)
+    assert list(s) == [(0, 40)]
+
+
+def test_subtract_overlapping_ranges():
+    s = IntervalSet([(0, 99), (200, 299)])
+    t = IntervalSet([(-5, 9), (50, 59), (90, 209), (250, 400)])
+    assert list(s - t) == [(10, 49), (60, 89), (210, 249)]
+    assert list(s - IntervalSet()) == list(s)
+    assert not s - s
+
+
+def test_intersection():
+    s = IntervalSet([(0, 99), (200, 299)])
+    t = IntervalSet([(50, 249)])
+    assert list(s & t) == [(50, 99), (200, 249)]
+    assert not s & IntervalSet([(100, 199)])
+
+
+def test_membership_and_cover():
+    s = IntervalSet.from_values([7, 3, 4, 5, 9, 5])
+    assert list(s) == [(3, 5), (7, 7), (9, 9)]
+    assert 4 in s and 6 not in s and 2 not in s
+    assert s.covers(3, 5)
+    assert not s.covers(3, 7)
+    assert not s.covers(8, 9)
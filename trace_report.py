@@ -0,0 +1,124 @@
+"""
+Latency percentiles per device and pipeline stage from scan traces.
+
+Reads the trace side table (trace_table / trace_enabled in config.json), or
+with --spool the local spool file, which only covers the stages up to the
+spool write. Either way only scans captured with tracing on carry stamps.
+
+    python trace_report.py --from 2026-10-01 --to 2026-10-02
+    python trace_report.py --spool --device PI-01
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import scan_trace
+from config_utils import Config, load_config
+from scan_record import ScanRecord
+from sql_connection import _quote_table_name, connect_db, trace_table_name
+
+PERCENTILES = (50, 90, 99)
+
+
+def _parse_day(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def traces_from_db(config: Config, start: datetime, end: datetime, device: str | None):
+    table = config.table_name
+    trace_table = trace_table_name(config)
+    if not trace_table:
+        raise SystemExit("Tracing to the DB is off: set trace_table or trace_enabled=1 in config.json.")
+
+    sql = f"""
+        SELECT DeviceID, BootID, FirstKeyNs, EnterNs, SpoolNs, DurableNs, FlushReadNs, CommitNs
+        FROM {_quote_table_name(trace_table)}
+        WHERE CommittedAt >= ? AND CommittedAt < ?"""
+    params = [start, end]
+    if device:
+        sql += " AND DeviceID = ?"
+        params.append(device)
+
+    conn = connect_db(config)
+    if conn is None:
+        raise SystemExit("DB connection failed.")
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, *params)
+        for row in cur.fetchall():
+            yield row[0], dict(zip(("boot",) + scan_trace.STAGES, row[1:]))
+    finally:
+        conn.close()
+
+
+def traces_from_spool(config: Config, start: datetime, end: datetime, device: str | None):
+    spool_path = config.spool_file
+    with open(spool_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = ScanRecord.from_spool_line(line)
+                scanned_at = datetime.fromisoformat(f"{rec.ScanDate}T{rec.ScanTime}")
+            except (ValueError, TypeError):
+                continue
+            trace = rec.Trace
+            if not trace or not (start <= scanned_at < end):
+                continue
+            if device and rec.DeviceID != device:
+                continue
+            yield rec.DeviceID, trace
+
+
+def summarize(traces) -> dict:
+    """{device: {stage: {"count", "p50", "p90", "p99", "max"}}} in milliseconds."""
+    samples = defaultdict(lambda: defaultdict(list))
+    for device, trace in traces:
+        for stage, seconds in scan_trace.stage_durations(trace).items():
+            samples[device][stage].append(seconds * 1000)
+
+    out = {}
+    for device, stages in samples.items():
+        out[device] = {}
+        for stage, values in stages.items():
+            values.sort()
+            row = {"count": len(values), "max": round(values[-1], 3)}
+            for pct in PERCENTILES:
+                row[f"p{pct}"] = round(scan_trace.percentile(values, pct), 3)
+            out[device][stage] = row
+    return out
+
+
+def _print_table(summary: dict) -> None:
+    order = list(scan_trace.STAGE_LABELS.values())
+    header = f"{'device':<16}{'stage':<24}{'count':>8}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'max':>10}"
+    print(header)
+    for device in sorted(summary, key=str):
+        stages = summary[device]
+        for stage in sorted(stages, key=order.index):
+            row = stages[stage]
+            print(f"{str(device):<16}{stage:<24}{row['count']:>8}"
+                  + "".join(f"{row['p' + str(p)]:>10.2f}" for p in PERCENTILES)
+                  + f"{row['max']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan latency percentiles per device and stage (ms).")
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    parser.add_argument("--from", dest="start", type=_parse_day, default=today)
+    parser.add_argument("--to", dest="end", type=_parse_day, default=today + timedelta(days=1))
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--spool", action="store_true", help="read the local spool instead of the DB")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args()
+
+    config = load_config()
+    source = traces_from_spool if args.spool else traces_from_db
+    summary = summarize(source(config, args.start, args.end, args.device))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        _print_table(summary)
+
+
+if __name__ == "__main__":
+    main()